@@ -6,8 +6,8 @@ import seaborn as sns
 from IPython.display import clear_output
 from finance_tools_py.backtest import BackTest
 from finance_tools_py.simulation.callbacks import CallBack
-from finance_tools_py.simulation.callbacks.talib import ATR
 from finance_tools_py.simulation import Simulation
+from finance_tools_py.simulation.cache import IndicatorCache
 from finance_tools_py.backtest import Utils
 import datetime
 from finance_tools_py.backtest import TurtleStrategy
@@ -16,8 +16,9 @@ from tqdm.auto import tqdm
 import empyrical
 import warnings
 import copy
-from finance_tools_py.calc import fluidity
-from finance_tools_py.calc import position_unit
+from finance_tools_py.panel import Panel
+from finance_tools_py.walkforward import WalkForward
+from finance_tools_py.walkforward import backtest_year
 
 plt.rcParams['font.family'] = 'SimHei'
 
@@ -764,6 +765,22 @@ def plot_basic_seaborn(symbol, data=None, ys=[], **kwargs):
 #     return fig
 
 
+def _show_year(bt, show_report, show_plot, show_history):
+    """显示一个年度的回测报告及胜率、盈亏比图表"""
+    if show_report:
+        print(bt.report(show_history=show_history))
+    if show_report or show_plot:
+        rp = bt.profit_loss_df()
+    if show_report:
+        print(rp)
+    if show_plot:
+        fig, axes = plt.subplots(1, 2, figsize=(10, 3))
+        Utils.plt_win_rate(rp, ax=axes[0])
+        Utils.plt_pnl_ratio(rp, ax=axes[1])
+        plt.gcf().autofmt_xdate()
+        plt.show()
+
+
 def all_years_single_symbol(symbol,
                             fulldata,
                             cbs,
@@ -778,11 +795,12 @@ def all_years_single_symbol(symbol,
                             **kwargs):
     """逐年度对单一股票进行回测。
 
-    采用 :py:class:`finance_tools_py.backtest.TurtleStrategy` 进行回测
+    采用 :py:class:`finance_tools_py.backtest.TurtleStrategy` 进行回测，
+    每个年度的回测参考 :py:func:`finance_tools_py.walkforward.backtest_year` 。
 
     Args:
         fulldata (:py:class:`pandas.DataFrame`): 完整的原始数据。
-            index[0]为股票代码,index[1]为日期。
+            index[0]为股票代码,index[1]为日期。也可以传入 :py:class:`finance_tools_py.panel.Panel` 。
         init_cash:
         start_year (int): 开始计算年份。
         end_year (int): 结束计算年份。
@@ -798,104 +816,36 @@ def all_years_single_symbol(symbol,
 
         - dict: 卖点字典。key值为年份。
     """
-    hold = pd.DataFrame()
     report = {}
     datas = {}
     buys = {}
     sells = {}
     h = {}
-    tb_kwgs_copy = copy.deepcopy(tb_kwgs)
 
+    panel = fulldata if isinstance(fulldata, Panel) else Panel(fulldata)
     for year in tqdm(range(start_year, end_year)):
-        df_symbol_year = fulldata[
-            (fulldata.index.get_level_values(0) == symbol)
-            & (fulldata.index.get_level_values(1) <= '{}-12-31'.format(year))]
-        s = Simulation(df_symbol_year.reset_index(), symbol, callbacks=cbs)
+        df_symbol_year = panel.slice(symbol, None, datetime.date(year, 12, 31))
+        s = Simulation(df_symbol_year,
+                       symbol,
+                       callbacks=cbs,
+                       copy=False)
         s.simulate()
         df_symbol_years = s.data
-        df_symbol_years.sort_values('date', inplace=True)
-        # 遍历股票，对每支股票进行数据处理-结束
-
-        buy_dict = df_symbol_years[df_symbol_years['opt'] == 1].reset_index(
-        ).groupby('code')['date'].apply(
-            lambda x: x.dt.to_pydatetime()).to_dict()
-
-        sell_dict = df_symbol_years[df_symbol_years['opt'] == 0].reset_index(
-        ).groupby('code')['date'].apply(
-            lambda x: x.dt.to_pydatetime()).to_dict()
-
-        buys[year] = buy_dict
-        sells[year] = sell_dict
-
-        df_symbol_years = df_symbol_years[
-            df_symbol_years['date'] >= '{}-01-01'.format(year)]
-
-        datas[year] = df_symbol_years
-
-        if verbose == 2:
-            print('起止日期:{:%Y-%m-%d}~{:%Y-%m-%d}'.format(
-                min(df_symbol_years['date']), max(df_symbol_years['date'])))
-            #     print('数据量:{}'.format(len(df_symbol_years)))
-
-        ts = TurtleStrategy(buy_dict=buy_dict,
-                            sell_dict=sell_dict,
-                            holds=h,
-                            **tb_kwgs_copy)
-        bt = BackTest(df_symbol_years,
-                      init_cash=init_cash,
-                      init_hold=hold,
-                      live_start_date=datetime.datetime(year, 1, 1),
-                      callbacks=[ts])
-        bt.calc_trade_history(verbose=2)
+        df_symbol_years.sort_values('date', kind='mergesort', inplace=True)
+
+        bt, h, buys[year], sells[year], datas[year] = backtest_year(
+            df_symbol_years,
+            year,
+            h,
+            init_cash,
+            copy.deepcopy(tb_kwgs),
+            verbose=verbose)
         report[year] = bt
-
-        h = ts.holds
-        if h:
-            hs = []
-            for k, v in h.items():
-                for v1 in v:
-                    hs.append(
-                        pd.DataFrame({
-                            'code': [k],
-                            'amount': [v1.amount],
-                            'price': [v1.price],
-                            'buy_date': [v1.date],
-                            'stoploss_price': [v1.stoploss_price],
-                            'stopprofit_price': [v1.stopprofit_price],
-                            'next_price': [v1.next_price],
-                        }))
-            hold = pd.concat(hs) if hs else pd.DataFrame()
-
         init_cash = bt.available_cash
-        if show_report:
-            print(bt.report(show_history=show_history))
-        if show_report or show_plot:
-            rp = bt.profit_loss_df()
-        if show_report:
-            print(rp)
-        if show_plot:
-            fig, axes = plt.subplots(1, 2, figsize=(10, 3))
-            Utils.plt_win_rate(rp, ax=axes[0])
-            Utils.plt_pnl_ratio(rp, ax=axes[1])
-            plt.gcf().autofmt_xdate()
-            plt.show()
+        _show_year(bt, show_report, show_plot, show_history)
     return report, datas, buys, sells
 
 
-class _cache():
-    def __init__(self, symbol, start=None, end=None):
-        self.symbol = symbol
-        self.start = start
-        self.end = end
-
-    def __hash__(self):
-        return self.symbol.__hash__() ^ self.start.__hash__(
-        ) ^ self.end.__hash__()
-
-    def __eq__(self, other):
-        return self.symbol == other.symbol and self.start == other.start and self.end == other.end
-
-
 def all_years(fulldata,
               cbs,
               init_cash=10000,
@@ -911,11 +861,11 @@ def all_years(fulldata,
               **kwargs):
     """逐年度对流动性最大的n支股票进行回测。
 
-    采用 :py:class:`finance_tools_py.backtest.TurtleStrategy` 进行回测
+    使用 :py:class:`finance_tools_py.walkforward.WalkForward` 进行计算，这里只负责显示每个年度的回测报告及图表。
 
     Args:
         fulldata (:py:class:`pandas.DataFrame`): 完整的原始数据。
-            index[0]为股票代码,index[1]为日期。
+            index[0]为股票代码,index[1]为日期。也可以传入 :py:class:`finance_tools_py.panel.Panel` 。
         init_cash:
         top (int): 选取流动性最大的n值股票。默认为10。
             流动性计算参考 :py:func:`finance_tools_py.calc.fluidity`
@@ -928,8 +878,15 @@ def all_years(fulldata,
         fixed_unit (bool): 是否使用固定金额（init_cash）作为计算头寸单元的标的。默认为True。
             如果为False的话，会在每年开始时，使用上一年度的总资产（:py:attr:`finance_tools_py.backtest.BackTest.total_assets_cur`）结合`unit_percent`进行运算。
             如果是第一年则使用`init_cash`结合`unit_percent`进行运算。
+        cache (:py:class:`finance_tools_py.simulation.cache.IndicatorCache`): 回调计算结果的缓存。
+            默认在每次调用时创建新的缓存，计算头寸单位时的ATR(20)与 `cbs` 中相同参数的回调共享计算结果。
+            传入带有 `cache_dir` 的缓存可以在多次调用之间复用计算结果。
+        n_jobs (int): 计算股票排名及指标时的进程数。默认为1。参考 :py:func:`finance_tools_py.walkforward.WalkForward.run` 。
+            每个年度回测完成后立即显示该年度的报告及图表。
 
     Returns:
+        - :py:class:`pandas.DataFrame`: 所有年度的损益表。
+
         - dict: BackTest字典。key值为年份。
 
         - dict: 回测用的数据源字典。key值为年份。
@@ -938,191 +895,35 @@ def all_years(fulldata,
 
         - dict: 卖点字典。key值为年份。
     """
-    hold = pd.DataFrame()
+    cache = kwargs.get('cache', None)
+    if cache is None:
+        cache = IndicatorCache()
+    wf = WalkForward(fulldata,
+                     cbs,
+                     start_year=start_year,
+                     end_year=end_year,
+                     lookback=lookback,
+                     top=top,
+                     tb_kwgs=tb_kwgs,
+                     unit_percent=kwargs.get('unit_percent', 0.01),
+                     fixed_unit=kwargs.get('fixed_unit', True),
+                     cache=cache)
+    if verbose == 2:
+        for look, year in wf.segments():
+            print(look, year)
     report = {}
     datas = {}
     buys = {}
     sells = {}
-    h = {}
-    tb_kwgs_copy = copy.deepcopy(tb_kwgs)
-    baseValue = init_cash * kwargs.get('unit_percent', 0.01)  #计算头寸单元时使用的基准
-    lookbacks = []
-    years = []
-    lookback = lookback - 1
-    for i in range(start_year, end_year):
-        if i + lookback + 1 <= end_year:
-            lookbacks.append([i, i + lookback])
-            years.append(i + lookback + 1)
-
-    if verbose == 2:
-        for lookback, year in zip(lookbacks, years):
-            print(lookback, year)
-
-    _top_dict = {}
-    _every_year_dict = {}
-
-    if 'symbol' not in fulldata.columns:
-        fulldata['symbol']=fulldata.index.get_level_values(0)
-    if 'datetime' not in fulldata.columns:
-        fulldata['datetime']=fulldata.index.get_level_values(1)
-
-    for look, year in tqdm(zip(lookbacks, years)):
-        # 取 year 年的n支流动性最大的股票-开始
-        year_df = fulldata[
-            (fulldata['datetime'] <= datetime.date(look[-1],12,31))
-            &
-            (fulldata['datetime'] >= datetime.date(look[0],1,1))]
-        #
-        # year_df = fluidity(year_df)
-        #
-        # #计算所有的头寸单元
-        # year_df.dropna(inplace=True)
-        # year_df['unit'] = year_df.apply(lambda row: int(position_unit(row['close'], row['atr_20'], baseValue)/100), axis=1)
-        # year_df=year_df[year_df['unit']>0]
-        # #计算所有的头寸单元
-        #
-        # top_year = year_df[:top] if top > 0 else year_df
-
-        tb_kwgs_copy['min_amount'] = {}
-        tb_kwgs_copy['max_amount'] = {}
-        top_year = []
-        for v in fluidity(year_df).index.values:
-            c = _cache(v)
-            _s_data = None
-            if c not in _top_dict or _top_dict[c] is None:
-                df_symbol = year_df[year_df['symbol'] == v]
-                s = Simulation(df_symbol.reset_index(), v,
-                               callbacks=[ATR(20)])  #TODO
-                s.simulate()
-                s.data.dropna(inplace=True)
-                _s_data = s.data.copy()
-                _top_dict[c] = _s_data.copy()
-            else:
-                _s_data = _top_dict[c]
-            if _s_data.empty:
-                continue
-            _s_data['unit'] = _s_data.apply(lambda row: position_unit(
-                row['close'], row[tb_kwgs_copy['colname']], baseValue),
-                                            axis=1)
-            m = int(_s_data.iloc[-1]['unit'] / 100) * 100
-            if m > 0:
-                tb_kwgs_copy['min_amount'][v] = m
-                tb_kwgs_copy['max_amount'][v] = m * 4
-                top_year.append(v)
-            else:
-                if verbose > 0:
-                    print('{}-根据时间 {:%Y-%m-%d}~{:%Y-%m-%d} 计算头寸单位大小为0'.format(
-                        v,
-                        year_df['datetime'][0],
-                        year_df['datetime'][-1]))
-            if len(top_year) >= top:
-                break
-
-        ls = list(
-            set(
-                list(top_year) +
-                list(hold['code'].unique() if not hold.empty else [])))
-        if not ls:
-            if verbose > 0:
-                print('{}无任何可跟踪的股票'.format(year))
-            continue
-
-        # 取 year 年的10支流动性最大的股票-结束
-        #     print('{}年的10支流动性最大的股票'.format(year))
-        # 遍历股票，对每支股票进行数据处理-开始
-        df_symbol_years = []
-        for symbol in ls:
-            c = _cache(symbol, look[0], year)
-            _s_data = None
-            if c not in _every_year_dict or _every_year_dict[c] is None:
-                df_symbol_year = fulldata[
-                    (fulldata['symbol'] == symbol)
-                    & (fulldata['datetime'] <= datetime.date(year,12,31))
-                    & (fulldata['datetime'] >= datetime.date(look[0],1,1))]
-                s = Simulation(df_symbol_year.reset_index(),
-                               symbol,
-                               callbacks=cbs)
-                s.simulate()
-                _s_data = s.data.copy()
-            else:
-                _s_data = _every_year_dict[c]
-            df_symbol_years.append(_s_data)
-        df_symbol_years = pd.concat(df_symbol_years)
-        df_symbol_years.sort_values('date', inplace=True)
-        # 遍历股票，对每支股票进行数据处理-结束
-
-        buy_dict = df_symbol_years[df_symbol_years['opt'] == 1].reset_index(
-        ).groupby('code')['date'].apply(
-            lambda x: x.dt.to_pydatetime()).to_dict()
-
-        sell_dict = df_symbol_years[df_symbol_years['opt'] == 0].reset_index(
-        ).groupby('code')['date'].apply(
-            lambda x: x.dt.to_pydatetime()).to_dict()
-
-        if not hold.empty:
-            for onlysell in set(hold['code'].to_list()).difference(
-                    set(top_year)):
-                if onlysell in buy_dict:
-                    del buy_dict[onlysell]
-
+    for year, bt, data, buy_dict, sell_dict in wf.iter_run(
+            init_cash=init_cash,
+            n_jobs=kwargs.get('n_jobs', 1),
+            verbose=verbose):
+        report[year] = bt
+        datas[year] = data
         buys[year] = buy_dict
         sells[year] = sell_dict
-
-        df_symbol_years = df_symbol_years[
-            df_symbol_years['date'] >= '{}-01-01'.format(year)]
-
-        datas[year] = df_symbol_years
-
-        if verbose == 2:
-            print('起止日期:{:%Y-%m-%d}~{:%Y-%m-%d}'.format(
-                min(df_symbol_years['date']), max(df_symbol_years['date'])))
-        #     print('数据量:{}'.format(len(df_symbol_years)))
-
-        ts = TurtleStrategy(buy_dict=buy_dict,
-                            sell_dict=sell_dict,
-                            holds=h,
-                            **tb_kwgs_copy)
-        bt = BackTest(df_symbol_years,
-                      init_cash=init_cash,
-                      init_hold=hold,
-                      live_start_date=datetime.datetime(year, 1, 1),
-                      callbacks=[ts])
-        bt.calc_trade_history(verbose=verbose)
-        report[year] = bt
-
-        if not kwargs.get('fixed_unit', True):
-            baseValue = bt.total_assets_cur * kwargs.get('unit_percent',
-                                                         0.01)  # 计算头寸单元时使用的基准
-
-        h = ts.holds
-        if h:
-            hs = []
-            for k, v in h.items():
-                for v1 in v:
-                    hs.append(
-                        pd.DataFrame({
-                            'code': [k],
-                            'amount': [v1.amount],
-                            'price': [v1.price],
-                            'buy_date': [v1.date],
-                            'stoploss_price': [v1.stoploss_price],
-                            'stopprofit_price': [v1.stopprofit_price],
-                            'next_price': [v1.next_price],
-                        }))
-            hold = pd.concat(hs) if hs else pd.DataFrame()
-
-        init_cash = bt.available_cash
-        if show_report:
-            print(bt.report(show_history=show_history))
-        if show_report or show_plot:
-            rp = bt.profit_loss_df()
-        if show_report:
-            print(rp)
-        if show_plot:
-            fig, axes = plt.subplots(1, 2, figsize=(10, 3))
-            Utils.plt_win_rate(rp, ax=axes[0])
-            Utils.plt_pnl_ratio(rp, ax=axes[1])
-            plt.gcf().autofmt_xdate()
-            plt.show()
-    df_profit = pd.concat([x.profit_loss_df() for x in report.values()])
+        _show_year(bt, show_report, show_plot, show_history)
+    df_profit = pd.concat([x.profit_loss_df() for x in report.values()
+                           ]) if report else pd.DataFrame()
     return df_profit, report, datas, buys, sells
@@ -0,0 +1,126 @@
+"""多进程计算工具。
+
+子进程通过进程池的初始化函数获取共享数据。支持 `fork` 的平台（Linux）上，子进程直接继承父进程中的共享数据（写时复制），
+不需要对共享数据进行序列化。其他平台（Windows、macOS）上使用 `spawn` 启动子进程，共享数据只会在父进程中序列化一次，
+每个子进程启动时反序列化，而不是随每个任务传递。此时计算函数及共享数据中的函数必须可以被序列化（模块级函数或其 `functools.partial` ，
+不能是 `lambda` 或函数内定义的函数），无法序列化时会给出警告并在当前进程中计算。
+"""
+import multiprocessing
+import os
+import pickle
+import warnings
+
+from tqdm.auto import tqdm
+
+_shared = None  # 子进程中的共享数据
+_start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods(
+) else 'spawn'
+
+
+def _init_shared(shared):
+    global _shared
+    _shared = shared
+
+
+def _load_shared(payload):
+    global _shared
+    _shared = pickle.loads(payload)
+
+
+def _dumps(func, shared):
+    """序列化计算函数及共享数据。无法序列化时给出警告并返回 `None` 。"""
+    try:
+        pickle.dumps(func)
+        return pickle.dumps(shared, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        warnings.warn('计算函数或共享数据无法序列化，在当前进程中计算。'
+                      '使用 {} 方式启动子进程时请使用模块级函数。({})'.format(
+                          _start_method, e))
+        return None
+
+
+def _call_shared(args):
+    func, task = args
+    return func(_shared, task)
+
+
+def cpu_count(n_jobs=None):
+    """计算实际使用的进程数。
+
+    Args:
+        n_jobs (int): 进程数。为 `None` 或小于等于0时使用所有的CPU核心。
+
+    Returns:
+        int: 进程数。
+    """
+    if n_jobs is None or n_jobs <= 0:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def map_shared(func, shared, tasks, n_jobs=1, chunksize=None, desc=None):
+    """在进程池中对每个任务调用 `func(shared, task)` ，按任务顺序返回结果。
+
+    Args:
+        func: 计算函数。必须是可以被序列化的模块级函数。
+        shared: 所有任务共享的数据。不支持 `fork` 的平台上需要可以被序列化。
+        tasks (list): 任务集合。
+        n_jobs (int): 进程数。为 `None` 或小于等于0时使用所有的CPU核心。为1时在当前进程中计算。默认为1。
+        chunksize (int): 每次分配给子进程的任务数量。默认根据任务数量及进程数计算。
+        desc (str): 进度条的描述文字。
+
+    Returns:
+        list: 计算结果集合，顺序与 `tasks` 一致。
+    """
+    return list(
+        imap_shared(func,
+                    shared,
+                    tasks,
+                    n_jobs=n_jobs,
+                    chunksize=chunksize,
+                    desc=desc))
+
+
+def imap_shared(func,
+                shared,
+                tasks,
+                n_jobs=1,
+                chunksize=None,
+                desc=None,
+                total=None):
+    """与 :py:func:`map_shared` 相同，但是以生成器的方式按任务顺序逐个返回结果。
+
+    调用方处理完一个结果后再读取下一个，不需要同时保存所有任务的计算结果。
+
+    Args:
+        total (int): 任务数量。为 `None` 时会先将 `tasks` 转换为 `list` 后计算。
+            传入时 `tasks` 可以是生成器。
+        其他参数参考 :py:func:`map_shared` 。
+
+    Yields:
+        计算结果，顺序与 `tasks` 一致。
+    """
+    if total is None:
+        tasks = list(tasks)
+        total = len(tasks)
+    n_jobs = min(cpu_count(n_jobs), total)
+    initializer, initargs = _init_shared, (shared, )
+    if n_jobs > 1 and _start_method != 'fork':
+        payload = _dumps(func, shared)
+        if payload is None:
+            n_jobs = 1
+        initializer, initargs = _load_shared, (payload, )
+    if n_jobs <= 1:
+        for task in tqdm(tasks, total=total, desc=desc):
+            yield func(shared, task)
+        return
+    if chunksize is None:
+        chunksize = max(1, total // (n_jobs * 4))
+    ctx = multiprocessing.get_context(_start_method)
+    with ctx.Pool(n_jobs, initializer=initializer,
+                  initargs=initargs) as pool:
+        yield from tqdm(pool.imap(_call_shared,
+                                  ((func, task) for task in tasks),
+                                  chunksize=chunksize),
+                        total=total,
+                        desc=desc)
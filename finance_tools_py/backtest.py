@@ -1,11 +1,17 @@
 import numpy as np
 import pandas as pd
 import datetime
+import heapq
+from collections import OrderedDict
+from collections import deque
+import functools
 import abc
 from tqdm.auto import tqdm
 import matplotlib.pyplot as plt
 import logging
 import statistics
+from finance_tools_py.calc import buy_cost, max_buy_amount
+from finance_tools_py.panel import Panel
 
 
 class CallBack():
@@ -97,6 +103,102 @@ class CallBack():
                 date, code, kwargs.pop('buy_price', -1),
                 kwargs.pop('sell_price', -1)))
 
+    def row_columns(self):
+        """回调中需要通过参数 `row` 读取的列名集合。
+
+        使用列式计算引擎（`engine='columnar'`）时，这些列会在计算开始前一次性读取。
+        未声明的列仍然可以读取，只是会在第一次访问时才加载。
+
+        Returns:
+            [str]: 列名集合。返回 `None` 表示未声明。
+        """
+        return None
+
+
+class _ColumnStore(dict):
+    """列式计算引擎使用的列缓存。key值为列名，value值为该列所有数据组成的 `list` 。
+
+    访问尚未加载的列时，会从数据源中读取并缓存。
+    """
+    def __init__(self, data, columns=()):
+        super().__init__()
+        self.data = data
+        for col in columns:
+            self[col]
+
+    def __missing__(self, key):
+        values = self.data[key].tolist()
+        self[key] = values
+        return values
+
+
+class _ColumnarRow():
+    """列式计算引擎中传递给回调的轻量数据行。
+
+    支持按列名取值及 `name` 、 `empty` 属性，与 :py:func:`pandas.DataFrame.iterrows` 返回的数据行用法一致。
+    """
+    __slots__ = ('_columns', '_pos')
+
+    def __init__(self, columns, pos):
+        self._columns = columns
+        self._pos = pos
+
+    def __getitem__(self, key):
+        return self._columns[key][self._pos]
+
+    def __contains__(self, key):
+        return key in self._columns.data.columns
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    @property
+    def name(self):
+        return self._columns.data.index[self._pos]
+
+    @property
+    def empty(self):
+        return len(self._columns.data.columns) == 0
+
+
+def _cached_by_version(func):
+    """按 :py:class:`BackTest` 的成交记录版本缓存计算结果。只有记录新的成交后才会重新计算。"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self):
+        key = (self._version, id(self.data))
+        cached = self._cache.get(name)
+        if cached is None or cached[0] != key:
+            cached = self._cache[name] = (key, func(self))
+        return cached[1]
+
+    return wrapper
+
+
+def _date_index(date_dict):
+    """将日期字典转换为以纳秒时间戳为元素的 `frozenset` 字典，用于 O(1) 判断日期是否包含在日期字典中。
+
+    Args:
+        date_dict ({str,[datetime.datetime]}): key值为股票代码，value值为日期集合。
+            日期集合可以是 `list` 、 `set` 、 :py:class:`numpy.ndarray` 、
+            :py:class:`pandas.DatetimeIndex` 或 :py:class:`pandas.Series` 。
+
+    Returns:
+        {str,frozenset}: key值为股票代码，value值为纳秒时间戳集合。
+    """
+    result = {}
+    for code, values in date_dict.items():
+        if isinstance(values, (set, frozenset)):
+            values = list(values)
+        result[code] = frozenset(pd.to_datetime(pd.Index(values)).asi8)
+    return result
+
+
+def _date_key(date):
+    """日期对应的纳秒时间戳"""
+    return pd.Timestamp(date).value
+
 
 class MinAmountChecker(CallBack):
     """每次买入和卖出数量都是最小数量（数量为 `min_amount` 定义）的回调。
@@ -149,6 +251,32 @@ class MinAmountChecker(CallBack):
         self.min_commission = kwargs.pop('min_commission', 5)
         self._min_amount = kwargs.pop('min_amount', {})
 
+    @property
+    def buy_dict(self):
+        """购买日期字典。key值为股票代码，value值为日期集合。
+
+        赋值时会同时建立日期索引，之后修改字典中的日期集合不会更新索引，需要重新赋值。
+        """
+        return self._buy_dict
+
+    @buy_dict.setter
+    def buy_dict(self, value):
+        self._buy_dict = value
+        self._buy_index = _date_index(value)
+
+    @property
+    def sell_dict(self):
+        """卖出日期字典。key值为股票代码，value值为日期集合。
+
+        赋值时会同时建立日期索引，之后修改字典中的日期集合不会更新索引，需要重新赋值。
+        """
+        return self._sell_dict
+
+    @sell_dict.setter
+    def sell_dict(self, value):
+        self._sell_dict = value
+        self._sell_index = _date_index(value)
+
     def min_amount(self, code):
         """最小购买量，默认为100"""
         result = None
@@ -159,19 +287,15 @@ class MinAmountChecker(CallBack):
     def on_check_buy(self, date: datetime.datetime.timestamp, code: str,
                      price: float, cash: float, **kwargs) -> bool:
         """当 `date` 及 `code` 包含在参数 :py:attr:`buy_dict` 中时返回 `True` 。否则返回 `False` 。"""
-        if code in self.buy_dict.keys() and date in self.buy_dict[code]:
-            return True
-        else:
-            return False
+        dates = self._buy_index.get(code)
+        return dates is not None and _date_key(date) in dates
 
     def on_check_sell(self, date: datetime.datetime.timestamp, code: str,
                       price: float, cash: float, hold_amount: float,
                       hold_price: float, **kwargs) -> bool:
         """当 `date` 及 `code` 包含在参数 :py:attr:`sell_dict` 中时返回 `True` 。否则返回 `False` 。"""
-        if code in self.sell_dict.keys() and date in self.sell_dict[code]:
-            return True
-        else:
-            return False
+        dates = self._sell_index.get(code)
+        return dates is not None and _date_key(date) in dates
 
     def _calc_commission(self, price: float, amount: int) -> float:
         """计算交易手续费"""
@@ -185,8 +309,8 @@ class MinAmountChecker(CallBack):
                            price: float, cash: float, **kwargs) -> float:
         """计算买入数量。当交易实际花费金额小于 `cash` （可用现金） 时，返回参数 :py:attr: `min_amount` （每次交易数量）。"""
         amount = self.min_amount(code)
-        if price * amount + self._calc_commission(
-                price, amount) + self._calc_tax(price, amount) <= cash:
+        if buy_cost(price, amount, self.commission_coeff, self.min_commission,
+                    self.tax_coeff) <= cash:
             return amount
         return 0
 
@@ -200,6 +324,10 @@ class MinAmountChecker(CallBack):
             return self.min_amount(code)
         return 0
 
+    def row_columns(self):
+        """不需要读取数据行中的任何列。"""
+        return []
+
 
 class AllInChecker(MinAmountChecker):
     """全部资金进入及全部持仓卖出的回调"""
@@ -209,12 +337,9 @@ class AllInChecker(MinAmountChecker):
             根据 `cash` （可用现金）及 `price` （当前价格）计算实际可以买入的数量（参数 :py:attr: `min_amount` 的倍数）
             （计算时包含考虑了交易时可能产生的印花税和手续费）
         """
-        amount = self.min_amount(code)
-        while price * amount + self._calc_commission(
-                price, amount) + self._calc_tax(price, amount) <= cash:
-            amount = amount + self.min_amount(code)
-        amount = amount - self.min_amount(code)
-        return amount
+        return max_buy_amount(price, cash, self.min_amount(code),
+                              self.commission_coeff, self.min_commission,
+                              self.tax_coeff)
 
     def on_calc_sell_amount(self, date: datetime.datetime.timestamp, code: str,
                             price: float, cash: float, hold_amount: float,
@@ -224,6 +349,12 @@ class AllInChecker(MinAmountChecker):
         return hold_amount
 
 
+_HOLD_COLUMNS = [
+    'code', 'amount', 'price', 'buy_date', 'stoploss_price',
+    'stopprofit_price', 'next_price'
+]  # 初始持仓的列名
+
+
 class TurtleStrategy(MinAmountChecker):
     """海龟交易法则适用的交易策略。可以计算止盈/止损/加仓的价位，并且按照这些价位进行仓位控制。
     """
@@ -238,7 +369,16 @@ class TurtleStrategy(MinAmountChecker):
             stoploss_price: 止损价格。
             stopprofit_price: 止盈价格。
             next_price: 加仓价位。
+
+        Example:
+            >>> holds = {'000001': [TurtleStrategy.Hold('000001', datetime.date(2020, 1, 1),
+            >>>                                         10, 100, 9, 11, 10.5)]}
+            >>> df = TurtleStrategy.Hold.to_frame(holds)  # 转换为 BackTest 的初始持仓
+            >>> holds = TurtleStrategy.Hold.from_frame(df)  # 转换为 TurtleStrategy 的初始持仓
         """
+        __slots__ = ('symbol', 'date', 'price', 'amount', 'stoploss_price',
+                     'stopprofit_price', 'next_price')
+
         def __init__(self, symbol, date, price, amount, stoploss_price,
                      stopprofit_price, next_price):
             """
@@ -264,6 +404,60 @@ class TurtleStrategy(MinAmountChecker):
                 self.symbol, self.date, self.price, self.amount,
                 self.stoploss_price, self.stopprofit_price, self.next_price)
 
+        @staticmethod
+        def to_frame(holds):
+            """将持仓转换为 :py:class:`BackTest` 初始持仓（ `init_hold` ）格式的数据。
+
+            Args:
+                holds (dict): 持仓。{symbol:[:py:class:`TurtleStrategy.Hold`]} 或 {symbol::py:class:`HoldBook`}。
+
+            Returns:
+                :py:class:`pandas.DataFrame`: 包含 'code', 'amount', 'price', 'buy_date', 'stoploss_price',
+                'stopprofit_price', 'next_price' 列的数据。每笔持仓批次为一行。
+            """
+            columns = {name: [] for name in _HOLD_COLUMNS}
+            for symbol, hs in holds.items():
+                if not isinstance(hs, HoldBook):
+                    hs = HoldBook(symbol, hs)
+                for lot in hs._lots.values():
+                    (date, price, amount, stoploss_price, stopprofit_price,
+                     next_price) = lot
+                    columns['code'].append(symbol)
+                    columns['amount'].append(amount)
+                    columns['price'].append(price)
+                    columns['buy_date'].append(date)
+                    columns['stoploss_price'].append(stoploss_price)
+                    columns['stopprofit_price'].append(stopprofit_price)
+                    columns['next_price'].append(next_price)
+            return pd.DataFrame(columns)
+
+        @staticmethod
+        def from_frame(data):
+            """将 :py:class:`BackTest` 初始持仓（ `init_hold` ）格式的数据转换为持仓。
+
+            Args:
+                data (:py:class:`pandas.DataFrame`): 包含 'code', 'amount', 'price', 'buy_date' 列的数据。
+                    缺少 'stoploss_price', 'stopprofit_price', 'next_price' 列时，对应的价格为-1。
+
+            Returns:
+                dict: {symbol::py:class:`HoldBook`}。可以作为 :py:class:`TurtleStrategy` 的 `holds` 参数。
+            """
+            holds = {}
+            if data.empty:
+                return holds
+            values = [
+                data[name].tolist()
+                if name in data.columns else [-1] * len(data)
+                for name in _HOLD_COLUMNS
+            ]
+            for code, amount, price, date, stoploss_price, stopprofit_price, next_price in zip(
+                    *values):
+                if code not in holds:
+                    holds[code] = HoldBook(code)
+                holds[code].append(date, price, amount, stoploss_price,
+                                   stopprofit_price, next_price)
+            return holds
+
     def __init__(self,
                  colname,
                  buy_dict={},
@@ -283,7 +477,8 @@ class TurtleStrategy(MinAmountChecker):
             next_point (float): 下一个可买点。根据`colname`指定的数据进行计算。默认为1。设置为None时，表示不计算。
                 计算下一个可买点`next_price=price+next_point*row[colname]`。
             max_amount (dict): 最大持仓数量。默认为400。
-            holds (dict): 初始持仓。{symbol:[:py:class:`TurtleStrategy.Hold`]}
+            holds (dict): 初始持仓。{symbol:[:py:class:`TurtleStrategy.Hold`]}。
+                初始化后每个股票代码的持仓会转换为 :py:class:`HoldBook` 。
             update_price_onsameday (float): 当买卖在同天发生时，是否允许更新最后一笔持仓的止盈价及下一个可买价。
             max_days (int): 最大持仓天数。默认为0。表示不判断。
         """
@@ -294,6 +489,9 @@ class TurtleStrategy(MinAmountChecker):
         self.next_point = kwargs.pop('next_point', 1)
         self._max_amount = max_amount
         self.holds = kwargs.pop('holds', {})
+        for symbol, hs in self.holds.items():
+            if not isinstance(hs, HoldBook):
+                self.holds[symbol] = HoldBook(symbol, hs)
         self.update_price_onsameday = kwargs.pop('update_price_onsameday',
                                                  True)
         self.max_days = kwargs.pop('max_days', 0)
@@ -304,29 +502,32 @@ class TurtleStrategy(MinAmountChecker):
                   stopprofit_price, next_price):
         """记录新增持仓"""
         if symbol not in self.holds:
-            self.holds[symbol] = []
-        self.holds[symbol].append(
-            TurtleStrategy.Hold(symbol, date, price, amount, stoploss_price,
-                                stopprofit_price, next_price))
+            self.holds[symbol] = HoldBook(symbol)
+        self.holds[symbol].append(date, price, amount, stoploss_price,
+                                  stopprofit_price, next_price)
 
     def max_amount(self, code):
         return (self._max_amount[code] if self._max_amount
                 and code in self._max_amount else self.min_amount(code) * 4)
 
+    def row_columns(self):
+        """计算止盈/止损/加仓价格时需要读取 `colname` 列。"""
+        return [self.colname] if self.colname else []
+
     def on_check_buy(self, date, code, price, cash, **kwargs):
         result = super().on_check_buy(date, code, price, cash, **kwargs)
         verbose = kwargs.get('verbose', 0)
-        if result and code in self.holds and len(self.holds[code]) > 0:
-            hold = self.holds[code][-1]
+        book = self.holds.get(code)
+        if result and book:
+            hold = book[-1]
             if hold and hold.next_price > 0 and price < hold.next_price:
                 if verbose == 2:
                     print(
                         '{:%Y-%m-%d}-{}-当前价位:{:.2f}小于上次购买价位:{:.2f}的下一个价位:{:.2f},不再购买.当前持仓数量:{}'
                         .format(date, code, price, hold.price, hold.next_price,
-                                sum(h.amount for h in self.holds[code])))
+                                book.amount))
                 return False
-        h = sum([h.amount
-                 for h in self.holds[code]]) if code in self.holds else 0
+        h = book.amount if book is not None else 0
         if h >= self.max_amount(code):
             """超过最大持仓线时不再购买"""
             if verbose == 2:
@@ -366,17 +567,18 @@ class TurtleStrategy(MinAmountChecker):
     def _update_last_price(self, date, code, price, **kwargs):
         stoploss_price, stopprofit_price, next_price = self.calc_price(
             price, **kwargs)
+        book = self.holds[code]
         if stopprofit_price != -1:
             if kwargs.get('verbose', 0) == 2:
                 print('{:%Y-%m-%d}-{}-同天买卖.更新止盈价:{:.2f}->{:.2f}.'.format(
-                    date, code, self.holds[code][-1].stopprofit_price,
+                    date, code, book[-1].stopprofit_price,
                     stopprofit_price))
-            self.holds[code][-1].stopprofit_price = stopprofit_price
+            book.update_last(stopprofit_price=stopprofit_price)
         if next_price != -1:
             if kwargs.get('verbose', 0) == 2:
                 print('{:%Y-%m-%d}-{}-同天买卖.更新加仓价:{:.2f}->{:.2f}.'.format(
-                    date, code, self.holds[code][-1].next_price, next_price))
-            self.holds[code][-1].next_price = next_price
+                    date, code, book[-1].next_price, next_price))
+            book.update_last(next_price=next_price)
 
     def on_buy_sell_on_same_day(self, date, code, price, **kwargs):
         """同一天出现买入和卖出信号时的操作
@@ -412,20 +614,14 @@ class TurtleStrategy(MinAmountChecker):
     def on_calc_sell_amount(self, date, code, price, cash, hold_amount,
                             hold_price, **kwargs):
         if code in self.holds:
-            result = 0
-            for h in reversed(self.holds[code]):
-                if h.stoploss_price >= price:
-                    result = result + h.amount
-                    self.holds[code].remove(h)
+            book = self.holds[code]
+            result = book.pop_stoploss(price)
             if result > 0:
                 if kwargs.get('verbose', 0) == 2:
                     print('{:%Y-%m-%d}-{}-止损.止损数量:{},当前金额:{:.2f},持仓金额:{:.2f}'.
                           format(date, code, result, price, hold_price))
                 return result
-            for h in reversed(self.holds[code]):
-                if h.stopprofit_price <= price:
-                    result = result + h.amount
-                    self.holds[code].remove(h)
+            result = result + book.pop_stopprofit(price)
             if result > 0:
                 if kwargs.get('verbose', 0) == 2:
                     print('{:%Y-%m-%d}-{}-止盈.止盈数量:{},当前金额:{:.2f},持仓金额:{:.2f}'.
@@ -435,34 +631,24 @@ class TurtleStrategy(MinAmountChecker):
             if hs:
                 result = sum([h.amount for h in hs])
                 if result > 0:
-                    for h in hs:
-                        if  kwargs.get('verbose', 0) == 2:
+                    if kwargs.get('verbose', 0) == 2:
+                        for h in hs:
                             print(
                             '{:%Y-%m-%d}-{}-达到持仓期限.{}Days,购买日期:{:%Y-%m-%d},数量:{},当前金额:{:.2f},持仓金额:{:.2f}'
                             .format(date, code, self.max_days, h.date,
                                     h.amount, price, h.price))
-                        self.holds[code].remove(h)
+                    book.pop_overdue(date, self._max_days_timedelta)
                 return result
         result = super().on_calc_sell_amount(date, code, price, cash,
                                              hold_amount, hold_price, **kwargs)
         result_temp = result
         while result_temp > 0:
-            if result_temp >= self.holds[code][0].amount:
-                if kwargs.get('verbose', 0) == 2:
-                    print('{:%Y-%m-%d}-{}-正常卖出.数量:{},当前金额:{:.2f},持仓金额:{:.2f}'.
-                          format(date, code, self.holds[code][0].amount, price,
-                                 self.holds[code][0].price))
-                a = self.holds[code][0]
-                result_temp = result_temp - a.amount
-                self.holds[code].remove(a)
-            else:
-                if kwargs.get('verbose', 0) == 2:
-                    print('{:%Y-%m-%d}-{}-正常卖出.数量:{},当前金额:{:.2f},持仓金额:{:.2f}'.
-                          format(date, code, self.holds[code][0].amount, price,
-                                 self.holds[code][0].price))
-                self.holds[code][
-                    0].amount = self.holds[code][0].amount - result_temp
-                result_temp = 0
+            book = self.holds[code]
+            if kwargs.get('verbose', 0) == 2:
+                print('{:%Y-%m-%d}-{}-正常卖出.数量:{},当前金额:{:.2f},持仓金额:{:.2f}'.
+                      format(date, code, book[0].amount, price,
+                             book[0].price))
+            result_temp = book.reduce_first(result_temp)
         return result
 
     def on_check_sell(self, date, code, price, cash, hold_amount, hold_price,
@@ -470,36 +656,558 @@ class TurtleStrategy(MinAmountChecker):
         result = super().on_check_sell(date, code, price, cash, hold_amount,
                                        hold_price, **kwargs)
         if not result and code in self.holds:
-            result = sum([
-                h.amount for h in self.holds[code]
-                if h.stoploss_price != -1 and h.stoploss_price >= price
-            ])
-            if result:
+            book = self.holds[code]
+            if book.hit_stoploss(price):
                 if kwargs.get('verbose', 0) == 2:
                     print('{:%Y-%m-%d}-{}-触及止损线.当前可卖数量:{}.'.format(
-                    date, code, result))
+                    date, code, book.stoploss_amount(price)))
                 return True
-            result = sum([
-                h.amount for h in self.holds[code]
-                if h.stopprofit_price != -1 and h.stopprofit_price <= price
-            ])
-            if result:
+            if book.hit_stopprofit(price):
                 if kwargs.get('verbose', 0) == 2:
                     print('{:%Y-%m-%d}-{}-触及止盈线.当前可卖数量:{}.'.format(
-                    date, code, result))
+                    date, code, book.stopprofit_amount(price)))
                 return True
-            if self._get_overdue(code, date):
+            if self._max_days_timedelta and book.hit_overdue(
+                    date, self._max_days_timedelta):
                 return True
+            result = 0
         return result
 
     def _get_overdue(self, code, date):
         if self._max_days_timedelta and code in self.holds:
-            return [
-                h for h in self.holds[code]
-                if (h.date + self._max_days_timedelta) <= date
-            ]
+            return self.holds[code].overdue(date, self._max_days_timedelta)
+        return None
+
+
+class HoldBook():
+    """单个股票代码的持仓批次（:py:class:`TurtleStrategy.Hold` ）集合。
+
+    持仓批次按买入顺序保存在以批次序号为key的 :py:class:`collections.OrderedDict` 中，
+    追加批次、读取首尾批次及移除任意批次都是 O(1) 。持仓总数量在每次变化时直接增减；
+    最高止损价格、最低止盈价格及最早买入日期分别由堆维护，移除批次时不立即从堆中删除，读取堆顶时再丢弃已失效的记录。
+    判断是否触及止损/止盈线及是否达到持仓期限只需要读取堆顶，与持仓批次数量无关；追加或移除批次为 O(log n) 。
+
+    可以像 `list` 一样按顺序遍历或按下标读取持仓批次，返回的 :py:class:`TurtleStrategy.Hold` 为持仓批次的副本，
+    修改持仓批次需要通过 :py:meth:`append` 、 :py:meth:`update_last` 等方法。
+
+    Example:
+        >>> book = HoldBook('000001')
+        >>> book.append(datetime.date(2020, 1, 1), 10, 100, 9, 11, 10.5)
+        >>> book.append(datetime.date(2020, 1, 2), 10.5, 100, 9.5, 11.5, 11)
+        >>> book.amount
+        200
+        >>> book.hit_stoploss(9.2)
+        True
+        >>> book.pop_stoploss(9.2)
+        100
+        >>> len(book)
+        1
+    """
+    # 持仓批次中各项的位置
+    _DATE, _PRICE, _AMOUNT, _STOPLOSS, _STOPPROFIT, _NEXT = range(6)
+
+    def __init__(self, symbol, holds=None):
+        """初始化
+
+        Args:
+            symbol (str): 股票代码。
+            holds ([:py:class:`TurtleStrategy.Hold`]): 初始持仓批次。
+        """
+        self.symbol = symbol
+        self._lots = OrderedDict()  # 批次序号 -> [买入日期, 买入价格, 数量, 止损价格, 止盈价格, 加仓价位]
+        self._seq = 0
+        self._total = 0
+        self._init_heaps()
+        for h in holds or []:
+            self.append(h.date, h.price, h.amount, h.stoploss_price,
+                        h.stopprofit_price, h.next_price)
+
+    def __len__(self):
+        return len(self._lots)
+
+    def __getitem__(self, i):
+        if self._lots and i == 0:
+            lot = self._lots[next(iter(self._lots))]
+        elif self._lots and i == -1:
+            lot = self._lots[next(reversed(self._lots))]
+        else:
+            lot = list(self._lots.values())[i]
+        return self._hold(lot)
+
+    def __iter__(self):
+        for lot in list(self._lots.values()):
+            yield self._hold(lot)
+
+    def _hold(self, lot):
+        return TurtleStrategy.Hold(self.symbol, *lot)
+
+    def _init_heaps(self):
+        # 堆中的元素为 (排序值, 批次序号)。带 valid 的堆不包含未设置价格(-1)及数量为0的批次
+        self._stoploss_heap = []
+        self._valid_stoploss_heap = []
+        self._stopprofit_heap = []
+        self._valid_stopprofit_heap = []
+        self._date_heap = []
+
+    def _push(self, i, lot):
+        heapq.heappush(self._stoploss_heap, (-lot[self._STOPLOSS], i))
+        heapq.heappush(self._date_heap, (lot[self._DATE], i))
+        if lot[self._STOPLOSS] != -1 and lot[self._AMOUNT]:
+            heapq.heappush(self._valid_stoploss_heap,
+                           (-lot[self._STOPLOSS], i))
+        self._push_stopprofit(i, lot)
+
+    def _push_stopprofit(self, i, lot):
+        heapq.heappush(self._stopprofit_heap, (lot[self._STOPPROFIT], i))
+        if lot[self._STOPPROFIT] != -1 and lot[self._AMOUNT]:
+            heapq.heappush(self._valid_stopprofit_heap,
+                           (lot[self._STOPPROFIT], i))
+
+    def _peek(self, heap, field, sign=1, valid=False):
+        """堆顶对应的持仓批次序号。堆为空时返回 `None` 。
+
+        已移除的批次、价格已更新的旧记录（以及 `valid` 时数量变为0的批次）在这里从堆中丢弃。
+        """
+        while heap:
+            key, i = heap[0]
+            lot = self._lots.get(i)
+            value = key if sign > 0 else -key
+            if lot is not None and lot[field] == value and (
+                    not valid or lot[self._AMOUNT]):
+                return i
+            heapq.heappop(heap)
         return None
 
+    def _remove(self, i):
+        """移除持仓批次，返回移除的数量"""
+        amount = self._lots.pop(i)[self._AMOUNT]
+        self._total -= amount
+        if len(self._date_heap) > 2 * len(self._lots) + 32:
+            # 堆中失效的记录过多时重建，均摊后仍为 O(1)
+            self._init_heaps()
+            for j, lot in self._lots.items():
+                self._push(j, lot)
+        return amount
+
+    @property
+    def amount(self):
+        """持仓总数量"""
+        return self._total
+
+    def append(self, date, price, amount, stoploss_price, stopprofit_price,
+               next_price):
+        """在末尾追加持仓批次。参数参考 :py:class:`TurtleStrategy.Hold` 。"""
+        i = self._seq
+        self._seq += 1
+        lot = [date, price, amount, stoploss_price, stopprofit_price,
+               next_price]
+        self._lots[i] = lot
+        self._total += amount
+        self._push(i, lot)
+
+    def update_last(self, stopprofit_price=None, next_price=None):
+        """更新最后一笔持仓批次的止盈价格及加仓价位。为 `None` 的参数不更新。"""
+        i = next(reversed(self._lots))
+        lot = self._lots[i]
+        if stopprofit_price is not None:
+            lot[self._STOPPROFIT] = stopprofit_price
+            self._push_stopprofit(i, lot)
+        if next_price is not None:
+            lot[self._NEXT] = next_price
+
+    def hit_stoploss(self, price):
+        """是否有持仓批次触及止损线（止损价格大于等于 `price` ）。不包含未设置止损价格的批次。"""
+        i = self._peek(self._valid_stoploss_heap, self._STOPLOSS, -1, True)
+        return i is not None and self._lots[i][self._STOPLOSS] >= price
+
+    def hit_stopprofit(self, price):
+        """是否有持仓批次触及止盈线（止盈价格小于等于 `price` ）。不包含未设置止盈价格的批次。"""
+        i = self._peek(self._valid_stopprofit_heap, self._STOPPROFIT, 1, True)
+        return i is not None and self._lots[i][self._STOPPROFIT] <= price
+
+    def hit_overdue(self, date, max_days):
+        """是否有持仓批次达到持仓期限。
+
+        Args:
+            date: 当前日期。
+            max_days (:py:class:`datetime.timedelta`): 最大持仓天数。
+        """
+        i = self._peek(self._date_heap, self._DATE)
+        return i is not None and (self._lots[i][self._DATE] +
+                                  max_days) <= date
+
+    def stoploss_amount(self, price):
+        """触及止损线的持仓数量合计。不包含未设置止损价格的批次。"""
+        return sum(lot[self._AMOUNT] for lot in self._lots.values()
+                   if lot[self._STOPLOSS] != -1
+                   and lot[self._STOPLOSS] >= price)
+
+    def stopprofit_amount(self, price):
+        """触及止盈线的持仓数量合计。不包含未设置止盈价格的批次。"""
+        return sum(lot[self._AMOUNT] for lot in self._lots.values()
+                   if lot[self._STOPPROFIT] != -1
+                   and lot[self._STOPPROFIT] <= price)
+
+    def overdue(self, date, max_days):
+        """达到持仓期限的持仓批次。参数参考 :py:meth:`hit_overdue` 。
+
+        Returns:
+            [:py:class:`TurtleStrategy.Hold`]: 达到持仓期限的持仓批次。
+        """
+        if not self.hit_overdue(date, max_days):
+            return []
+        return [self._hold(lot) for lot in self._lots.values()
+                if (lot[self._DATE] + max_days) <= date]
+
+    def pop_stoploss(self, price):
+        """移除止损价格大于等于 `price` 的持仓批次。
+
+        Returns:
+            float: 移除的数量合计。
+        """
+        result = 0
+        while True:
+            i = self._peek(self._stoploss_heap, self._STOPLOSS, -1)
+            if i is None or self._lots[i][self._STOPLOSS] < price:
+                return result
+            result += self._remove(i)
+
+    def pop_stopprofit(self, price):
+        """移除止盈价格小于等于 `price` 的持仓批次。
+
+        Returns:
+            float: 移除的数量合计。
+        """
+        result = 0
+        while True:
+            i = self._peek(self._stopprofit_heap, self._STOPPROFIT)
+            if i is None or self._lots[i][self._STOPPROFIT] > price:
+                return result
+            result += self._remove(i)
+
+    def pop_overdue(self, date, max_days):
+        """移除达到持仓期限的持仓批次。参数参考 :py:meth:`hit_overdue` 。
+
+        Returns:
+            float: 移除的数量合计。
+        """
+        result = 0
+        while self.hit_overdue(date, max_days):
+            result += self._remove(self._peek(self._date_heap, self._DATE))
+        return result
+
+    def reduce_first(self, amount):
+        """按先进先出的顺序从第一笔持仓批次中扣减数量。扣减数量大于等于该批次数量时移除该批次。
+
+        Args:
+            amount (float): 需要扣减的数量。
+
+        Returns:
+            float: 剩余未扣减的数量。
+        """
+        i = next(iter(self._lots))
+        first = self._lots[i][self._AMOUNT]
+        if amount >= first:
+            self._remove(i)
+            return amount - first
+        self._lots[i][self._AMOUNT] = first - amount
+        self._total -= amount
+        return 0
+
+
+class TradeLog():
+    """按列保存的成交记录。
+
+    每列使用固定类型的 :py:class:`numpy.ndarray` 保存，容量不足时按两倍扩容。
+
+    ============  ==================  ============
+    列名           类型                说明
+    ============  ==================  ============
+    datetime      `datetime64[ns]`    时间
+    code          `category`          代码
+    price         `float64`           成交价
+    amount        `float64`           成交量（卖出为负数）
+    cash          `float64`           剩余现金
+    commission    `float64`           手续费
+    tax           `float64`           印花税
+    total         `float64`           总金额
+    toward        `int8`              方向。1（买入），-1（卖出）
+    ============  ==================  ============
+
+    Example:
+        >>> log = TradeLog()
+        >>> log.append(date(1998, 1, 1), '000001', 4.5, 100, 544.55, 5, 0.45, 455.45, 1)
+        >>> len(log)
+        1
+        >>> log['cash']
+        array([544.55])
+    """
+    headers = [
+        'datetime', 'code', 'price', 'amount', 'cash', 'commission', 'tax',
+        'total', 'toward'
+    ]
+    _dtypes = {
+        'datetime': np.int64,  # 纳秒时间戳，读取时转换为 datetime64[ns]
+        'code': np.int32,  # 代码在 `categories` 中的位置
+        'price': np.float64,
+        'amount': np.float64,
+        'cash': np.float64,
+        'commission': np.float64,
+        'tax': np.float64,
+        'total': np.float64,
+        'toward': np.int8,
+    }
+
+    def __init__(self, capacity=64):
+        """初始化
+
+        Args:
+            capacity (int): 初始容量。默认为64。
+        """
+        self._size = 0
+        self._columns = {
+            name: np.empty(max(capacity, 1), dtype=dtype)
+            for name, dtype in self._dtypes.items()
+        }
+        self.categories = []  # 代码集合
+        self._category_pos = {}
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        for name, values in self._columns.items():
+            grown = np.empty(len(values) * 2, dtype=values.dtype)
+            grown[:self._size] = values[:self._size]
+            self._columns[name] = grown
+
+    def append(self, date, code, price, amount, cash, commission, tax, total,
+               toward):
+        """追加一条成交记录"""
+        if self._size == len(self._columns['price']):
+            self._grow()
+        pos = self._category_pos.get(code)
+        if pos is None:
+            pos = self._category_pos[code] = len(self.categories)
+            self.categories.append(code)
+        i = self._size
+        c = self._columns
+        c['datetime'][i] = pd.Timestamp(date).value
+        c['code'][i] = pos
+        c['price'][i] = price
+        c['amount'][i] = amount
+        c['cash'][i] = cash
+        c['commission'][i] = commission
+        c['tax'][i] = tax
+        c['total'][i] = total
+        c['toward'][i] = toward
+        self._size = i + 1
+
+    def column(self, name):
+        """读取一列数据。
+
+        Returns:
+            :py:class:`numpy.ndarray`: 除 `code` 列以外都不会复制数据。
+                `code` 列返回 :py:class:`pandas.Categorical` 。
+        """
+        values = self._columns[name][:self._size]
+        if name == 'datetime':
+            return values.view('datetime64[ns]')
+        if name == 'code':
+            return pd.Categorical.from_codes(values, self.categories)
+        return values
+
+    def __getitem__(self, key):
+        """按列名读取一列数据，或按位置读取一行数据（与 :py:attr:`headers` 顺序一致的 `list`）。"""
+        if isinstance(key, str):
+            return self.column(key)
+        if key < 0:
+            key += self._size
+        if key < 0 or key >= self._size:
+            raise IndexError('成交记录索引超出范围')
+        row = [self._columns[name][key] for name in self.headers]
+        row[0] = pd.Timestamp(row[0])
+        row[1] = self.categories[row[1]]
+        return row
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def to_frame(self):
+        """转换为 :py:class:`pandas.DataFrame` 。
+
+        Returns:
+            :py:class:`pandas.DataFrame`: 列名参考 :py:attr:`headers` 。
+        """
+        return pd.DataFrame({name: self.column(name) for name in self.headers})
+
+
+class _EquityRecorder():
+    """回测过程中逐日记录资金、持仓市值及总资产。
+
+    每个股票代码的持仓市值（持仓数量*最近价格）在价格或持仓变化时增量更新，日期变化时记录前一天的数据。
+    """
+    def __init__(self, bt):
+        self._bt = bt
+        self._values = {}  # 每个股票代码的持仓市值
+        self._positions = 0.0  # 持仓市值合计
+        self._date = None
+        self.dates = []
+        self.cash = []
+        self.positions = []
+        for code in bt.ledger.codes:
+            price = bt.last_price(code)
+            if price is None:
+                price = bt.ledger.avg_price(code)[0]
+            self._set(code, bt.ledger.amount(code) * price)
+
+    def _set(self, code, value):
+        self._positions += value - self._values.get(code, 0.0)
+        self._values[code] = value
+
+    def _record(self):
+        self.dates.append(self._date)
+        self.cash.append(self._bt.available_cash)
+        self.positions.append(self._positions)
+
+    def on_row(self, date, code, price):
+        """读取到新的一行数据"""
+        if self._date is not None and date != self._date:
+            self._record()
+        self._date = date
+        if code in self._values:
+            self._set(code, self._bt.ledger.amount(code) * price)
+
+    def on_trade(self, code, price):
+        """发生成交"""
+        self._set(code, self._bt.ledger.amount(code) * price)
+
+    def to_frame(self):
+        """转换为 :py:class:`pandas.DataFrame` 。参考 :py:attr:`BackTest.equity_df` 。"""
+        if self._date is not None:
+            self._record()
+            self._date = None
+        cash = np.asarray(self.cash, dtype=np.float64)
+        positions = np.asarray(self.positions, dtype=np.float64)
+        total = cash + positions
+        rets = np.empty_like(total)
+        if len(total) > 0:
+            rets[0] = total[0] / self._bt._init_assets - 1
+            rets[1:] = total[1:] / total[:-1] - 1
+        return pd.DataFrame(
+            {
+                'cash': cash,
+                'positions': positions,
+                'total': total,
+                'rets': rets
+            },
+            index=pd.DatetimeIndex(pd.to_datetime(self.dates), name='date'))
+
+
+class PositionLedger():
+    """按先进先出（FIFO）顺序记录持仓批次的账本。
+
+    每个股票代码保存一个由持仓批次组成的 :py:class:`collections.deque` ，同时维护持仓数量及持仓成本的累计值。
+    买入时在队尾追加批次，卖出时从队首开始扣减批次，查询平均成本时直接使用累计值计算。
+
+    Example:
+        >>> ledger = PositionLedger()
+        >>> ledger.buy('000001', 100, 4.5)
+        >>> ledger.buy('000001', 100, 6.7)
+        >>> ledger.sell('000001', 150)
+        >>> ledger.avg_price('000001')
+        (6.7, 50.0)
+        >>> ledger.lots('000001')
+        [(None, 50, 6.7)]
+    """
+    def __init__(self):
+        self._lots = {}  # 持仓批次。key值为股票代码，value值为[数量,价格,日期]组成的deque。
+        self._amount = {}  # 持仓数量累计值
+        self._cost = {}  # 持仓成本（价格*数量）累计值
+
+    def __contains__(self, code):
+        return code in self._lots and len(self._lots[code]) > 0
+
+    def __len__(self):
+        """有持仓的股票数量"""
+        return len(self.codes)
+
+    @property
+    def codes(self):
+        """有持仓的股票代码集合"""
+        return [code for code in self._lots if code in self]
+
+    def buy(self, code, amount, price, date=None):
+        """买入，在队尾追加一个持仓批次。
+
+        Args:
+            code (str): 股票代码。
+            amount (float): 买入数量。
+            price (float): 买入价格。
+            date: 买入日期。
+        """
+        if code not in self._lots:
+            self._lots[code] = deque()
+            self._amount[code] = 0.0
+            self._cost[code] = 0.0
+        self._lots[code].append([amount, price, date])
+        self._amount[code] += amount
+        self._cost[code] += price * amount
+
+    def sell(self, code, amount):
+        """卖出，从队首开始扣减持仓批次。
+
+        Args:
+            code (str): 股票代码。
+            amount (float): 卖出数量。超过持仓数量的部分会被忽略。
+        """
+        lots = self._lots.get(code)
+        while amount > 0 and lots:
+            lot = lots[0]
+            if amount >= lot[0]:
+                lots.popleft()
+                self._amount[code] -= lot[0]
+                self._cost[code] -= lot[1] * lot[0]
+                amount = amount - lot[0]
+            else:
+                lot[0] = lot[0] - amount
+                self._amount[code] -= amount
+                self._cost[code] -= lot[1] * amount
+                amount = 0
+        if lots is not None and not lots:
+            # 清仓后重置累计值，避免浮点误差累积
+            self._amount[code] = 0.0
+            self._cost[code] = 0.0
+
+    def amount(self, code):
+        """持仓数量"""
+        return self._amount.get(code, 0.0)
+
+    def cost(self, code):
+        """持仓成本（价格*数量）"""
+        return self._cost.get(code, 0.0)
+
+    def avg_price(self, code):
+        """持仓平均成本
+
+        Returns:
+            (float,float): (成本,数量)。没有持仓时返回 `(0.0, 0.0)` 。
+        """
+        if code in self:
+            amount = self._amount[code]
+            if amount:
+                return (self._cost[code] / amount, amount)
+        return (0.0, 0.0)
+
+    def lots(self, code):
+        """持仓批次，按买入顺序排列。
+
+        Returns:
+            [(date,float,float)]: (买入日期,数量,价格)组成的集合。
+        """
+        return [(lot[2], lot[0], lot[1]) for lot in self._lots.get(code, [])]
+
 
 class BackTest():
     """简单的回测系统。根据传入的购买日期和卖出日期，计算收益。
@@ -552,6 +1260,7 @@ class BackTest():
         Args:
             data (:py:class:`pandas.DataFrame`): 完整的日线数据。数据中需要包含 `date` 列，用来标记日期。
                 数据中至少需要包含 `date` 列、 `code` 列和 `close` 列，其中 `close` 列可以由参数 `colname` 参数指定。
+                也可以传入 :py:class:`finance_tools_py.panel.Panel` ，此时使用按日期排序后的数据（参考 :py:func:`finance_tools_py.panel.Panel.by_date` ）。
             init_cash (float): 初始资金。
             init_hold (:py:class:`pandas.DataFrame`): 初始持仓。
                 数据中需要包含 'code', 'amount', 'price', 'buy_date', 'stoploss_price',
@@ -565,38 +1274,33 @@ class BackTest():
             callbacks ([:py:class:`finance_tools_py.backtest.CallBack`]): 回调函数集合。
         """
         self._min_buy_amount = 100  # 单次可买最小数量
+        if isinstance(data, Panel):
+            data = data.by_date()
         self.data = data
         self.init_cash = init_cash
-        self.cash = [init_cash]  # 资金明细
+        self._available_cash = init_cash  # 当前可用资金
         self.tax_coeff = tax_coeff
         self.commission_coeff = commission_coeff
         self.min_commission = min_commission
-        self.history = []  # 交易历史
-        self._init_hold = kwargs.pop(
-            'init_hold',
-            pd.DataFrame(columns=[
-                'code', 'amount', 'price', 'buy_date', 'stoploss_price',
-                'stopprofit_price', 'next_price'
-            ]))
+        self.history = TradeLog()  # 交易历史
+        self._version = 0  # 成交记录版本。每次记录成交后加1
+        self._cache = {}  # 按成交记录版本缓存的计算结果
+        self._last_price = {}  # 回测过程中每个股票代码最近一次出现的价格
+        self._hold_cost = {}  # 每个股票代码最近一次清仓后的成交金额及成交量累计值（[价格*数量,数量]）
+        self._equity = None  # 计算过程中的逐日总资产记录
+        self._equity_df = None
+        self._init_hold = kwargs.pop('init_hold',
+                                     pd.DataFrame(columns=_HOLD_COLUMNS))
         self._calced = False
         self._colname = col_name
         self._calbacks = callbacks
-        self._buy_price_cur = {}  #购买成本。
+        self.ledger = PositionLedger()  #持仓批次及购买成本。
         if not self._init_hold.empty:
             for index, row in self._init_hold.iterrows():
                 self.__update_buy_price(row['buy_date'], row['code'],
                                         row['amount'], row['price'], 1)
-        self._history_headers = [
-            'datetime',  # 时间
-            'code',  # 代码
-            'price',  # 成交价
-            'amount',  # 成交量
-            'cash',  # 剩余现金
-            'commission',  # 手续费
-            'tax',  # 印花税
-            'total',  # 总金额
-            'toward',  # 方向
-        ]
+                self._update_hold_cost(row['code'], row['price'],
+                                       row['amount'])
         self.__start_date = self.data.iloc[0]['date']  #数据起始日期
         self._live_start_date = kwargs.pop('live_start_date',
                                            self.__start_date)
@@ -609,16 +1313,17 @@ class BackTest():
         # self.hold_price=[]#当前持仓金额
 
     @property
+    @_cached_by_version
     def history_df(self):
-        """获取成交历史的 :py:class:`pandas.DataFrame` 格式。"""
-        if len(self.history) > 0:
-            lens = len(self.history[0])
-        else:
-            lens = len(self._history_headers)
+        """获取成交历史的 :py:class:`pandas.DataFrame` 格式。
 
-        his = pd.DataFrame(data=self.history,
-                           columns=self._history_headers[:lens])
+        结果会被缓存，直到记录新的成交。请不要直接修改返回的数据。
+        """
+        his = self.history.to_frame()
+        his['code'] = his['code'].astype(object)
         hold = self._init_hold.reset_index().drop(columns=['index'])
+        if not hold.empty:
+            hold['datetime'] = pd.to_datetime(hold['datetime'])
         return his.append(hold).sort_values('datetime')
 
     @property
@@ -647,6 +1352,7 @@ class BackTest():
     #     ).fillna(0).sort_index()
 
     @property
+    @_cached_by_version
     def hold_price_cur_df(self):
         """当前持仓成本附加最新价格的 DataFrame 格式数据
 
@@ -656,44 +1362,117 @@ class BackTest():
             code
             000001       13.4   100.0       15.3
 
+        结果会被缓存，直到记录新的成交。请不要直接修改返回的数据。
+
         Returns:
             :class:`pandas.DataFrame` : 结果数据
         """
-        if self._hold_price_cur.empty:
+        hold = self._hold_price_cur
+        if not hold:
             return pd.DataFrame(
                 columns=['buy_price', 'amount', 'price_cur']).sort_index()
-        d = self.data.sort_values('date')
-        df = pd.DataFrame(self._hold_price_cur.values.tolist(),
+        prices = self._current_prices
+        df = pd.DataFrame(list(hold.values()),
                           columns=['buy_price', 'amount'],
-                          index=self._hold_price_cur.index)
-        df['price_cur'] = df.apply(
-            lambda row: d.loc[d['code'] == row.name, 'close'].iloc[-1]
-            if not d.loc[d['code'] == row.name, 'close'].empty else 0,
-            axis=1)
+                          index=pd.Index(list(hold.keys()), name='code'))
+        df['price_cur'] = [prices.get(code, 0) for code in df.index]
         return df.sort_index()
 
     @property
-    def _hold_price_cur(self):
-        """目前持仓的成本。是 :py:class:`pandas.Series` 类型或 :py:class:`pandas.DataFrame` 类型。
-            其中 `code` 是索引，通过索引访问会返回一个数组（price,amount）"""
-        def weights(x):
-            n = len(x)
-            res = 1
-            while res > 0 or res < 0:
-                res = sum(x[:n]['amount'])
-                n = n - 1
+    def equity_df(self):
+        """逐日的资金、持仓市值及总资产。
 
-            x = x[n + 1:]
+        需要在调用 :py:func:`calc_trade_history` 时设置参数 `record_equity=True` 。
+        `rets` 列可以直接作为 :py:func:`finance_tools_py._jupyter_helper.report_metrics` 的策略收益。
 
-            if sum(x['amount']) != 0:
-                return np.average(x['price'].to_list(),
-                                  weights=x['amount'].to_list(),
-                                  returned=True)
-            else:
-                return np.nan
+        Examples:
+            >>> bt.calc_trade_history(record_equity=True)
+            >>> bt.equity_df
+                          cash  positions    total      rets
+            date
+            1998-01-01  544.55      450.0   994.55 -0.005450
+            1999-01-01 1328.76        0.0  1328.76  0.336041
+            2000-01-01  653.09      670.0  1323.09 -0.004267
+            2001-01-01  653.09     1000.0  1653.09  0.249416
+
+        Returns:
+            :py:class:`pandas.DataFrame`: 以日期为索引，包含 `cash` （可用资金）、 `positions` （持仓市值）、
+            `total` （总资产）及 `rets` （日收益率，第一天相对于期初资产计算）列。
+            没有记录时返回 `None` 。
+        """
+        return self._equity_df
+
+    @property
+    def _final_prices(self):
+        """数据中每个股票代码最后一行数据的价格。数据需要按日期排序。
 
-        df = self.history_df.set_index('datetime')
-        return df.sort_index().groupby('code').apply(weights).dropna()
+        Returns:
+            {str,float}: key值为股票代码，value值为价格。
+        """
+        key = ('_final_prices', id(self.data), self._colname)
+        if key not in self._cache:
+            last = self.data.drop_duplicates('code', keep='last')
+            self._cache[key] = dict(zip(last['code'], last[self._colname]))
+        return self._cache[key]
+
+    @property
+    def _current_prices(self):
+        """计算持仓价值时使用的价格。
+
+        计算完成后为回测过程中记录的每个股票代码最近一次出现的价格（即最后一行数据的价格），不需要再读取数据；
+        还没有计算时为数据中每个股票代码最后一行数据的价格。
+        """
+        return self._last_price if self._calced else self._final_prices
+
+    def last_price(self, code):
+        """回测过程中股票代码最近一次出现的价格。
+
+        Args:
+            code (str): 股票代码。
+
+        Returns:
+            float: 还没有出现过价格时返回 `None` 。
+        """
+        return self._last_price.get(code)
+
+    def mark_to_market(self):
+        """按照每个持仓股票最近一次出现的价格计算当前总资产。
+
+        可以在回测过程中（例如在回调中）调用。持仓股票还没有出现过价格时，按持仓成本计算。
+        回测计算完成后，结果与 :py:attr:`total_assets_cur` 一致。
+
+        Returns:
+            float: 当前可用资金+持仓按最近价格计算的价值。
+        """
+        value = 0
+        for code in sorted(self.ledger.codes):
+            price = self._last_price.get(code)
+            if price is None:
+                price = self.ledger.avg_price(code)[0]
+            value = value + self.ledger.amount(code) * price
+        return self.available_cash + value
+
+    @property
+    def _hold_price_cur(self):
+        """目前持仓的成本。
+
+        成本为最近一次清仓之后所有成交（卖出的数量为负数）按数量加权的平均价格，在记录成交时累计，不需要扫描成交历史。
+
+        Returns:
+            {str,(float,float)}: key值为股票代码，value值为(成本,数量)。
+        """
+        return {
+            code: (cost / amount, amount)
+            for code, (cost, amount) in self._hold_cost.items()
+        }
+
+    def _update_hold_cost(self, code, price, amount):
+        """记录一笔成交后更新持仓成本的累计值。`amount` 为带方向的成交量，持仓数量回到0时重新开始累计。"""
+        cost = self._hold_cost.setdefault(code, [0.0, 0.0])
+        cost[0] += price * amount
+        cost[1] += amount
+        if cost[1] == 0:
+            del self._hold_cost[code]
 
     def hold_time(self, dt=None):
         """持仓时间。根据参数 `dt` 查询截止时间之前的交易，并与当前时间计算差异。
@@ -722,17 +1501,16 @@ class BackTest():
                     'code').apply(weights).dropna()
 
     @property
+    @_cached_by_version
     def total_assets_cur(self) -> float:
         """获取当前总资产
 
         当前可用资金+当前持仓现价。
         """
-        if self.hold_price_cur_df.empty:
-            return self.available_cash
-        else:
-            return self.available_cash + sum(
-                self.hold_price_cur_df['amount'] *
-                self.hold_price_cur_df['price_cur'])
+        prices = self._current_prices
+        return self.available_cash + sum(
+            self.ledger.amount(code) * prices.get(code, 0)
+            for code in sorted(self.ledger.codes))
 
     # def hold_table(self, datetime=None):
     #     """到某一个时刻的持仓 如果给的是日期,则返回当日开盘前的持仓"""
@@ -752,7 +1530,16 @@ class BackTest():
     @property
     def available_cash(self) -> float:
         """获取当前可用资金"""
-        return self.cash[-1]
+        return self._available_cash
+
+    @property
+    def cash(self):
+        """资金明细。初始资金及每次成交后的剩余资金。
+
+        Returns:
+            [float]
+        """
+        return [self.init_cash] + self.history['cash'].tolist()
 
     def _calc_commission(self, price, amount) -> float:
         """计算交易手续费"""
@@ -783,58 +1570,19 @@ class BackTest():
         Returns:
             (float,float): (成本,数量)
         """
-        if code in self._buy_price_cur:
-            hold_amount, hold_price = self._buy_price_cur[code]
-            if hold_amount and hold_price:
-                return np.average(hold_price,
-                                  weights=hold_amount,
-                                  returned=True)
-        return (0.0, 0.0)
-
-    # def __get_hold_price(self,code):
-    #     pass
+        return self.ledger.avg_price(code)
 
     def __update_buy_price(self, date, code, amount, price, toward):
         """更新买入成本"""
+        logging.debug(
+            '__update_buy_price-{:%Y-%m-%d}:toward:{},code:{},amount:{},price:{:.2f}'
+            .format(date, toward, code, amount, price))
         if toward == 1:
-            #买入
-            hold_amount = []
-            hold_price = []
-            if code not in self._buy_price_cur:
-                self._buy_price_cur[code] = [hold_amount, hold_price]
-            else:
-                hold_amount, hold_price = self._buy_price_cur[code]
-            logging.debug(
-                '__update_buy_price-{:%Y-%m-%d}:toward:{},code:{},amount:{},price:{:.2f}'
-                .format(date, toward, code, amount, price))
-            self._buy_price_cur[code] = [
-                hold_amount + [amount], hold_price + [price]
-            ]
+            self.ledger.buy(code, amount, price, date)
         elif toward == -1:
-            #卖出
-            hold_amount = []
-            hold_price = []
-            if code not in self._buy_price_cur:
-                self._buy_price_cur[code] = [hold_amount, hold_price]
-            else:
-                hold_amount, hold_price = self._buy_price_cur[code]
-
-            while amount > 0:
-                if amount >= hold_amount[0]:
-                    logging.debug(
-                        '__update_buy_price-{:%Y-%m-%d}:toward:{},code:{},amount:{},price:{:.2f},hold_amount:{}'
-                        .format(date, toward, code, amount, price,
-                                hold_amount))
-                    a = hold_amount[0]
-                    hold_amount.remove(a)
-                    hold_price.remove(hold_price[0])
-                    amount = amount - a
-                else:
-                    logging.debug(
-                        '__update_buy_price:toward:{},code:{},amount:{},price:{:.2f}'
-                        .format(toward, code, amount, price))
-                    hold_amount[0] = hold_amount[0] - amount
-                    amount = 0
+            self.ledger.sell(code, amount)
+        if self._equity is not None:
+            self._equity.on_trade(code, price)
 
     def _check_callback_sell(self, date, code, price, **kwargs) -> bool:
         for cb in self._calbacks:
@@ -864,137 +1612,322 @@ class BackTest():
                     return amount
         return 0
 
-    def calc_trade_history(self, verbose=0, **kwargs):
+    def calc_trade_history(self, verbose=0, engine='iterrows', **kwargs):
         """计算交易记录
 
         Args:
             verbose (int): 是否显示计算过程。0（不显示），1（显示部分），2（显示全部）。默认为0。
+            engine (str): 计算引擎。默认为 `iterrows` 。
+
+                * `iterrows`: 通过 :py:func:`pandas.DataFrame.iterrows` 逐行计算。
+                  回调中的参数 `row` 为 :py:class:`pandas.Series` 。
+                * `columnar`: 计算前将 `date` 、 `code` 、价格列及回调声明的列（参考 :py:func:`CallBack.row_columns` ）
+                  一次性读取为数组后逐行计算，计算结果与 `iterrows` 一致，速度更快。
+                  回调中的参数 `row` 为轻量的数据行，只支持按列名取值及 `name` 、 `empty` 属性。
+                * `signal`: 当回调全部为 :py:class:`MinAmountChecker` 或 :py:class:`AllInChecker` 时，
+                  交易只取决于 `buy_dict` 及 `sell_dict` 中的日期。此时会先将日期字典转换为买卖信号，只计算有信号的数据行。
+                  只有一个 :py:class:`MinAmountChecker` 回调时，资金充足部分的成交、手续费、印花税及剩余资金会一次性计算，
+                  从第一次资金不足的买入开始才逐行计算。
+                  回调不满足条件、 `verbose` 为2或 `record_equity` 为 `True` 时，使用 `columnar` 计算。
             bssd_buy (bool): 买卖发生在同一天，是否允许买入。默认False。
             bssd_sell (bool): 买卖发生在同一天，是否允许买入。默认False。
+            record_equity (bool): 是否在计算过程中逐日记录资金、持仓市值及总资产。默认False。
+                记录结果参考 :py:attr:`equity_df` 。记录时要求数据按日期排序。
 
         """
-        def update_history(history, date, code, price, amount, available_cash,
-                           commission, tax, toward):
-            history.append([
-                date,  # 时间
-                code,  # 代码
-                price,  # 成交价
-                amount * toward,  # 成交量
-                available_cash,  # 剩余现金
-                commission,  # 手续费
-                tax,  # 印花税
-                price * amount + commission + tax,  # 总金额
-                toward,  # 方向
-            ])
-
         _bssd_buy = kwargs.pop('bssd_buy', False)  #买卖发生在同一天，是否允许买入。默认False
         _bssd_sell = kwargs.pop('bssd_sell', False)  #买卖发生在同一天，是否允许卖出。默认False
+        _record_equity = kwargs.pop('record_equity', False)  #是否逐日记录总资产。默认False
+
+        self._equity = _EquityRecorder(self) if _record_equity else None
+        if engine == 'iterrows':
+            for index, row in tqdm(self.data.iterrows(),
+                                   total=len(self.data),
+                                   desc='回测计算中...'):
+                self._on_row(row['date'], row['code'], row[self._colname],
+                             row, verbose, _bssd_buy, _bssd_sell)
+        elif (engine == 'signal' and verbose < 2 and not _record_equity
+              and self._signal_only()):
+            self._calc_signal(_bssd_buy, _bssd_sell)
+        elif engine in ('columnar', 'signal'):
+            columns = _ColumnStore(self.data, self._row_columns())
+            dates = columns['date']
+            codes = columns['code']
+            prices = columns[self._colname]
+            for i in tqdm(range(len(self.data)), desc='回测计算中...'):
+                self._on_row(dates[i], codes[i], prices[i],
+                             _ColumnarRow(columns, i), verbose, _bssd_buy,
+                             _bssd_sell)
+        else:
+            raise ValueError('不支持的计算引擎:{}'.format(engine))
+        if self._equity is not None:
+            self._equity_df = self._equity.to_frame()
+            self._equity = None
+        if verbose ==2:
+            print('计算完成！')
+        self._calced = True
 
-        for index, row in tqdm(self.data.iterrows(),
-                               total=len(self.data),
-                               desc='回测计算中...'):
-            date = row['date']
-            if date < self._live_start_date:
+    def _row_columns(self):
+        """所有回调声明需要读取的列名集合。"""
+        result = []
+        for cb in self._calbacks:
+            cols = cb.row_columns() if hasattr(cb, 'row_columns') else None
+            for col in (cols or []):
+                if col not in result and col in self.data.columns:
+                    result.append(col)
+        return result
+
+    def _update_history(self, date, code, price, amount, available_cash,
+                        commission, tax, toward):
+        """记录一笔成交"""
+        self._available_cash = available_cash
+        self._version += 1
+        self.history.append(
+            date,  # 时间
+            code,  # 代码
+            price,  # 成交价
+            amount * toward,  # 成交量
+            available_cash,  # 剩余现金
+            commission,  # 手续费
+            tax,  # 印花税
+            price * amount + commission + tax,  # 总金额
+            toward,  # 方向
+        )
+        self._update_hold_cost(code, price, amount * toward)
+
+    def _on_row(self, date, code, price, row, verbose, bssd_buy, bssd_sell):
+        """处理一行数据：检查买卖信号并记录成交"""
+        self._last_price[code] = price
+        if self._equity is not None:
+            self._equity.on_row(date, code, price)
+        if date < self._live_start_date:
+            if verbose ==2:
+                print('{:%Y-%m-%d} < 起始日期:{:%Y-%m-%d} 跳过判断。'.format(
+                    date, self._live_start_date))
+            return
+        _buy = self._check_callback_buy(date,
+                                        code,
+                                        price,
+                                        row=row,
+                                        verbose=verbose)
+        _sell = self._check_callback_sell(date,
+                                          code,
+                                          price,
+                                          row=row,
+                                          verbose=verbose)
+        if _buy and _sell:
+            self._on_buy_sell_on_same_day(date,
+                                          code,
+                                          price,
+                                          row=row,
+                                          verbose=verbose)
+            _buy = bssd_buy
+            _sell = bssd_sell
+            if verbose == 2:
+                print('{:%Y-%m-%d}-{}-同天买卖.允许买入:{},允许卖出:{}.'.format(
+                    date, code, bssd_buy, bssd_sell))
+
+        if _buy:
+            amount = self._calc_buy_amount(date,
+                                           code,
+                                           price,
+                                           row=row,
+                                           verbose=verbose)  # 买入数量
+            commission = self._calc_commission(price, amount)
+            tax = self._calc_tax(price, amount)
+            value = price * amount + commission + tax
+            if value <= self.available_cash and amount > 0:
+                self._update_history(
+                    date,
+                    code,
+                    price,
+                    amount,
+                    self.available_cash - value,
+                    commission,
+                    tax,
+                    1,
+                )
+                self.__update_buy_price(date, code, amount, price, 1)
+                if verbose ==2:
+                    print('{:%Y-%m-%d} {} 买入 {:.2f}/{:.2f}，剩余资金 {:.2f}'.
+                          format(date, code, price, amount,
+                                 self.available_cash))
+            else:
                 if verbose ==2:
-                    print('{:%Y-%m-%d} < 起始日期:{:%Y-%m-%d} 跳过判断。'.format(
-                        date, self._live_start_date))
-                continue
-            code = row['code']
-            price = row['close']  # 价格
-            _buy = self._check_callback_buy(date,
+                    print('{:%Y-%m-%d} {} {:.2f} 可用资金不足，跳过购买。'.format(
+                        date, code, price))
+        if _sell:
+            amount = self._calc_sell_amount(date,
                                             code,
                                             price,
                                             row=row,
                                             verbose=verbose)
-            _sell = self._check_callback_sell(date,
-                                              code,
-                                              price,
-                                              row=row,
-                                              verbose=verbose)
-            if _buy and _sell:
-                self._on_buy_sell_on_same_day(date,
-                                              code,
-                                              price,
-                                              row=row,
-                                              verbose=verbose)
-                _buy = _bssd_buy
-                _sell = _bssd_sell
-                if verbose == 2:
-                    print('{:%Y-%m-%d}-{}-同天买卖.允许买入:{},允许卖出:{}.'.format(
-                        date, code, _bssd_buy, _bssd_sell))
-
-            if _buy:
-                amount = self._calc_buy_amount(date,
-                                               code,
-                                               price,
-                                               row=row,
-                                               verbose=verbose)  # 买入数量
+            if amount > 0:
                 commission = self._calc_commission(price, amount)
                 tax = self._calc_tax(price, amount)
-                value = price * amount + commission + tax
-                if value <= self.available_cash and amount > 0:
-                    self.cash.append(self.available_cash - value)
-                    update_history(
-                        self.history,
-                        date,
-                        code,
-                        price,
-                        amount,
-                        self.cash[-1],
-                        commission,
-                        tax,
-                        1,
-                    )
-                    self.__update_buy_price(date, code, amount, price, 1)
-                    if verbose ==2:
-                        print('{:%Y-%m-%d} {} 买入 {:.2f}/{:.2f}，剩余资金 {:.2f}'.
-                              format(date, code, price, amount,
-                                     self.available_cash))
-                else:
-                    if verbose ==2:
-                        print('{:%Y-%m-%d} {} {:.2f} 可用资金不足，跳过购买。'.format(
-                            date, code, price))
-            if _sell:
-                amount = self._calc_sell_amount(date,
-                                                code,
-                                                price,
-                                                row=row,
-                                                verbose=verbose)
-                if amount > 0:
-                    commission = self._calc_commission(price, amount)
-                    tax = self._calc_tax(price, amount)
-                    value = price * amount - commission - tax
-                    self.cash.append(self.available_cash + value)
-                    update_history(
-                        self.history,
-                        date,
-                        code,
-                        price,
-                        amount,
-                        self.cash[-1],
-                        commission,
-                        tax,
-                        -1,
-                    )
-                    self.__update_buy_price(date, code, amount, price, -1)
-                    if verbose ==2:
-                        print('{:%Y-%m-%d} {} 卖出 {:.2f}/{:.2f}，剩余资金 {:.2f}'.
-                              format(date, code, price, amount,
-                                     self.available_cash))
-                else:
-                    if verbose ==2:
-                        print('{:%Y-%m-%d} {} 没有持仓，跳过卖出。'.format(date, code))
-        if verbose ==2:
-            print('计算完成！')
-        self._calced = True
+                value = price * amount - commission - tax
+                self._update_history(
+                    date,
+                    code,
+                    price,
+                    amount,
+                    self.available_cash + value,
+                    commission,
+                    tax,
+                    -1,
+                )
+                self.__update_buy_price(date, code, amount, price, -1)
+                if verbose ==2:
+                    print('{:%Y-%m-%d} {} 卖出 {:.2f}/{:.2f}，剩余资金 {:.2f}'.
+                          format(date, code, price, amount,
+                                 self.available_cash))
+            else:
+                if verbose ==2:
+                    print('{:%Y-%m-%d} {} 没有持仓，跳过卖出。'.format(date, code))
+
+    def _signal_only(self):
+        """回调是否全部为只根据日期字典交易的 :py:class:`MinAmountChecker` 或 :py:class:`AllInChecker` 。"""
+        return len(self._calbacks) > 0 and all(
+            type(cb) in (MinAmountChecker, AllInChecker)
+            for cb in self._calbacks)
+
+    def _signal_mask(self, keys, code_ids, date_index, attr):
+        """根据回调中的日期索引计算每行数据是否有交易信号。
+
+        每行数据及每个信号都转换为 (股票代码序号, 日期序号) 组合的整数key，只需要一次 `np.isin` 。
+
+        Args:
+            keys (:py:class:`numpy.ndarray`): 每行数据的组合key（`股票代码序号 * 日期数量 + 日期序号`）。
+            code_ids ({str,int}): 股票代码及其序号。
+            date_index (:py:class:`pandas.Index`): 所有不重复的日期（纳秒时间戳），位置为日期序号。
+            attr (str): 日期索引的属性名（`_buy_index` 或 `_sell_index`）。
+
+        Returns:
+            :py:class:`numpy.ndarray`: 布尔类型的信号。
+        """
+        signals = []
+        for cb in self._calbacks:
+            for code, values in getattr(cb, attr).items():
+                if len(values) == 0 or code not in code_ids:
+                    continue
+                ids = date_index.get_indexer(
+                    np.fromiter(values, dtype=np.int64, count=len(values)))
+                signals.append(code_ids[code] * len(date_index) +
+                               ids[ids >= 0])
+        if not signals:
+            return np.zeros(len(keys), dtype=bool)
+        return np.isin(keys, np.concatenate(signals))
+
+    def _calc_signal(self, bssd_buy, bssd_sell):
+        """`signal` 计算引擎。参考 :py:func:`calc_trade_history` 。"""
+        columns = _ColumnStore(self.data, self._row_columns())
+        dates = columns['date']
+        codes = columns['code']
+        prices = columns[self._colname]
+        date_values = pd.to_datetime(self.data['date']).values.astype(
+            'datetime64[ns]').astype(np.int64)
+        active = date_values >= pd.Timestamp(self._live_start_date).value
+        code_codes, code_uniques = pd.factorize(self.data['code'].values)
+        date_codes, date_uniques = pd.factorize(date_values)
+        keys = code_codes.astype(np.int64) * len(date_uniques) + date_codes
+        code_ids = {code: i for i, code in enumerate(code_uniques)}
+        date_index = pd.Index(date_uniques)
+        buy = self._signal_mask(keys, code_ids, date_index,
+                                '_buy_index') & active
+        sell = self._signal_mask(keys, code_ids, date_index,
+                                 '_sell_index') & active
+        both = buy & sell
+        buy &= ~both | bssd_buy
+        sell &= ~both | bssd_sell
+        rows = np.flatnonzero(buy | sell)
+        start = 0
+        if len(self._calbacks) == 1 and type(
+                self._calbacks[0]) is MinAmountChecker:
+            start = self._calc_signal_prefix(rows, buy, sell, columns)
+        for i in tqdm(rows[start:], desc='回测计算中...'):
+            self._on_row(dates[i], codes[i], prices[i],
+                         _ColumnarRow(columns, i), 0, bssd_buy, bssd_sell)
+        # 没有信号的数据行不会逐行处理，按数据顺序补齐每个股票代码最后一次出现的价格
+        last = np.zeros(len(code_uniques), dtype=np.int64)
+        np.maximum.at(last, code_codes[code_codes >= 0],
+                      np.flatnonzero(code_codes >= 0))
+        self._last_price.update(
+            zip(code_uniques, np.asarray(prices)[last].tolist()))
+
+    def _calc_signal_prefix(self, rows, buy, sell, columns):
+        """一次性计算只有一个 :py:class:`MinAmountChecker` 回调时，资金充足部分的成交。
+
+        每次买入、卖出数量都是 `min_amount` ，持仓（以 `min_amount` 为单位）的变化与资金无关，
+        假设所有买入都成交时，剩余资金为成交金额的累计和。第一次资金不足的买入之前的成交都是确定的。
+
+        Returns:
+            int: 已经计算完成的信号行数（`rows` 中的位置）。
+        """
+        cb = self._calbacks[0]
+        codes = self.data['code'].values
+        prices = np.asarray(columns[self._colname], dtype=float)
+        ev_rows = np.repeat(rows, 2)
+        ev_toward = np.tile([1, -1], len(rows))
+        keep = np.where(ev_toward == 1, buy[ev_rows], sell[ev_rows])
+        ev_rows = ev_rows[keep]
+        ev_toward = ev_toward[keep]
+        if len(ev_rows) == 0:
+            return len(rows)
+        ev_codes = pd.Series(codes[ev_rows])
+        uniques = ev_codes.unique()
+        lots = ev_codes.map({c: cb.min_amount(c) for c in uniques}).values
+        holds = ev_codes.map({
+            c: self.__get_buy_avg_price(c)[1]
+            for c in uniques
+        }).values
+        # 以 min_amount 为单位的持仓满足 u[k]=max(u[k-1]+x[k],0)，
+        # 其解为 u[k]=S[k]-min(-u[0],min(S[1..k]))，S 为 x 的累计和。
+        units0 = holds // lots
+        csum = pd.Series(ev_toward).groupby(ev_codes).cumsum()
+        cmin = csum.groupby(ev_codes).cummin().values
+        units = csum.values - np.minimum(-units0, cmin)
+        units_prev = pd.Series(units).groupby(ev_codes).shift(1).fillna(
+            pd.Series(units0)).values
+        traded = (ev_toward == 1) | (units_prev >= 1)
+        ev_rows = ev_rows[traded]
+        ev_toward = ev_toward[traded]
+        lots = lots[traded]
+
+        p = prices[ev_rows]
+        value = p * lots
+        commission = np.maximum(value * self.commission_coeff,
+                                self.min_commission)
+        tax = value * self.tax_coeff
+        delta = np.where(ev_toward == 1, -(value + commission + tax),
+                         value - commission - tax)
+        cash = np.cumsum(np.concatenate([[self.available_cash], delta]))
+        cash_before = cash[:-1]
+        cb_value = value + np.maximum(value * cb.commission_coeff,
+                                      cb.min_commission) + value * cb.tax_coeff
+        infeasible = (ev_toward == 1) & ~((cb_value <= cash_before) &
+                                          (value + commission + tax <=
+                                           cash_before) & (lots > 0))
+        end = np.argmax(infeasible) if infeasible.any() else len(ev_rows)
+
+        for i, toward, amount, cash_cur in zip(ev_rows[:end].tolist(),
+                                               ev_toward[:end].tolist(),
+                                               lots[:end].tolist(),
+                                               cash[1:end + 1].tolist()):
+            date, code, price = columns['date'][i], columns['code'][
+                i], columns[self._colname][i]
+            self._update_history(date, code, price, amount, cash_cur,
+                                 self._calc_commission(price, amount),
+                                 self._calc_tax(price, amount), toward)
+            self.__update_buy_price(date, code, amount, price, toward)
+        if end == len(ev_rows):
+            return len(rows)
+        return np.searchsorted(rows, ev_rows[end])
 
     def _calc_total_tax(self) -> float:
-        return np.asarray(
-            self.history).T[6].sum() if len(self.history) > 0 else 0
+        return self.history['tax'].sum()
 
     def _calc_total_commission(self) -> float:
-        return np.asarray(
-            self.history).T[5].sum() if len(self.history) > 0 else 0
+        return self.history['commission'].sum()
 
     def report(self, **kwargs):
         """获取计算结果
@@ -1072,8 +2005,8 @@ class BackTest():
             000002 2020-05-12 2020-05-14        3.3        3.51     200   0.063636       42.0   2 days
             000001 2020-05-12 2020-07-11        5.4        4.30     100  -0.203704     -110.0  60 days
         """
-        return BackTest._pnl_fifo(self.history_df,
-                                  self.history_df.code.unique())
+        history_df = self.history_df
+        return BackTest._pnl_fifo(history_df, history_df.code.unique())
 
     @staticmethod
     def _pnl_fifo(history_df, code):
@@ -1110,79 +2043,69 @@ class BackTest():
             000002 2020-05-12 2020-05-14        3.3        3.51     200   0.063636       42.0   2 days
             000001 2020-05-12 2020-07-11        5.4        4.30     100  -0.203704     -110.0  60 days
         """
-        from collections import deque
-        X = dict(
-            zip(code, [{
-                'buy': deque(),
-                'sell': deque()
-            } for i in range(len(code))]))
-        pair_table = []
-        for _, data in history_df.iterrows():
-            if abs(data.amount) < 1:
-                pass
-            else:
-                while True:
-                    if data.amount > 0:
-                        X[data.code]['buy'].append(
-                            (data.datetime, data.amount, data.price, 1))
-                        break
-                    elif data.amount < 0:
-                        rawoffset = 'buy'
-                        l = X[data.code][rawoffset].popleft()
-                        if abs(l[1]) > abs(data.amount):
-                            """
-                            if raw> new_close:
-                            """
-                            temp = (l[0], l[1] + data.amount, l[2])
-                            X[data.code][rawoffset].appendleft(temp)
-                            if data.amount < 0:
-                                pair_table.append([
-                                    data.code, data.datetime, l[0],
-                                    abs(data.amount), data.price, l[2],
-                                    rawoffset
-                                ])
-                                break
-                            else:
-                                pair_table.append([
-                                    data.code, l[0], data.datetime,
-                                    abs(data.amount), l[2], data.price,
-                                    rawoffset
-                                ])
-                                break
-
-                        elif abs(l[1]) < abs(data.amount):
-                            data.amount = data.amount + l[1]
-
-                            if data.amount < 0:
-                                pair_table.append([
-                                    data.code, data.datetime, l[0], l[1],
-                                    data.price, l[2], rawoffset
-                                ])
-                            else:
-                                pair_table.append([
-                                    data.code, l[0], data.datetime, l[1], l[2],
-                                    data.price, rawoffset
-                                ])
-                        else:
-                            if data.amount < 0:
-                                pair_table.append([
-                                    data.code, data.datetime, l[0],
-                                    abs(data.amount), data.price, l[2],
-                                    rawoffset
-                                ])
-                                break
-                            else:
-                                pair_table.append([
-                                    data.code, l[0], data.datetime,
-                                    abs(data.amount), l[2], data.price,
-                                    rawoffset
-                                ])
-                                break
-        pair_title = [
-            'code', 'sell_date', 'buy_date', 'amount', 'sell_price',
-            'buy_price', 'rawdirection'
-        ]
-        pnl = pd.DataFrame(pair_table, columns=pair_title)
+        df = history_df[(history_df['amount'].abs() >= 1)
+                        & history_df['code'].isin(code)]
+        amount_dtype = df['amount'].dtype
+        keys = pd.factorize(df['code'])[0]
+        # 按股票代码排序（同一代码内保持原有顺序）后，以累计买入数量划分每笔买入的数量区间。
+        # 后一个股票代码的区间接在前一个股票代码的累计买入总量之后，所有区间在同一个有序数组中。
+        order = np.argsort(keys, kind='stable')
+        k = keys[order]
+        amt = df['amount'].values[order].astype(np.float64)
+        buy_q = np.where(amt > 0, amt, 0)
+        sell_q = np.where(amt < 0, -amt, 0)
+        cum_buy = np.cumsum(buy_q)
+        cum_sell = np.cumsum(sell_q)
+        n = k.max() + 1 if len(k) > 0 else 0
+        bought = np.bincount(k, weights=buy_q, minlength=n)
+        sold = np.bincount(k, weights=sell_q, minlength=n)
+        code_end = np.cumsum(bought)
+        buy_base = code_end - bought
+        sell_base = np.cumsum(sold) - sold
+
+        is_buy = amt > 0
+        b_end = cum_buy[is_buy]
+        b_start = b_end - buy_q[is_buy]
+        b_pos = order[is_buy]
+        # 卖出的数量区间与同一股票代码的买入区间对齐，并按原有顺序排列
+        is_sell = amt < 0
+        s_pos = order[is_sell]
+        s_key = k[is_sell]
+        s_end = cum_sell[is_sell] - sell_base[s_key] + buy_base[s_key]
+        s_start = s_end - sell_q[is_sell]
+        s_end = np.minimum(s_end, code_end[s_key])
+        s_start = np.minimum(s_start, s_end)
+        s_order = np.argsort(s_pos, kind='stable')
+        s_pos, s_start, s_end = s_pos[s_order], s_start[s_order], s_end[
+            s_order]
+
+        # 每笔卖出对应的买入区间为 [first, last)
+        first = np.searchsorted(b_end, s_start, side='right')
+        last = np.searchsorted(b_start, s_end, side='left')
+        counts = np.maximum(last - first, 0)
+        sell_idx = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        buy_idx = np.repeat(first, counts) + offsets
+        pair_amount = np.minimum(s_end[sell_idx], b_end[buy_idx]) - np.maximum(
+            s_start[sell_idx], b_start[buy_idx])
+        valid = pair_amount > 0
+        sell_idx, buy_idx, pair_amount = sell_idx[valid], buy_idx[
+            valid], pair_amount[valid]
+        if np.issubdtype(amount_dtype, np.integer):
+            pair_amount = pair_amount.astype(amount_dtype)
+
+        sell_rows = df.iloc[s_pos[sell_idx]]
+        buy_rows = df.iloc[b_pos[buy_idx]]
+        pnl = pd.DataFrame({
+            'code': sell_rows['code'].values,
+            'sell_date': sell_rows['datetime'].values,
+            'buy_date': buy_rows['datetime'].values,
+            'amount': pair_amount,
+            'sell_price': sell_rows['price'].values,
+            'buy_price': buy_rows['price'].values,
+            'rawdirection': 'buy'
+        })
 
         pnl = pnl.assign(
             # unit=1,
@@ -1,3 +1,11 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from finance_tools_py.panel import Panel
+
+
 def position_unit(price, v, funds):
     """计算头寸单位
 
@@ -57,3 +65,230 @@ def fluidity(data):
     df = df_amount_mean.join(df_ret_std)
     df['v'] = df['amount_mean_sorted'] + df['rets_std_sorted']
     return df.sort_values('v')
+
+
+def _rank(values, valid, participating):
+    """按行计算 `values` 正向排序后的位置。无效值排在有效值之后，不参与排序的股票排在最后。相同值按股票代码顺序。"""
+    category = np.where(participating, np.where(valid, 0, 1), 2)
+    order = np.lexsort((np.where(valid, values, 0), category), axis=-1)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order,
+                      np.broadcast_to(np.arange(order.shape[-1]), order.shape),
+                      axis=-1)
+    return ranks
+
+
+def fluidity_windows(data, windows):
+    """一次计算多个时间窗口的流动性。
+
+    每个时间窗口的计算规则与 :py:func:`fluidity` 相同。成交量平均值及日回报标准差由每支股票的 `amount` 、 `rets` 、 `rets²` 的累计和计算，
+    每个时间窗口只需要按日期二分查找起止位置，所有时间窗口的排名同时计算。
+
+    排名相同时按成交量平均值的排名排序，成交量平均值也相同时按股票代码排序。
+    :py:func:`fluidity` 中的排序不保证相同值的顺序，股票数量较多且排名相同时两者的顺序可能不同。
+
+    Args:
+        data: 包含 `code` 、 `date` 、 `amount` 、 `rets` 列的数据。
+            可以是 :py:class:`pandas.DataFrame` （index[0]为股票代码,index[1]为日期时也可以），也可以是 :py:class:`finance_tools_py.panel.Panel` 。
+        windows ([(start, end)]): 时间窗口集合。起止日期都包含在时间窗口内，为 `None` 时表示不限制。
+
+    Examples:
+        >>> from finance_tools_py.calc import fluidity_windows
+        >>> for df in fluidity_windows(data, [('2005-01-01', '2005-12-31'), ('2006-01-01', '2006-12-31')]):
+        >>>     print(df.index[:10])  # 每年流动性最大的10支股票
+
+    Returns:
+        [:py:class:`pandas.DataFrame`]: 与 `windows` 顺序一致的计算结果。格式与 :py:func:`fluidity` 的返回值相同，
+        只包含时间窗口内有数据的股票。
+    """
+    panel = data if isinstance(data, Panel) else Panel(data)
+    codes = np.array(panel.codes, dtype=object)
+    if not len(windows) or not len(codes):
+        return [_fluidity_frame(codes[:0], *([np.array([])] * 4))
+                for w in windows]
+    amount = panel.data['amount'].values.astype(float)
+    rets = panel.data['rets'].values.astype(float)
+    starts = np.array([panel.offsets(c)[0] for c in codes])
+    stops = np.array([panel.offsets(c)[1] for c in codes])
+    code_idx = np.repeat(np.arange(len(codes)), stops - starts)
+
+    # (股票序号, 日期序号) 组成的递增key，用来同时查找所有股票的起止位置
+    dates, date_idx = np.unique(panel._dates, return_inverse=True)
+    key = code_idx * (len(dates) + 1) + date_idx
+    lower = np.array([
+        0 if start is None else np.searchsorted(
+            dates, np.datetime64(pd.Timestamp(start), 'ns'), 'left')
+        for start, end in windows
+    ])
+    upper = np.array([
+        len(dates) if end is None else np.searchsorted(
+            dates, np.datetime64(pd.Timestamp(end), 'ns'), 'right')
+        for start, end in windows
+    ])
+    base = np.arange(len(codes)) * (len(dates) + 1)
+    j0 = np.searchsorted(key, base[None, :] + lower[:, None], 'left')
+    j1 = np.searchsorted(key, base[None, :] + upper[:, None], 'left')
+
+    def window_sum(values):
+        c = np.r_[0, np.cumsum(values)]
+        return c[j1] - c[j0]
+
+    valid_amount = ~np.isnan(amount)
+    n_amount = window_sum(valid_amount)
+    amount_mean = window_sum(np.where(valid_amount, amount, 0)) / np.where(
+        n_amount > 0, n_amount, 1)
+
+    # 减去每支股票的平均值后再累计，减少计算方差时的误差
+    valid_rets = ~np.isnan(rets)
+    rets0 = np.where(valid_rets, rets, 0)
+    shift = np.add.reduceat(rets0, starts) / np.maximum(
+        np.add.reduceat(valid_rets, starts), 1) if len(rets) else rets0
+    rets0 = np.where(valid_rets, rets0 - np.repeat(shift, stops - starts), 0)
+    n_rets = window_sum(valid_rets)
+    s1 = window_sum(rets0)
+    s2 = window_sum(rets0 * rets0)
+    var = (s2 - s1 * s1 / np.where(n_rets > 0, n_rets, 1)) / np.where(
+        n_rets > 1, n_rets - 1, 1)
+    rets_std = np.sqrt(np.maximum(var, 0))
+
+    participating = j1 > j0
+    valid_amount = n_amount > 0
+    valid_std = n_rets > 1
+    amount_rank = _rank(-amount_mean, valid_amount, participating)
+    std_rank = _rank(rets_std, valid_std, participating)
+    v = amount_rank + std_rank
+    order = np.lexsort((amount_rank, v, ~participating), axis=-1)
+
+    result = []
+    for w in range(len(windows)):
+        idx = order[w, :participating[w].sum()]
+        result.append(
+            _fluidity_frame(codes[idx], amount_rank[w, idx],
+                            np.where(valid_amount[w, idx], amount_mean[w, idx],
+                                     np.nan), std_rank[w, idx],
+                            np.where(valid_std[w, idx], rets_std[w, idx],
+                                     np.nan)))
+    return result
+
+
+def _fluidity_frame(codes, amount_rank, amount_mean, std_rank, rets_std):
+    """:py:func:`fluidity` 格式的计算结果"""
+    amount_rank = np.asarray(amount_rank, dtype=np.int64)
+    std_rank = np.asarray(std_rank, dtype=np.int64)
+    return pd.DataFrame(
+        {
+            'amount_mean_sorted': amount_rank,
+            'amount': amount_mean,
+            'rets_std_sorted': std_rank,
+            'rets': rets_std,
+            'v': amount_rank + std_rank
+        },
+        index=pd.Index(codes, name='code'))
+
+
+def buy_cost(price,
+             amount,
+             commission_coeff=0.001,
+             min_commission=5,
+             tax_coeff=0.001):
+    """计算买入时实际花费的金额（成交金额+手续费+印花税）。
+
+    手续费为 `max(成交金额*commission_coeff, min_commission)` 。支持 :py:class:`numpy.ndarray` 参数。
+
+    Args:
+        price (float): 买入价格。
+        amount (int): 买入数量。
+        commission_coeff (float): 手续费费率。默认为 `0.001` 。
+        min_commission (float): 最小手续费。默认为 `5` 。
+        tax_coeff (float): 印花税费率。默认为 `0.001` 。
+
+    Examples:
+        >>> from finance_tools_py.calc import buy_cost
+        >>> buy_cost(10, 100)
+        1006.0
+
+    Returns:
+        float: 实际花费的金额。
+    """
+    value = price * amount
+    return value + np.maximum(value * commission_coeff,
+                              min_commission) + value * tax_coeff
+
+
+def max_buy_amount(price,
+                   cash,
+                   lot=100,
+                   commission_coeff=0.001,
+                   min_commission=5,
+                   tax_coeff=0.001):
+    """计算使用 `cash` 最多可以买入的数量（ `lot` 的整数倍）。计算时包含手续费及印花税。
+
+    实际花费为 `max(v*(1+commission_coeff+tax_coeff), v*(1+tax_coeff)+min_commission)` （ `v` 为成交金额），
+    所以最大成交金额为 `min(cash/(1+commission_coeff+tax_coeff), (cash-min_commission)/(1+tax_coeff))` ，
+    据此直接算出数量，再使用 :py:func:`buy_cost` 按逐笔计算的方式校正浮点误差，结果与逐次增加 `lot` 的计算方式一致。
+
+    所有参数都支持 :py:class:`numpy.ndarray` ，可以一次计算整个信号序列的买入数量。
+
+    Args:
+        price (float): 买入价格。价格小于等于0时返回0。
+        cash (float): 可用现金。
+        lot (int): 每手数量。默认为 `100` 。
+        commission_coeff (float): 手续费费率。默认为 `0.001` 。
+        min_commission (float): 最小手续费。默认为 `5` 。
+        tax_coeff (float): 印花税费率。默认为 `0.001` 。
+
+    Examples:
+        >>> from finance_tools_py.calc import max_buy_amount
+        >>> max_buy_amount(10, 10000)
+        900
+        >>> max_buy_amount(np.array([10, 20, 3.5]), 10000)
+        array([ 900,  400, 2800])
+
+    Returns:
+        int 或 :py:class:`numpy.ndarray`: 最多可以买入的数量。
+    """
+    args = (commission_coeff, min_commission, tax_coeff)
+    if all(np.ndim(v) == 0 for v in (price, cash, lot) + args):
+        return _max_buy_amount_scalar(price, cash, lot, *args)
+    price, cash, lot = np.broadcast_arrays(
+        np.asarray(price, dtype=float), np.asarray(cash, dtype=float),
+        np.asarray(lot))
+    valid = (price > 0) & (lot > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = np.minimum(cash / (1 + commission_coeff + tax_coeff),
+                           (cash - min_commission) / (1 + tax_coeff))
+        lots = np.floor(value / (price * lot))
+    lots = np.where(valid & (lots > 0), lots, 0).astype(np.int64)
+    # 校正浮点误差，保证结果与逐笔计算时的判断条件一致
+    while True:
+        over = (lots > 0) & (buy_cost(price, lots * lot, *args) > cash)
+        if not over.any():
+            break
+        lots = lots - over
+    while True:
+        under = valid & (buy_cost(price, (lots + 1) * lot, *args) <= cash)
+        if not under.any():
+            break
+        lots = lots + under
+    return lots * lot
+
+
+def _max_buy_amount_scalar(price, cash, lot, commission_coeff, min_commission,
+                           tax_coeff):
+    """:py:func:`max_buy_amount` 的标量版本。避免逐笔回测时 numpy 的调用开销。"""
+    def cost(amount):
+        value = price * amount
+        return value + max(value * commission_coeff,
+                           min_commission) + value * tax_coeff
+
+    if not (price > 0 and lot > 0 and math.isfinite(cash)):
+        return 0 * lot
+    value = min(cash / (1 + commission_coeff + tax_coeff),
+                (cash - min_commission) / (1 + tax_coeff))
+    lots = max(int(math.floor(value / (price * lot))), 0)
+    # 校正浮点误差，保证结果与逐笔计算时的判断条件一致
+    while lots > 0 and cost(lots * lot) > cash:
+        lots -= 1
+    while cost((lots + 1) * lot) <= cash:
+        lots += 1
+    return lots * lot
@@ -0,0 +1,121 @@
+"""随机买入点的蒙特卡洛回测。
+
+每次试验从数据中随机抽取买入点进行一次回测（:py:class:`finance_tools_py.backtest.BackTest` ），
+多次试验的结果可以作为策略的比较基准。
+"""
+import numpy as np
+import pandas as pd
+
+from finance_tools_py._pool import imap_shared
+from finance_tools_py.backtest import BackTest
+from finance_tools_py.backtest import MinAmountChecker
+
+
+def _min_amount_checker(buys):
+    return [MinAmountChecker(buys, {})]
+
+
+def trial_rng(entropy, trial):
+    """第 `trial` 次试验使用的随机数生成器。
+
+    与 `numpy.random.SeedSequence(entropy).spawn(n)[trial]` 生成的随机数序列相同，
+    每次试验的随机数只取决于 `entropy` 及 `trial` ，与试验的执行顺序及进程数无关。
+
+    Args:
+        entropy (int): 随机数种子。
+        trial (int): 试验序号。
+
+    Returns:
+        :py:class:`numpy.random.Generator`: 随机数生成器。
+    """
+    return np.random.default_rng(
+        np.random.SeedSequence(entropy, spawn_key=(trial, )))
+
+
+def _run_trial(shared, trial):
+    """在子进程中执行一次随机买入点的回测"""
+    (data, codes, dates, buy_times, entropy, callbacks, keep_history,
+     bt_kwargs, trade_kwargs) = shared
+    rng = trial_rng(entropy, trial)
+    buys = {}
+    for i in rng.choice(len(codes), buy_times):
+        buys.setdefault(codes[i], []).append(dates[i])
+    bt = BackTest(data, callbacks=callbacks(buys), **bt_kwargs)
+    bt.calc_trade_history(**trade_kwargs)
+    result = {
+        'trial': trial,
+        'total_assets': bt.total_assets_cur,
+        'available_cash': bt.available_cash,
+        'trades': len(bt.history),
+    }
+    if keep_history:
+        result['history'] = bt.history_df
+    return result
+
+
+def iter_random_entry(data, times=100, buy_times=50, n_jobs=None, **kwargs):
+    """在进程池中执行 `times` 次随机买入点的回测，以生成器的方式按试验序号逐个返回每次试验的结果。
+
+    子进程通过 `fork` 直接继承输入数据，不会随每次试验序列化数据。每次试验只返回汇总数据，
+    调用方处理完一次试验的结果后再读取下一次，试验次数较多（例如10000次以上）时内存占用也不会增加。
+
+    Args:
+        data (:py:class:`pandas.DataFrame`): 所有股票完整数据。需要满足 :py:class:`finance_tools_py.backtest.BackTest` 对数据的要求。
+        times (int): 试验次数。默认为100。
+        buy_times (int): 每次试验从 `buy_data` 中随机抽取买入点的次数（可重复抽取）。默认为50。
+        n_jobs (int): 进程数。为 `None` 或小于等于0时使用所有的CPU核心。为1时在当前进程中计算。
+        seed (int): 随机数种子。参考 :py:func:`trial_rng` 。默认为 `None` ，随机生成种子。
+        buy_data (:py:class:`pandas.DataFrame`): 计算买入时间点的数据集。默认为 `data` 。其中最少需要包含 `date` 和 `code` 列。
+        callbacks: 按买入日期字典创建回测回调集合的函数。
+            默认创建 :py:class:`finance_tools_py.backtest.MinAmountChecker` （不卖出）。
+        keep_history (bool): 是否在结果中包含成交明细（ `history` ）。默认为 `False` 。
+        engine (str): 回测计算引擎。参考 :py:func:`finance_tools_py.backtest.BackTest.calc_trade_history` 。默认为 `signal` 。
+        trade_kwargs (dict): 传递给 :py:func:`finance_tools_py.backtest.BackTest.calc_trade_history` 的其他参数。
+        kwargs: 其他参数传递给 :py:class:`finance_tools_py.backtest.BackTest` 。例如 `init_cash` 等。
+            `init_cash` 默认为50000。
+
+    Examples:
+        >>> from finance_tools_py.montecarlo import iter_random_entry
+        >>> total = 0
+        >>> for r in iter_random_entry(data, times=10000, seed=1234):
+        >>>     total += r['total_assets']
+
+    Yields:
+        dict: 每次试验的结果。包含 `trial` （试验序号）、 `total_assets` （期末总资产）、
+        `available_cash` （可用资金）、 `trades` （交易次数）。 `keep_history` 为 `True` 时包含 `history` （成交明细）。
+    """
+    seed = kwargs.pop('seed', None)
+    buy_data = kwargs.pop('buy_data', data)
+    callbacks = kwargs.pop('callbacks', _min_amount_checker)
+    keep_history = kwargs.pop('keep_history', False)
+    trade_kwargs = dict(kwargs.pop('trade_kwargs', {}))
+    trade_kwargs.setdefault('engine', kwargs.pop('engine', 'signal'))
+    kwargs.setdefault('init_cash', 50000)
+    entropy = np.random.SeedSequence(seed).entropy
+    shared = (data, buy_data['code'].tolist(), buy_data['date'].tolist(),
+              buy_times, entropy, callbacks, keep_history, kwargs,
+              trade_kwargs)
+    return imap_shared(_run_trial,
+                       shared,
+                       range(times),
+                       n_jobs=n_jobs,
+                       total=times,
+                       desc='随机回测中...')
+
+
+def random_entry(data, times=100, buy_times=50, n_jobs=None, **kwargs):
+    """执行 `times` 次随机买入点的回测，返回所有试验的结果。
+
+    Args:
+        参考 :py:func:`iter_random_entry` 。
+
+    Examples:
+        >>> from finance_tools_py.montecarlo import random_entry
+        >>> result = random_entry(data, times=1000, buy_times=50, seed=1234, init_cash=50000)
+        >>> result['total_assets'].mean()
+
+    Returns:
+        :py:class:`pandas.DataFrame`: 每次试验为一行。列参考 :py:func:`iter_random_entry` 的返回值。
+    """
+    return pd.DataFrame(
+        list(iter_random_entry(data, times, buy_times, n_jobs, **kwargs)))
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+
+class Panel():
+    """按 (股票代码, 日期) 排序保存的多支股票数据。
+
+    初始化时对数据排序一次，同时记录每支股票在数据中的起止位置。按股票代码及日期截取数据时只需要二分查找，
+    返回的是排序后数据的切片（不复制数据）。
+
+    :py:class:`finance_tools_py.simulation.Simulation` 、 :py:func:`finance_tools_py.simulation.simulate_many` 、
+    :py:class:`finance_tools_py.backtest.BackTest` 可以直接使用 :py:class:`Panel` 作为数据源。
+
+    Attributes:
+        data (:py:class:`pandas.DataFrame`): 按 (股票代码, 日期) 排序后的数据。索引为行号。
+        col_code (str): 股票代码的列名。
+        col_date (str): 日期的列名。
+
+    Example:
+        >>> from finance_tools_py.panel import Panel
+        >>> panel = Panel(fulldata)  # fulldata 的 index[0]为股票代码,index[1]为日期
+        >>> panel.slice('600036', '2019-01-01', '2019-12-31')
+        >>> panel.window('2019-01-01', '2019-12-31')  # 所有股票2019年的数据
+    """
+    def __init__(self, data, col_code='code', col_date='date'):
+        """初始化
+
+        Args:
+            data (:py:class:`pandas.DataFrame`): 多支股票的数据。index[0]为股票代码,index[1]为日期；
+                或者包含 `col_code` 列及 `col_date` 列。
+            col_code (str): 股票代码的列名。默认为 `code` 。
+            col_date (str): 日期的列名。默认为 `date` 。日期列需要为 `datetime64` 类型。
+        """
+        if isinstance(data.index, pd.MultiIndex):
+            data = data.reset_index()
+        self.data = data.sort_values([col_code, col_date],
+                                     kind='mergesort').reset_index(drop=True)
+        self.col_code = col_code
+        self.col_date = col_date
+        self._dates = self.data[col_date].values.astype('datetime64[ns]')
+        codes = self.data[col_code].values
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]
+                                ) if len(codes) else np.array([], dtype=int)
+        stops = np.r_[starts[1:], len(codes)].astype(int)
+        self._offsets = {
+            code: (start, stop)
+            for code, start, stop in zip(codes[starts].tolist(),
+                                         starts.tolist(), stops.tolist())
+        }
+        self._by_date = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, code):
+        return code in self._offsets
+
+    @property
+    def codes(self):
+        """股票代码集合。按股票代码排序。"""
+        return list(self._offsets.keys())
+
+    def offsets(self, code):
+        """股票 `code` 的数据在 :py:attr:`data` 中的起止位置。
+
+        Returns:
+            (int,int): 起始位置（包含）及结束位置（不包含）。没有数据时返回 `(0, 0)` 。
+        """
+        return self._offsets.get(code, (0, 0))
+
+    def _range(self, code, start, end):
+        i0, i1 = self.offsets(code)
+        dates = self._dates[i0:i1]
+        j0 = i0 if start is None else i0 + int(
+            np.searchsorted(dates, np.datetime64(pd.Timestamp(start), 'ns'),
+                            'left'))
+        j1 = i1 if end is None else i0 + int(
+            np.searchsorted(dates, np.datetime64(pd.Timestamp(end), 'ns'),
+                            'right'))
+        return j0, j1
+
+    def slice(self, code, start=None, end=None):
+        """股票 `code` 在 `start` ~ `end` 期间的数据。
+
+        Args:
+            code (str): 股票代码。
+            start: 开始日期（包含）。为 `None` 时从第一条数据开始。
+            end: 结束日期（包含）。为 `None` 时到最后一条数据结束。
+
+        Returns:
+            :py:class:`pandas.DataFrame`: :py:attr:`data` 的切片。请不要直接修改返回的数据。
+        """
+        j0, j1 = self._range(code, start, end)
+        return self.data.iloc[j0:j1]
+
+    def window(self, start=None, end=None, codes=None):
+        """多支股票在 `start` ~ `end` 期间的数据。
+
+        Args:
+            start: 开始日期（包含）。为 `None` 时从第一条数据开始。
+            end: 结束日期（包含）。为 `None` 时到最后一条数据结束。
+            codes ([str]): 股票代码集合。默认为 `None` ，所有股票。
+
+        Returns:
+            :py:class:`pandas.DataFrame`: 按 (股票代码, 日期) 排序的数据。
+        """
+        codes = self.codes if codes is None else codes
+        ranges = [self._range(code, start, end) for code in codes]
+        if not ranges:
+            return self.data.iloc[:0]
+        return self.data.take(
+            np.concatenate([np.arange(j0, j1) for j0, j1 in ranges]))
+
+    def by_date(self):
+        """按日期排序的数据。同一日期的数据按股票代码排序。结果会被缓存，请不要直接修改返回的数据。
+
+        Returns:
+            :py:class:`pandas.DataFrame`: 按 (日期, 股票代码) 排序的数据。
+        """
+        if self._by_date is None:
+            order = np.argsort(self._dates, kind='stable')
+            self._by_date = self.data.take(order)
+        return self._by_date
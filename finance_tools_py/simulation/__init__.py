@@ -1,3 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from finance_tools_py import _pool
+from finance_tools_py.panel import Panel
+
+
 class Simulation():
     """模拟类
 
@@ -5,36 +14,64 @@ class Simulation():
         data: 数据源。调用 :func:`simulate` 方法后，会返回处理后的数据集，否则返回原始数据集。
         symbol: 股票代码
         callbacks: 处理数据时会使用到的回调 :class:`callbacks.CallBack` 集合。
+        cache: 回调计算结果的缓存 :class:`cache.IndicatorCache` 。
+        copy: 是否复制数据源。
 
     """
-    def __init__(
-            self,
-            data,
-            symbol,
-            callbacks=[],
-    ):
+    def __init__(self, data, symbol, callbacks=[], cache=None, copy=True):
         """初始化
 
         Args:
-            data (:class:`pandas.DataFrame`): 数据源，
+            data (:class:`pandas.DataFrame`): 数据源。
+                也可以传入 :class:`finance_tools_py.panel.Panel` ，此时数据源为 `symbol` 的数据切片。
             symbol (str): 股票代码。
             callbacks: 处理数据时会使用到的回调 :class:`callbacks.CallBack` 集合。
+            cache (:class:`cache.IndicatorCache`): 回调计算结果的缓存。
+                输入数据及回调参数相同时直接使用缓存中的计算结果。默认为 `None` ，不使用缓存。
+            copy (bool): 是否复制数据源。默认为 `True` 。
+                为 `False` 时 :attr:`data` 与数据源共享已有列的数据，只有回调生成的新列会占用新的内存。
+                新列不会附加到数据源中，但回调对已有列数据的原地修改会影响数据源。
+                适用于数据源只是临时数据（例如按股票筛选后的数据）的场合。
         """
-        self.data = data.copy()
+        if isinstance(data, Panel):
+            data = data.slice(symbol)
+        self.data = data.copy(deep=copy)
         self.symbol = symbol
         self.callbacks = callbacks
+        self.cache = cache
+        self.copy = copy
 
     def simulate(self, **kwargs):
         """执行模拟计算。默认使用 :attr:`callbacks` 回调生成的数据。
 
+        回调通过 :py:meth:`callbacks.CallBack.input_columns` 及 :py:meth:`callbacks.CallBack.output_columns`
+        声明读取及生成的列，据此建立回调之间的依赖关系（DAG）。
+
         Args:
             reset_index (bool): 是否对 :attr:`data` 做 :meth:`pandas.DataFrame.reset_index` 处理。
                 默认为 `True`。
+            columns ([str]): 需要计算的列名集合。设置后只执行生成这些列（及其依赖列）的回调，
+                其他回调生成的列不会出现在结果中。未声明生成列的回调总是会被执行。默认为 `None` ，执行所有回调。
+            n_jobs (int): 同时计算的线程数。大于1时，互不依赖的回调会在线程池中同时计算。默认为1。
+
+        Examples:
+            >>> s = Simulation(data, '600036',
+            >>>                callbacks=[SMA(5), Rolling_Future(5), ATR(20)])
+            >>> s.simulate(columns=['atr_20'])  # 只计算ATR
         """
-        self.__parse_data(**kwargs)
+        columns = kwargs.pop('columns', None)
+        n_jobs = kwargs.pop('n_jobs', 1)
+        callbacks = self.callbacks
+        if columns is not None:
+            callbacks = self._required(columns)
+        if n_jobs is not None and n_jobs > 1:
+            self.__parse_data_concurrent(callbacks, n_jobs, **kwargs)
+        else:
+            self.__parse_data(callbacks, **kwargs)
         if not self.data.empty:
             if kwargs.pop('reset_index', True):
-                self.data = self.data.reset_index()
+                # data 已经是独立的 DataFrame，原地处理以避免再次复制所有的列
+                self.data.reset_index(inplace=True)
 
     # def plot_sns(self, **kwargs) -> plt.axes:
     #     """绘制买入卖出信号图像
@@ -58,10 +95,96 @@ class Simulation():
     #                            figsize=figsize,
     #                            annotate_fontsize=annotate_fontsize)
     #
-    def __parse_data(self, **kwargs):
+    def _required(self, columns):
+        """倒序遍历回调，筛选生成 `columns` 所需要执行的回调"""
+        needed = set(columns)
+        required = []
+        for i in range(len(self.callbacks) - 1, -1, -1):
+            cb = self.callbacks[i]
+            outputs = cb.output_columns()
+            if outputs is not None and needed.isdisjoint(outputs):
+                continue
+            required.append(cb)
+            inputs = cb.input_columns()
+            if inputs is None:
+                # 依赖未知时，之前所有的回调都需要执行
+                return self.callbacks[:i] + required[::-1]
+            needed.update(inputs)
+        return required[::-1]
+
+    @staticmethod
+    def _levels(callbacks):
+        """按依赖关系对回调分层，同一层中的回调互不依赖。
+
+        读取列或生成列未知的回调单独成为一层，并且依赖之前所有的回调。
+        """
+        levels = []
+        depth = []
+        barrier = -1
+        for i, cb in enumerate(callbacks):
+            inputs = cb.input_columns()
+            outputs = cb.output_columns()
+            if inputs is None or outputs is None:
+                level = len(levels)
+                barrier = level
+            else:
+                level = barrier + 1
+                for j in range(i):
+                    prev = callbacks[j].output_columns()
+                    if prev is None:
+                        continue
+                    if not set(prev).isdisjoint(inputs) or not set(
+                            prev).isdisjoint(outputs):
+                        level = max(level, depth[j] + 1)
+            depth.append(level)
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(i)
+        return levels
+
+    def _apply(self, cb, data, **kwargs):
+        if self.cache is None:
+            cb.on_preparing_data(data, **kwargs)
+        else:
+            self.cache.apply(cb, data, **kwargs)
+
+    def __parse_data(self, callbacks, **kwargs):
         """读取指定股票的数据"""
-        for cb in self.callbacks:
-            cb.on_preparing_data(self.data, **kwargs)
+        for cb in callbacks:
+            self._apply(cb, self.data, **kwargs)
+
+    def __parse_data_concurrent(self, callbacks, n_jobs, **kwargs):
+        """在线程池中同时计算互不依赖的回调。每个回调只处理自身读取列组成的数据，计算完成后按回调顺序合并结果。"""
+        origin = self.data.columns.tolist()
+        added = [[] for cb in callbacks]
+
+        def run(i):
+            inputs = callbacks[i].input_columns()
+            frame = self.data[[c for c in inputs
+                               if c in self.data.columns]].copy()
+            self._apply(callbacks[i], frame, **kwargs)
+            return frame, [c for c in frame.columns if c not in inputs]
+
+        with ThreadPoolExecutor(n_jobs) as executor:
+            for level in self._levels(callbacks):
+                cb = callbacks[level[0]]
+                if cb.input_columns() is None or cb.output_columns() is None:
+                    before = set(self.data.columns)
+                    self._apply(cb, self.data, **kwargs)
+                    added[level[0]] = [
+                        c for c in self.data.columns if c not in before
+                    ]
+                    continue
+                # 等待同一层的回调全部完成后再合并，避免合并时其他线程仍在读取 data
+                results = list(executor.map(run, level))
+                for i, (frame, names) in zip(level, results):
+                    for name in names:
+                        self.data[name] = frame[name].values
+                    added[i] = names
+        ordered = list(
+            dict.fromkeys(origin + [c for names in added for c in names]))
+        if self.data.columns.tolist() != ordered:
+            self.data = self.data[ordered]
         # self.__query['buy'] = context['buy_query']
         # self.__query['sell'] = context['sell_query']
 
@@ -78,3 +201,87 @@ class Simulation():
     # #         ax.annotate('Sell:{:.2f}\n{}'.format(sell[1], sell[0].strftime('%Y-%m-%d')), sell,
     # #                     fontsize=annotate_fontsize)
     # #     return ax
+
+
+def _simulate_slice(shared, task):
+    """在子进程中对一支股票的数据进行模拟计算。
+
+    `task` 为 (股票代码, 起始位置, 结束位置) 时从共享数据中截取该股票的数据；
+    为 (股票代码, 数据) 时直接使用任务中的数据（不支持 `fork` 的平台）。
+    """
+    data, callbacks, kwargs = shared
+    if len(task) == 3:
+        symbol, start, stop = task
+        data = data.iloc[start:stop]
+    else:
+        symbol, data = task
+    s = Simulation(data, symbol, callbacks=callbacks, copy=False)
+    s.simulate(reset_index=False, **dict(kwargs))
+    return s.data
+
+
+def simulate_many(data, callbacks, n_jobs=1, **kwargs):
+    """在进程池中对多支股票的数据同时进行模拟计算。
+
+    数据只会按股票代码分组一次，每支股票的数据交给 :py:class:`Simulation` 计算，计算结果按股票代码第一次出现的顺序合并。
+    计算结果保留输入数据的索引：每支股票的数据不会单独 `reset_index` ，合并后的结果中索引与输入数据一致（按股票代码分组排列）。
+
+    支持 `fork` 的平台（Linux）上，子进程直接继承输入数据，不需要对输入数据进行序列化，每个任务只传递股票的起止位置。
+    其他平台（Windows、macOS）上使用 `spawn` 启动子进程，每支股票的数据随各自的任务序列化一次，
+    不会将完整的输入数据复制到每个子进程中。此时 `callbacks` 需要可以被序列化（参考 :py:mod:`finance_tools_py._pool` ），
+    无法序列化时给出警告并在当前进程中计算。
+
+    Args:
+        data (:py:class:`pandas.DataFrame`): 包含多支股票的长格式数据。
+            同一支股票的数据需要按计算顺序（通常为日期）排列。
+            也可以传入 :py:class:`finance_tools_py.panel.Panel` ，此时不需要再按股票代码分组，计算结果按股票代码排序。
+        callbacks: 处理数据时会使用到的回调 :class:`callbacks.CallBack` 集合。
+        n_jobs (int): 进程数。为 `None` 或小于等于0时使用所有的CPU核心。为1时在当前进程中计算。默认为1。
+        col_code (str): 股票代码的列名。默认为 `code` 。
+        chunksize (int): 每次分配给子进程的股票数量。默认根据股票数量及进程数计算。
+        reset_index (bool): 是否在合并后对结果做一次 :meth:`pandas.DataFrame.reset_index` 处理，
+            输入数据的索引会成为结果中的列，结果的索引为 `0~n-1` 。默认为 `True`。
+            为 `False` 时结果的索引为输入数据的索引。
+        其他参数会传递给 :py:func:`Simulation.simulate` 。
+
+    Example:
+        >>> from finance_tools_py.simulation import simulate_many
+        >>> from finance_tools_py.simulation.callbacks.talib import SMA
+        >>> result = simulate_many(data, [SMA(5)], n_jobs=8)
+
+    Returns:
+        :py:class:`pandas.DataFrame`: 所有股票计算后的数据。
+    """
+    col_code = kwargs.pop('col_code', 'code')
+    chunksize = kwargs.pop('chunksize', None)
+    reset_index = kwargs.pop('reset_index', True)
+    if isinstance(data, Panel):
+        # Panel 中的数据已经按股票代码排序，直接使用每支股票的起止位置
+        tasks = [(symbol, ) + data.offsets(symbol) for symbol in data.codes]
+        data = data.data
+    else:
+        keys, symbols = pd.factorize(data[col_code])
+        order = np.argsort(keys, kind='stable')
+        order = order[keys[order] >= 0]  # 忽略没有股票代码的数据
+        keys = keys[order]
+        data = data.iloc[order]
+        stops = np.cumsum(np.bincount(keys, minlength=len(symbols)))
+        starts = stops - np.bincount(keys, minlength=len(symbols))
+        tasks = [(symbol, start, stop)
+                 for symbol, start, stop in zip(symbols, starts.tolist(),
+                                                stops.tolist())]
+    shared = data
+    if _pool.cpu_count(n_jobs) > 1 and _pool._start_method != 'fork':
+        # 子进程无法继承输入数据，每支股票的数据随任务传递
+        tasks = [(symbol, data.iloc[start:stop])
+                 for symbol, start, stop in tasks]
+        shared = None
+    dfs = _pool.map_shared(_simulate_slice, (shared, callbacks, kwargs),
+                           tasks,
+                           n_jobs=n_jobs,
+                           chunksize=chunksize,
+                           desc='模拟计算中...')
+    result = pd.concat(dfs) if dfs else data.copy()
+    if reset_index and not result.empty:
+        result.reset_index(inplace=True)
+    return result
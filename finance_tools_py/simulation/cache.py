@@ -0,0 +1,274 @@
+import hashlib
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class IndicatorCache():
+    """指标计算结果的缓存。
+
+    缓存的key值由回调类型、回调参数、输入列及数据窗口的起始行（日期及输入数据的哈希值）组成，
+    value值为回调计算后新增的各列数据，与数据窗口中每一行的日期及输入数据的哈希值一起保存。
+    输入数据及参数都相同时，直接从缓存中读取计算结果，不再调用回调进行计算。
+
+    支持增量计算（ :py:attr:`finance_tools_py.simulation.callbacks.CallBack.supports_incremental` ）的回调，
+    每一行的计算结果只依赖该行及之前的数据行，所以起始行相同的数据窗口之间可以共享计算结果：
+    数据窗口是已缓存的数据窗口的前段（例如先计算到年末，再计算到年中）时直接截取缓存中的数据；
+    数据窗口比已缓存的更长时重新计算，并使用更长的计算结果替换缓存。
+    其他回调（例如需要未来数据的 :py:class:`finance_tools_py.simulation.callbacks.Rolling_Future` ）只有数据窗口完全相同时才会命中缓存。
+    起始行不同的数据窗口不会共享计算结果，递归计算的指标（例如EMA、ATR）的结果与起始行有关。
+
+    回调的输入列为回调 `input_columns` 方法声明的列。未声明时为回调属性中引用的数据列（例如 `col_close` 、 `col_name` 等属性的值），
+    回调属性中没有引用任何数据列时，所有的数据列都会被认为是输入列。
+    数据行的日期为 `date` 列，没有 `date` 列时为索引中的 `date` 级别，都没有时为索引。
+
+    Attributes:
+        max_bytes (int): 内存中缓存的最大字节数。超出时按最近最少使用（LRU）的顺序移除。
+        cache_dir (str): 缓存文件的保存目录。为 `None` 时只在内存中缓存。
+            包含非数值类型（例如字符串）列或日期的计算结果只在内存中缓存。
+        hits (int): 命中缓存的次数。
+        misses (int): 未命中缓存的次数。
+
+    Example:
+        >>> from finance_tools_py.simulation import Simulation
+        >>> from finance_tools_py.simulation.cache import IndicatorCache
+        >>> from finance_tools_py.simulation.callbacks.talib import ATR
+        >>> cache = IndicatorCache(cache_dir='.indicator_cache')
+        >>> s = Simulation(data, '600036', callbacks=[ATR(20)], cache=cache)
+        >>> s.simulate()
+    """
+    def __init__(self, max_bytes=512 * 1024 * 1024, cache_dir=None):
+        """初始化
+
+        Args:
+            max_bytes (int): 内存中缓存的最大字节数。默认为512MB。
+            cache_dir (str): 缓存文件的保存目录。为 `None` 时只在内存中缓存。默认为 `None` 。
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (self._path(key) is not None
+                                        and os.path.exists(self._path(key)))
+
+    @staticmethod
+    def _params(callback):
+        """回调的参数。不包含以 `_` 开头的属性。"""
+        return sorted((k, repr(v)) for k, v in vars(callback).items()
+                      if not k.startswith('_'))
+
+    @staticmethod
+    def input_columns(callback, data):
+        """回调计算时使用的输入列。优先使用回调的 `input_columns` 方法声明的列；
+        未声明时，回调属性中值为数据列名的属性都会被认为是输入列；没有任何属性引用数据列时，返回所有的数据列。
+
+        Args:
+            callback: 回调。
+            data (:py:class:`pandas.DataFrame`): 待处理的数据。
+
+        Returns:
+            [str]: 输入列名集合。
+        """
+        declared = getattr(callback, 'input_columns', None)
+        declared = declared() if callable(declared) else None
+        if declared is not None:
+            return [c for c in declared if c in data.columns]
+        columns = []
+        for k, v in sorted(vars(callback).items()):
+            if isinstance(v, str) and v in data.columns and v not in columns:
+                columns.append(v)
+        return columns if columns else [str(c) for c in data.columns]
+
+    @staticmethod
+    def dates(data):
+        """数据行的日期。
+
+        Args:
+            data (:py:class:`pandas.DataFrame`): 待处理的数据。
+
+        Returns:
+            :py:class:`numpy.ndarray`: `date` 列的数据。没有 `date` 列时为索引中的 `date` 级别，都没有时为索引。
+        """
+        if 'date' in data.columns:
+            return data['date'].values
+        if 'date' in data.index.names:
+            return data.index.get_level_values('date').values
+        return data.index.values
+
+    def row_hashes(self, callback, data):
+        """每一行输入数据的哈希值。
+
+        Args:
+            callback: 回调。
+            data (:py:class:`pandas.DataFrame`): 待处理的数据。
+
+        Returns:
+            :py:class:`numpy.ndarray`: 由各输入列数据计算得到的 `uint64` 数组。
+        """
+        hashes = np.zeros(len(data), dtype=np.uint64)
+        for col in self.input_columns(callback, data):
+            hashes *= np.uint64(1000003)
+            hashes ^= pd.util.hash_array(data[col].values)
+        return hashes
+
+    def key(self, callback, data, hashes=None):
+        """计算缓存的key值。
+
+        Args:
+            callback: 回调。
+            data (:py:class:`pandas.DataFrame`): 待处理的数据。
+            hashes (:py:class:`numpy.ndarray`): 每一行输入数据的哈希值。为 `None` 时使用 :py:meth:`row_hashes` 计算。
+
+        Returns:
+            str: 由回调类型、回调参数、输入列及数据窗口的起始行计算得到的key值。
+            回调不支持增量计算时还包含数据窗口的行数及结束行。
+        """
+        if hashes is None:
+            hashes = self.row_hashes(callback, data)
+        h = hashlib.blake2b(digest_size=20)
+        h.update('{}.{}'.format(type(callback).__module__,
+                                type(callback).__qualname__).encode())
+        h.update(repr(self._params(callback)).encode())
+        h.update(repr(self.input_columns(callback, data)).encode())
+        if len(data):
+            dates = self.dates(data)
+            rows = [0]
+            if not getattr(callback, 'supports_incremental', False):
+                h.update(str(len(data)).encode())
+                rows.append(-1)
+            for row in rows:
+                h.update('{}:{}'.format(dates[row], hashes[row]).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, '{}.npz'.format(key))
+
+    def get(self, key):
+        """读取缓存。
+
+        Args:
+            key (str): 缓存的key值。
+
+        Returns:
+            {str,:py:class:`numpy.ndarray`}: 列名及数据组成的字典。
+            其中 `__dates__` 为每一行的日期， `__hashes__` 为每一行输入数据的哈希值。未命中时返回 `None` 。
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            try:
+                with np.load(path, allow_pickle=False) as f:
+                    names = f['__columns__'].tolist()
+                    columns = {
+                        name: f['arr_{}'.format(i)]
+                        for i, name in enumerate(names)
+                    }
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                # 无法读取的缓存文件视为未命中
+                return None
+            if not {'__dates__', '__hashes__'} <= set(columns):
+                return None
+            self._store(key, columns)
+            return columns
+        return None
+
+    def put(self, key, columns):
+        """写入缓存。包含非数值类型的数据时不写入缓存文件（读取时不允许反序列化对象）。
+
+        Args:
+            key (str): 缓存的key值。
+            columns ({str,:py:class:`numpy.ndarray`}): 列名及数据组成的字典。参考 :py:meth:`get` 。
+        """
+        self._store(key, columns)
+        path = self._path(key)
+        if path is not None and all(v.dtype.kind in 'biufcmM'
+                                    for v in columns.values()):
+            arrays = {
+                'arr_{}'.format(i): values
+                for i, values in enumerate(columns.values())
+            }
+            tmp = '{}.{}.tmp.npz'.format(path[:-len('.npz')],
+                                         threading.get_ident())
+            np.savez(tmp,
+                     __columns__=np.array(list(columns.keys()), dtype=str),
+                     **arrays)
+            os.replace(tmp, path)
+
+    def _store(self, key, columns):
+        with self._lock:
+            self._store_locked(key, columns)
+
+    def _store_locked(self, key, columns):
+        if key in self._entries:
+            self.nbytes -= sum(v.nbytes for v in self._entries[key].values())
+        self._entries[key] = columns
+        self._entries.move_to_end(key)
+        self.nbytes += sum(v.nbytes for v in columns.values())
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, removed = self._entries.popitem(last=False)
+            self.nbytes -= sum(v.nbytes for v in removed.values())
+
+    def clear(self):
+        """清空内存中的缓存。不会删除缓存文件。"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    @staticmethod
+    def _covers(columns, data, hashes, dates):
+        """缓存的数据窗口是否以 `data` 为前段，并且 `data` 中还没有缓存的列。"""
+        if columns is None:
+            return False
+        n = len(data)
+        return (n <= len(columns['__hashes__'])
+                and np.array_equal(columns['__hashes__'][:n], hashes)
+                and np.array_equal(columns['__dates__'][:n], dates)
+                and all(c not in data.columns for c in columns
+                        if not c.startswith('__')))
+
+    def apply(self, callback, data, **kwargs):
+        """调用回调处理数据。命中缓存时直接将缓存的列写入数据，否则调用回调计算并缓存新增的列。
+
+        Args:
+            callback: 回调。
+            data (:py:class:`pandas.DataFrame`): 待处理的数据。
+            kwargs: 传递给回调 `on_preparing_data` 方法的参数。
+        """
+        hashes = self.row_hashes(callback, data)
+        dates = self.dates(data)
+        key = self.key(callback, data, hashes)
+        columns = self.get(key)
+        if self._covers(columns, data, hashes, dates):
+            self.hits += 1
+            for name, values in columns.items():
+                if not name.startswith('__'):
+                    # 复制数据，避免修改计算结果时影响缓存
+                    data[name] = values[:len(data)].copy()
+            return
+        self.misses += 1
+        before = set(data.columns)
+        callback.on_preparing_data(data, **kwargs)
+        added = [c for c in data.columns if c not in before]
+        if added:
+            columns = {'__dates__': np.array(dates), '__hashes__': hashes}
+            columns.update({c: data[c].values.copy() for c in added})
+            self.put(key, columns)
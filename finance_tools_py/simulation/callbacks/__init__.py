@@ -1,4 +1,120 @@
 import abc
+import bisect
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+class _ForwardWindows():
+    """一个或多个窗口大小共享的滑动窗口统计结构。
+
+    最低、最高使用稀疏表（sparse table）：第 `k` 层为所有长度为 `2**k` 的窗口的最值，
+    任意长度的窗口都可以由两个重叠的 `2**k` 窗口得到。
+    平均值使用按 `max_window` 分块、在每块内重新开始的前缀和及后缀和：任意不超过 `max_window` 的窗口最多跨越两块，
+    窗口和为一个后缀和加一个前缀和（或同一块内两个前缀和的差），误差只与块的大小有关，不会随数据长度累积。
+    `nan` 按0求和，另外用整数前缀和统计窗口中 `nan` 的数量。
+    结构只需要按最大的窗口构建一次，之后每个窗口大小的最低、最高及平均值的计算量都是 O(n) 。
+    中位数使用 pandas 基于有序窗口（skiplist）的滑动中位数，每个窗口大小单独计算，每行 O(log window) 。
+    """
+    def __init__(self, values, max_window):
+        self.values = np.asarray(values, dtype=float)
+        self.max_window = max(int(max_window), 1)
+        self._tables = {}
+        self._levels = self.max_window.bit_length() - 1
+        self._sums = None
+
+    def _table(self, func):
+        if func not in self._tables:
+            tables = [self.values]
+            for k in range(1, self._levels + 1):
+                prev, half = tables[-1], 1 << (k - 1)
+                if len(prev) <= half:
+                    break
+                tables.append(func(prev[:-half], prev[half:]))
+            self._tables[func] = tables
+        return self._tables[func]
+
+    def _extreme(self, window, func):
+        tables = self._table(func)
+        k = min(window.bit_length() - 1, len(tables) - 1)
+        count = len(self.values) - window + 1
+        table = tables[k]
+        return func(table[:count], table[window - (1 << k):][:count])
+
+    def _block_sums(self):
+        if self._sums is None:
+            n, size = len(self.values), self.max_window
+            blocks = -(-n // size)
+            nans = np.isnan(self.values)
+            padded = np.zeros(blocks * size)
+            padded[:n] = self.values
+            if nans.any():
+                padded[:n][nans] = 0
+                nan_count = np.concatenate([[0], np.cumsum(nans)])
+            else:
+                nan_count = None
+            padded = padded.reshape(blocks, size)
+            prefix = np.cumsum(padded, axis=1).ravel()[:n]
+            suffix = np.cumsum(padded[:, ::-1], axis=1)[:, ::-1].ravel()[:n]
+            self._sums = prefix, suffix, nan_count
+        return self._sums
+
+    def _mean(self, window):
+        prefix, suffix, nan_count = self._block_sums()
+        size = self.max_window
+        count = len(self.values) - window + 1
+        # 窗口 values[j:j+window] 的最后一行为 j+window-1
+        last = prefix[window - 1:window - 1 + count]
+        # 同一块内为两个前缀和的差，跨越两块时为前一块的后缀和加后一块的前缀和
+        before = np.empty(count)
+        before[0] = 0
+        before[1:] = prefix[:count - 1]
+        before[::size] = 0
+        inside = np.tile(np.arange(size) + window <= size, -(-count // size))[:count]
+        total = np.where(inside, last - before, suffix[:count] + last)
+        result = total / window
+        if nan_count is not None:
+            result[nan_count[window:window + count] > nan_count[:count]] = np.nan
+        return result
+
+    def stat(self, window, name):
+        """计算所有长度为 `window` 的窗口的统计值。
+
+        Args:
+            window (int): 窗口大小。不能大于 `max_window` 。
+            name (str): `min` 、 `max` 、 `mean` 或 `med` 。
+
+        Returns:
+            :py:class:`numpy.ndarray`: 长度为 `len(values)-window+1` ，第 `j` 个值为 `values[j:j+window]` 的统计值。
+        """
+        if name == 'min':
+            return self._extreme(window, np.minimum)
+        if name == 'max':
+            return self._extreme(window, np.maximum)
+        if name == 'mean':
+            return self._mean(window)
+        if name == 'med':
+            return pd.Series(self.values).rolling(
+                window).median().values[window - 1:]
+        raise ValueError('不支持的统计类型:{}'.format(name))
+
+    def forward(self, timeperiod, name):
+        """计算每行之后 `timeperiod` 行（不含当前行）的统计值。
+
+        与 `pandas.Series.shift(-timeperiod).rolling(timeperiod)` 的结果一致：
+        只有第 `timeperiod-1` 行至倒数第 `timeperiod+1` 行有值，其余为 `nan` 。
+
+        Returns:
+            :py:class:`numpy.ndarray`: 长度与 `values` 一致。
+        """
+        n = len(self.values)
+        result = np.full(n, np.nan)
+        start, stop = timeperiod - 1, n - timeperiod
+        if start < stop:
+            # 第 i 行的窗口为 values[i+1:i+1+timeperiod]
+            result[start:stop] = self.stat(timeperiod, name)[start + 1:stop + 1]
+        return result
 
 
 class CallBack:
@@ -8,16 +124,183 @@ class CallBack:
         col_close: 计算时取值的列名。默认为 `close`。
         col_high: 计算时取值的列名。默认为 `high`。
         col_low: 计算时取值的列名。默认为 `low`。
+        group_key: 分组计算时使用的列名。默认为 `None` ，表示数据中只有一支股票。
+        supports_incremental (bool): 是否支持 :py:meth:`seed` 及 :py:meth:`update` 增量计算。
+            支持增量计算的派生类需要实现 `_step_columns` 、 `_seed_state` 、 `_step` 、 `_write` 方法。
     """
+    supports_incremental = False
+
     def __init__(self, **kwargs):
         """构造。
 
         Args:
             close_name (str): 计算时取值的列名。默认为 `close`。
+            group_key (str): 分组计算时使用的列名（例如 `code` ）。默认为 `None` 。
+                设置后可以直接处理包含多支股票的长格式数据，每组数据单独计算。同一组内的数据需要按日期排序。
         """
         self.col_close = kwargs.get('col_close', 'close')
         self.col_high = kwargs.get('high_close', 'high')
         self.col_low = kwargs.get('low_close', 'low')
+        self.group_key = kwargs.get('group_key', None)
+
+    def _columns(self, *columns):
+        """计算时读取的列名集合。设置了 :py:attr:`group_key` 时包含分组列。"""
+        columns = list(columns)
+        if self.group_key is not None and self.group_key not in columns:
+            columns.append(self.group_key)
+        return columns
+
+    def input_columns(self):
+        """计算时读取的列名集合。
+
+        :py:class:`finance_tools_py.simulation.Simulation` 根据该方法及 :py:meth:`output_columns` 建立各回调之间的依赖关系。
+
+        Returns:
+            [str]: 列名集合。默认返回 `None` ，表示未知，此时认为该回调依赖之前所有回调生成的列。
+        """
+        return None
+
+    def output_columns(self):
+        """计算后附加到数据中的列名集合。
+
+        Returns:
+            [str]: 列名集合。默认返回 `None` ，表示未知，此时该回调总是会被执行。
+        """
+        return None
+
+    def _calc(self, data, func, columns, *args):
+        """使用 `func` 对 `columns` 列的数据进行计算。
+
+        未设置 :py:attr:`group_key` 时直接对整列数据计算。
+        设置后先按分组稳定排序，在排序后数组的连续切片上逐组计算，最后按原有顺序一次性还原结果，不会对每组数据创建 `DataFrame` 。
+        分组列为空值的数据行，计算结果为 `nan` 。
+
+        Args:
+            data (:py:class:`pandas.DataFrame`): 待处理的数据。
+            func: 计算函数。参数为各列数据的 :py:class:`numpy.ndarray` 及 `args` ，
+                返回 :py:class:`numpy.ndarray` 或由其组成的 `tuple` 。
+            columns ([str]): 计算时使用的列名。
+
+        Returns:
+            :py:class:`numpy.ndarray` 或由其组成的 `tuple` ，与 `func` 的返回值一致。
+        """
+        values = [data[col].values for col in columns]
+        if self.group_key is None:
+            return func(*values, *args)
+        keys = pd.factorize(data[self.group_key])[0]
+        order = np.argsort(keys, kind='stable')
+        order = order[keys[order] >= 0]
+        sorted_keys = keys[order]
+        values = [v[order] for v in values]
+        bounds = (np.flatnonzero(np.diff(sorted_keys)) + 1).tolist()
+        outputs = None
+        multiple = False
+        for start, stop in zip([0] + bounds, bounds + [len(order)]):
+            result = func(*[v[start:stop] for v in values], *args)
+            multiple = isinstance(result, tuple)
+            result = result if multiple else (result, )
+            if outputs is None:
+                outputs = [np.empty(len(order)) for r in result]
+            for output, r in zip(outputs, result):
+                output[start:stop] = r
+        if outputs is None:
+            # 没有任何分组时，按未分组的方式计算以得到相同数量的结果
+            result = func(*[data[col].values for col in columns], *args)
+            multiple = isinstance(result, tuple)
+            outputs = [np.empty(0) for r in (result if multiple else (result, ))]
+        results = []
+        for output in outputs:
+            r = np.full(len(data), np.nan)
+            r[order] = output
+            results.append(r)
+        return tuple(results) if multiple else results[0]
+
+    def _groups(self, data, columns):
+        """按 :py:attr:`group_key` 分组，逐组返回分组值及 `columns` 列的数据。
+
+        未设置 :py:attr:`group_key` 时只返回一组，分组值为 `None` 。
+        """
+        values = [data[col].values for col in columns]
+        if self.group_key is None:
+            yield None, values
+            return
+        keys, uniques = pd.factorize(data[self.group_key])
+        order = np.argsort(keys, kind='stable')
+        order = order[keys[order] >= 0]
+        sorted_keys = keys[order]
+        bounds = (np.flatnonzero(np.diff(sorted_keys)) + 1).tolist()
+        for start, stop in zip([0] + bounds, bounds + [len(order)]):
+            if start == stop:
+                continue
+            rows = order[start:stop]
+            yield uniques[sorted_keys[start]], [v[rows] for v in values]
+
+    def _check_incremental(self):
+        if not self.supports_incremental:
+            raise ValueError('{}不支持增量计算'.format(type(self).__name__))
+
+    def seed(self, data):
+        """使用历史数据初始化增量计算的状态。
+
+        初始化后每次只需要将新增的数据行传入 :py:meth:`update` ，即可得到新增数据行的计算结果，
+        不需要重新计算全部历史数据。设置了 :py:attr:`group_key` 时，每组数据分别保存计算状态。
+
+        Args:
+            data (:py:class:`pandas.DataFrame`): 历史数据。同一组内的数据需要按日期排序。
+
+        Returns:
+            当前回调。
+        """
+        self._check_incremental()
+        columns = self._step_columns()
+        self._states = {}
+        for key, values in self._groups(data, columns):
+            self._states[key] = self._seed_state(
+                *[np.asarray(v, dtype=float) for v in values])
+        return self
+
+    def update(self, data):
+        """计算新增数据行的结果，并更新增量计算的状态。
+
+        计算结果与对完整数据调用 :py:meth:`on_preparing_data` 的结果一致。不会修改 `data` ，计算结果以新的 `DataFrame` 返回。
+        没有历史数据的分组视为从第一行数据开始计算。
+
+        Args:
+            data (:py:class:`pandas.DataFrame`): 新增的数据行。同一组内的数据需要按日期排序，
+                且日期晚于之前传入的数据。
+
+        Returns:
+            :py:class:`pandas.DataFrame`: 新增数据行的计算结果。
+
+        Examples:
+            >>> sma = SMA(5).seed(history)
+            >>> sma.update(today)
+                  sma_close_5
+            5000        10.42
+        """
+        self._check_incremental()
+        columns = self._step_columns()
+        states = self.__dict__.setdefault('_states', {})
+        if self.group_key is None:
+            keys = [None] * len(data)
+        else:
+            keys = data[self.group_key].tolist()
+        empty = [np.empty(0)] * len(columns)
+        results = []
+        for key, row in zip(keys, zip(*[data[c].tolist() for c in columns])):
+            state = states.get(key)
+            if state is None:
+                state = states[key] = self._seed_state(*empty)
+            results.append(self._step(state, *row))
+        if not results:
+            return pd.DataFrame(index=data.index,
+                                columns=self.output_columns(),
+                                dtype=float)
+        values = np.array(results, dtype=float)
+        # 在读取列的副本中写入结果，部分结果列（例如比率）需要读取列参与计算
+        frame = data[columns].copy()
+        names = self._write(frame, *values.T)
+        return frame[names]
 
     @abc.abstractmethod
     def on_preparing_data(self, data, **kwargs):
@@ -82,24 +365,190 @@ class Rolling_Future(CallBack):
         self.skip = timeperiod if skip is None else skip
         self.col_name = self.col_close if col_name is None else col_name
 
-    def on_preparing_data(self, data, **kwargs):
+    def input_columns(self):
+        return self._columns(self.col_name)
+
+    def output_columns(self):
         col_min = 'rolling_{}_{}_min'.format(self.col_name, self.timeperiod)
         col_max = 'rolling_{}_{}_max'.format(self.col_name, self.timeperiod)
         col_mean = 'rolling_{}_{}_mean'.format(self.col_name, self.timeperiod)
         col_med = 'rolling_{}_{}_med'.format(self.col_name, self.timeperiod)
-        r = data.shift(-self.timeperiod)[self.col_name].rolling(
-            self.timeperiod)
-        data[col_min] = r.min()
-        data[col_max] = r.max()
-        data[col_mean] = r.mean()
-        data[col_med] = r.median()
         n_mean = '{}/{}'.format(col_mean, self.col_name)
         n_med = '{}/{}'.format(col_med, self.col_name)
         n_max = '{}/{}'.format(col_max, self.col_name)
         n_min = '{}/{}'.format(col_min, self.col_name)
-        data[n_mean] = data[col_mean] / data[
-            self.col_name]  # 未来n日的平均价。>1表示上涨，<1表示下跌
-        data[n_med] = data[col_med] / data[
-            self.col_name]  # 未来n日的中位数。>1表示上涨，<1表示下跌
-        data[n_max] = data[col_max] / data[self.col_name]
-        data[n_min] = data[col_min] / data[self.col_name]
+        return [col_min, col_max, col_mean, col_med, n_mean, n_med, n_max, n_min]
+
+    def on_preparing_data(self, data, **kwargs):
+        (col_min, col_max, col_mean, col_med, n_mean, n_med, n_max,
+         n_min) = self.output_columns()
+        values = data[self.col_name].values.astype(float)
+        windows = _ForwardWindows(values, self.timeperiod)
+        r_min, r_max, r_mean, r_med = [
+            windows.forward(self.timeperiod, stat)
+            for stat in ['min', 'max', 'mean', 'med']
+        ]
+        data[col_min] = r_min
+        data[col_max] = r_max
+        data[col_mean] = r_mean
+        data[col_med] = r_med
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data[n_mean] = r_mean / values  # 未来n日的平均价。>1表示上涨，<1表示下跌
+            data[n_med] = r_med / values  # 未来n日的中位数。>1表示上涨，<1表示下跌
+            data[n_max] = r_max / values
+            data[n_min] = r_min / values
+
+    def seed(self, data):
+        """使用历史数据初始化增量计算的状态。参考 :py:meth:`CallBack.seed` 。
+
+        只会保留最后 `timeperiod+1` 行数据。
+
+        Args:
+            data (:py:class:`pandas.DataFrame`): 历史数据。需要按日期排序。
+
+        Returns:
+            当前回调。
+        """
+        t = self.timeperiod
+        window = deque(zip(data.index[-(t + 1):],
+                           data[self.col_name].values[-(t + 1):].tolist()),
+                       maxlen=t + 1)
+        # 最后 timeperiod 个值中的有效值（有序）及 nan 的数量
+        future = [v for _, v in list(window)[-t:]]
+        self._state = {
+            'window': window,
+            'count': len(data),
+            'sorted': sorted(v for v in future if v == v),
+            'nans': sum(1 for v in future if v != v),
+        }
+        return self
+
+    def update(self, data):
+        """传入新增的数据行，计算因此得到完整未来数据的历史数据行的结果。
+
+        第 `i` 行的结果需要第 `i+timeperiod` 行的数据，所以每新增一行数据，会得到 `timeperiod` 行之前那一行的结果。
+        新增数据行本身的未来数据未知，不会出现在结果中。不会修改 `data` 。
+
+        未来数据按顺序保存，每新增一行只需要一次二分插入及一次删除，最低、最高及中位数直接按位置读取。
+
+        Args:
+            data (:py:class:`pandas.DataFrame`): 新增的数据行。需要按日期排序，且日期晚于之前传入的数据。
+
+        Returns:
+            :py:class:`pandas.DataFrame`: 新得到结果的历史数据行的计算结果。index为历史数据行的index。
+
+        Examples:
+            >>> rf = Rolling_Future(3).seed(history)
+            >>> rf.update(today)  # 返回3行之前的那一行数据的结果
+        """
+        names = self.output_columns()
+        state = self.__dict__.get('_state', None)
+        if state is None:
+            state = self.seed(data.iloc[:0])._state
+        window = state['window']
+        future = state['sorted']
+        t = self.timeperiod
+        labels = []
+        records = []
+        for label, value in zip(data.index, data[self.col_name].tolist()):
+            if len(window) >= t:
+                # 移出未来数据中最早的值
+                _, old = window[-t]
+                if old != old:
+                    state['nans'] -= 1
+                else:
+                    del future[bisect.bisect_left(future, old)]
+            if value != value:
+                state['nans'] += 1
+            else:
+                bisect.insort(future, value)
+            window.append((label, value))
+            state['count'] += 1
+            if state['count'] < 2 * t:
+                continue
+            label_cur, cur = window[0]
+            if state['nans']:
+                stats = [np.nan] * 4
+            else:
+                half = t // 2
+                med = future[half] if t % 2 else (future[half - 1] +
+                                                  future[half]) / 2
+                stats = [future[0], future[-1], sum(future) / t, med]
+            labels.append(label_cur)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                records.append(stats + [
+                    np.float64(stats[i]) / cur for i in [2, 3, 1, 0]
+                ])
+        return pd.DataFrame(records, index=labels, columns=names, dtype=float)
+
+
+class Rolling_Future_Batch(CallBack):
+    """同时计算多个窗口大小的 :py:class:`Rolling_Future` 。
+
+        执行后附加的列与对每个 `timeperiod` 分别使用 :py:class:`Rolling_Future` 的结果一致（只包含 `stats` 中的统计值）。
+        所有窗口大小共享同一个稀疏表及同一组分块前缀和，最低、最高及平均值的公共结构只构建一次，
+        之后每个窗口大小只需要 O(n) 的查询。
+        中位数不能在窗口大小之间共享，每个窗口大小单独做一次滑动中位数计算，所以包含 `med` 时的计算时间主要由中位数决定，
+        批量计算的加速只针对最低、最高及平均值。
+
+    Attributes:
+        timeperiods ([int]): 窗口大小集合。
+        stats ([str]): 统计值集合。可选 `min` 、 `max` 、 `mean` 、 `med` 。默认为全部。
+        col_name: 计算时使用的列名。默认使用 `col_close` 。
+
+    Examples:
+        >>> Rolling_Future_Batch([5, 10, 20, 60]).on_preparing_data(data)
+        >>> Rolling_Future_Batch([5, 10], stats=['max', 'min']).on_preparing_data(data)
+    """
+    _stats = ['min', 'max', 'mean', 'med']
+
+    def __init__(self, timeperiods, stats=None, col_name=None):
+        """构造
+
+        Args:
+            timeperiods ([int]): 窗口大小集合。
+            stats ([str]): 统计值集合。可选 `min` 、 `max` 、 `mean` 、 `med` 。默认为全部。
+            col_name (str): 计算时使用的列名。默认使用 `col_close` 。
+        """
+        super().__init__()
+        self.timeperiods = list(timeperiods)
+        self.stats = list(self._stats if stats is None else stats)
+        for stat in self.stats:
+            if stat not in self._stats:
+                raise ValueError('不支持的统计类型:{}'.format(stat))
+        self.col_name = self.col_close if col_name is None else col_name
+
+    def _names(self, timeperiod):
+        names = {
+            stat: 'rolling_{}_{}_{}'.format(self.col_name, timeperiod, stat)
+            for stat in self._stats
+        }
+        ratios = {
+            stat: '{}/{}'.format(names[stat], self.col_name)
+            for stat in self._stats
+        }
+        # 与 Rolling_Future 的列顺序一致
+        columns = [(names[stat], stat, False) for stat in self._stats
+                   if stat in self.stats]
+        columns += [(ratios[stat], stat, True)
+                    for stat in ['mean', 'med', 'max', 'min']
+                    if stat in self.stats]
+        return columns
+
+    def input_columns(self):
+        return self._columns(self.col_name)
+
+    def output_columns(self):
+        return [
+            name for t in self.timeperiods for name, stat, ratio in self._names(t)
+        ]
+
+    def on_preparing_data(self, data, **kwargs):
+        values = data[self.col_name].values.astype(float)
+        windows = _ForwardWindows(values,
+                                  max(self.timeperiods) if self.timeperiods else 1)
+        for t in self.timeperiods:
+            results = {stat: windows.forward(t, stat) for stat in self.stats}
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for name, stat, ratio in self._names(t):
+                    data[name] = results[stat] / values if ratio else results[stat]
@@ -1,8 +1,16 @@
+from collections import deque
+
+import numpy as np
 import talib
 
 from . import CallBack
 
 
+def _is_zero(value):
+    """与 talib 中的 `TA_IS_ZERO` 一致"""
+    return -0.00000001 < value < 0.00000001
+
+
 class BBANDS(CallBack):
     """附加计算布林带数据。
 
@@ -43,6 +51,8 @@ class BBANDS(CallBack):
         bbands_3_2.4_2.7_up/bbands_3_2.4_2.7_low:[   nan    nan  -2.46 -19.36   6.23   3.32   2.49   2.1 ]
         close/bbands_3_2.4_2.7_low:[   nan    nan  -1.66 -14.67   5.03   2.78   2.15   1.84]
     """
+    supports_incremental = True
+
     def __init__(self, timeperiod, nbdevup, nbdevdn, **kwargs):
         super().__init__(**kwargs)
         self.timeperiod = timeperiod
@@ -51,23 +61,49 @@ class BBANDS(CallBack):
 
     def on_preparing_data(self, data, **kwargs):
         """附加布林带数据"""
+        self._write(
+            data,
+            *self._calc(data, talib.BBANDS, [self.col_close], self.timeperiod,
+                        self.nbdevup, self.nbdevdn))
+
+    def input_columns(self):
+        return self._columns(self.col_close)
+
+    def output_columns(self):
         col_up = 'bbands_{}_{}_{}_up'.format(self.timeperiod, self.nbdevup,
                                              self.nbdevdn)  # 布林带上线
         col_mean = 'bbands_{}_{}_{}_mean'.format(self.timeperiod, self.nbdevup,
                                                  self.nbdevdn)  # 布林带中线
         col_low = 'bbands_{}_{}_{}_low'.format(self.timeperiod, self.nbdevup,
                                                self.nbdevdn)  # 布林带下线
-        data[col_up], data[col_mean], data[col_low] = talib.BBANDS(
-            data[self.col_close].values, self.timeperiod, self.nbdevup,
-            self.nbdevdn)
-        data['{}/{}'.format(
-            col_up, self.col_close
-        )] = data[col_up] / data[self.col_close]  # 上线相对于收盘价线的比率
-        data['{}/{}'.format(
-            col_up, col_low)] = data[col_up] / data[col_low]  # 上线相对于下线的比率
-        data['{}/{}'.format(
-            self.col_close,
-            col_low)] = data[self.col_close] / data[col_low]  # 收盘价线相对于上线的比率
+        return [
+            col_up, col_mean, col_low, '{}/{}'.format(col_up, self.col_close),
+            '{}/{}'.format(col_up, col_low), '{}/{}'.format(self.col_close, col_low)
+        ]
+
+    def _write(self, data, up, mean, low):
+        names = self.output_columns()
+        col_up, col_mean, col_low, n_up_close, n_up_low, n_close_low = names
+        data[col_up], data[col_mean], data[col_low] = up, mean, low
+        data[n_up_close] = data[col_up] / data[self.col_close]  # 上线相对于收盘价线的比率
+        data[n_up_low] = data[col_up] / data[col_low]  # 上线相对于下线的比率
+        data[n_close_low] = data[self.col_close] / data[col_low]  # 收盘价线相对于上线的比率
+        return names
+
+    def _step_columns(self):
+        return [self.col_close]
+
+    def _seed_state(self, values):
+        return deque(values[-self.timeperiod:].tolist(), maxlen=self.timeperiod)
+
+    def _step(self, window, value):
+        window.append(value)
+        if len(window) < self.timeperiod:
+            return np.nan, np.nan, np.nan
+        mean = sum(window) / self.timeperiod
+        var = sum(v * v for v in window) / self.timeperiod - mean * mean
+        std = np.sqrt(var) if var >= 0.00000001 else 0.0
+        return mean + self.nbdevup * std, mean, mean - self.nbdevdn * std
 
 
 class WILLR(CallBack):
@@ -108,12 +144,18 @@ class WILLR(CallBack):
         super().__init__(**kwargs)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_high, self.col_low, self.col_close)
+
+    def output_columns(self):
+        return ['willr_{}'.format(self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算威廉指标"""
-        willr = 'willr_{}'.format(self.timeperiod)
-        data[willr] = talib.WILLR(data[self.col_high].values,
-                                  data[self.col_low].values,
-                                  data[self.col_close].values, self.timeperiod)
+        willr, = self.output_columns()
+        data[willr] = self._calc(
+            data, talib.WILLR, [self.col_high, self.col_low, self.col_close],
+            self.timeperiod)
 
 
 class MFI(CallBack):
@@ -154,13 +196,18 @@ class MFI(CallBack):
         self.col_vol = kwargs.get('low_close', 'volume')
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_high, self.col_low, self.col_close, self.col_vol)
+
+    def output_columns(self):
+        return ['mfi_{}'.format(self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算顺势指标"""
-        real = 'mfi_{}'.format(self.timeperiod)
-        data[real] = talib.MFI(data[self.col_high].values,
-                               data[self.col_low].values,
-                               data[self.col_close].values,
-                               data[self.col_vol].values, self.timeperiod)
+        real, = self.output_columns()
+        data[real] = self._calc(data, talib.MFI, [
+            self.col_high, self.col_low, self.col_close, self.col_vol
+        ], self.timeperiod)
 
 
 class CCI(CallBack):
@@ -198,13 +245,21 @@ class CCI(CallBack):
         super().__init__(**kwargs)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_high, self.col_low, self.col_close)
+
+    def output_columns(self):
+        return [
+            'cci_{}_{}_{}_{}'.format(self.col_high, self.col_low,
+                                     self.col_close, self.timeperiod)
+        ]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算顺势指标"""
-        real = 'cci_{}_{}_{}_{}'.format(self.col_high, self.col_low,
-                                        self.col_close, self.timeperiod)
-        data[real] = talib.CCI(data[self.col_high].values,
-                               data[self.col_low].values,
-                               data[self.col_close].values, self.timeperiod)
+        real, = self.output_columns()
+        data[real] = self._calc(
+            data, talib.CCI, [self.col_high, self.col_low, self.col_close],
+            self.timeperiod)
 
 
 class DEMA(CallBack):
@@ -237,10 +292,17 @@ class DEMA(CallBack):
         self.col_name = kwargs.pop('col_name', self.col_close)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_name)
+
+    def output_columns(self):
+        return ['dema_{}_{}'.format(self.col_name, self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算双移动平均线"""
-        real = 'dema_{}_{}'.format(self.col_name, self.timeperiod)
-        data[real] = talib.DEMA(data[self.col_name].values, self.timeperiod)
+        real, = self.output_columns()
+        data[real] = self._calc(data, talib.DEMA, [self.col_name],
+                                self.timeperiod)
 
 
 class RSI(CallBack):
@@ -268,15 +330,58 @@ class RSI(CallBack):
         >>>     print('{}:{}'.format(col,np.round(s.data[col].values,2)))
         rsi_close_3:[ nan  nan  nan 100. 100. 100. 100. 100.]
     """
+    supports_incremental = True
+
     def __init__(self, timeperiod, **kwargs):
         super().__init__(**kwargs)
         self.col_name = kwargs.pop('col_name', self.col_close)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_name)
+
+    def output_columns(self):
+        return ['rsi_{}_{}'.format(self.col_name, self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算Relative Strength Index 相对强弱指数"""
-        real = 'rsi_{}_{}'.format(self.col_name, self.timeperiod)
-        data[real] = talib.RSI(data[self.col_name].values, self.timeperiod)
+        self._write(data,
+                    self._calc(data, talib.RSI, [self.col_name], self.timeperiod))
+
+    def _write(self, data, values):
+        real, = self.output_columns()
+        data[real] = values
+        return [real]
+
+    def _step_columns(self):
+        return [self.col_name]
+
+    def _seed_state(self, values):
+        state = {'prev': None, 'count': 0, 'gain': 0.0, 'loss': 0.0}
+        for value in values.tolist():
+            self._step(state, value)
+        return state
+
+    def _step(self, state, value):
+        prev, state['prev'] = state['prev'], value
+        if prev is None:
+            return np.nan,
+        diff = value - prev
+        n = self.timeperiod
+        if state['count'] >= n:
+            state['gain'] *= (n - 1)
+            state['loss'] *= (n - 1)
+        if diff < 0:
+            state['loss'] -= diff
+        else:
+            state['gain'] += diff
+        state['count'] += 1
+        if state['count'] < n:
+            return np.nan,
+        state['gain'] /= n
+        state['loss'] /= n
+        total = state['gain'] + state['loss']
+        return (0.0 if _is_zero(total) else 100 * (state['gain'] / total)),
 
 
 class SMA(CallBack):
@@ -309,15 +414,40 @@ class SMA(CallBack):
         >>>     print('{}:{}'.format(col,np.round(s.data[col].values,2)))
         sma_close_3:[nan nan  6.  7.  8.]
     """
+    supports_incremental = True
+
     def __init__(self, timeperiod, **kwargs):
         super().__init__(**kwargs)
         self.col_name = kwargs.pop('col_name', self.col_close)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_name)
+
+    def output_columns(self):
+        return ['sma_{}_{}'.format(self.col_name, self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算SMA - 简单移动均线指标"""
-        real = 'sma_{}_{}'.format(self.col_name, self.timeperiod)
-        data[real] = talib.SMA(data[self.col_name].values, self.timeperiod)
+        self._write(data,
+                    self._calc(data, talib.SMA, [self.col_name], self.timeperiod))
+
+    def _write(self, data, values):
+        real, = self.output_columns()
+        data[real] = values
+        return [real]
+
+    def _step_columns(self):
+        return [self.col_name]
+
+    def _seed_state(self, values):
+        return deque(values[-self.timeperiod:].tolist(), maxlen=self.timeperiod)
+
+    def _step(self, window, value):
+        window.append(value)
+        if len(window) < self.timeperiod:
+            return np.nan,
+        return sum(window) / self.timeperiod,
 
 
 class EMA(CallBack):
@@ -350,15 +480,51 @@ class EMA(CallBack):
         >>>     print('{}:{}'.format(col,np.round(s.data[col].values,2)))
         ema_close_3:[nan nan  6.  7.  8.]
     """
+    supports_incremental = True
+
     def __init__(self, timeperiod, **kwargs):
         super().__init__(**kwargs)
         self.col_name = kwargs.pop('col_name', self.col_close)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_name)
+
+    def output_columns(self):
+        return ['ema_{}_{}'.format(self.col_name, self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算EMA - 指数移动平均线"""
-        real = 'ema_{}_{}'.format(self.col_name, self.timeperiod)
-        data[real] = talib.EMA(data[self.col_name].values, self.timeperiod)
+        self._write(data,
+                    self._calc(data, talib.EMA, [self.col_name], self.timeperiod))
+
+    def _write(self, data, values):
+        real, = self.output_columns()
+        data[real] = values
+        return [real]
+
+    def _step_columns(self):
+        return [self.col_name]
+
+    def _seed_state(self, values):
+        if len(values) < self.timeperiod:
+            return {'buffer': values.tolist(), 'ema': np.nan}
+        return {
+            'buffer': None,
+            'ema': float(talib.EMA(values, self.timeperiod)[-1])
+        }
+
+    def _step(self, state, value):
+        if state['buffer'] is not None:
+            state['buffer'].append(value)
+            if len(state['buffer']) < self.timeperiod:
+                return np.nan,
+            state['ema'] = sum(state['buffer']) / self.timeperiod
+            state['buffer'] = None
+        else:
+            k = 2.0 / (self.timeperiod + 1)
+            state['ema'] = ((value - state['ema']) * k) + state['ema']
+        return state['ema'],
 
 
 class WMA(CallBack):
@@ -391,10 +557,17 @@ class WMA(CallBack):
         self.col_name = kwargs.pop('col_name', self.col_close)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_name)
+
+    def output_columns(self):
+        return ['wma_{}_{}'.format(self.col_name, self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算WMA - 加权移动平均线"""
-        real = 'wma_{}_{}'.format(self.col_name, self.timeperiod)
-        data[real] = talib.WMA(data[self.col_name].values, self.timeperiod)
+        real, = self.output_columns()
+        data[real] = self._calc(data, talib.WMA, [self.col_name],
+                                self.timeperiod)
 
 
 class ATR(CallBack):
@@ -431,16 +604,64 @@ class ATR(CallBack):
         >>>     print('{}:{}'.format(col,np.round(s.data[col].values,2)))
         atr_3:[ nan  nan  nan 10.1 10.1]
     """
+    supports_incremental = True
+
     def __init__(self, timeperiod, **kwargs):
         super().__init__(**kwargs)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_high, self.col_low, self.col_close)
+
+    def output_columns(self):
+        return ['atr_{}'.format(self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算平均真实波幅指标"""
-        real = 'atr_{}'.format(self.timeperiod)
-        data[real] = talib.ATR(data[self.col_high].values,
-                               data[self.col_low].values,
-                               data[self.col_close].values, self.timeperiod)
+        self._write(
+            data,
+            self._calc(data, talib.ATR,
+                       [self.col_high, self.col_low, self.col_close],
+                       self.timeperiod))
+
+    def _write(self, data, values):
+        real, = self.output_columns()
+        data[real] = values
+        return [real]
+
+    def _step_columns(self):
+        return [self.col_high, self.col_low, self.col_close]
+
+    def _seed_state(self, high, low, close):
+        state = {
+            'close': close[-1] if len(close) else np.nan,
+            'count': len(close),
+            'buffer': None,
+            'atr': np.nan
+        }
+        if len(close) <= self.timeperiod:
+            state['buffer'] = talib.TRANGE(high, low, close)[1:].tolist()
+        else:
+            state['atr'] = float(
+                talib.ATR(high, low, close, self.timeperiod)[-1])
+        return state
+
+    def _step(self, state, high, low, close):
+        prev, state['close'] = state['close'], close
+        state['count'] += 1
+        if state['count'] == 1:
+            return np.nan,
+        tr = max(high, prev) - min(low, prev)
+        n = self.timeperiod
+        if state['buffer'] is not None:
+            state['buffer'].append(tr)
+            if len(state['buffer']) < n:
+                return np.nan,
+            state['atr'] = sum(state['buffer']) / n
+            state['buffer'] = None
+        else:
+            state['atr'] = (state['atr'] * (n - 1) + tr) / n
+        return state['atr'],
 
 
 class NATR(CallBack):
@@ -481,12 +702,18 @@ class NATR(CallBack):
         super().__init__(**kwargs)
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.col_high, self.col_low, self.col_close)
+
+    def output_columns(self):
+        return ['natr_{}'.format(self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算归一化平均真实波幅"""
-        real = 'natr_{}'.format(self.timeperiod)
-        data[real] = talib.NATR(data[self.col_high].values,
-                                data[self.col_low].values,
-                                data[self.col_close].values, self.timeperiod)
+        real, = self.output_columns()
+        data[real] = self._calc(
+            data, talib.NATR, [self.col_high, self.col_low, self.col_close],
+            self.timeperiod)
 
 
 class TRANGE(CallBack):
@@ -519,11 +746,17 @@ class TRANGE(CallBack):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    def input_columns(self):
+        return self._columns(self.col_high, self.col_low, self.col_close)
+
+    def output_columns(self):
+        return ['trange']
+
     def on_preparing_data(self, data, **kwargs):
         """附加计算真正的范围"""
-        data['trange'] = talib.TRANGE(data[self.col_high].values,
-                                      data[self.col_low].values,
-                                      data[self.col_close].values)
+        real, = self.output_columns()
+        data[real] = self._calc(
+            data, talib.TRANGE, [self.col_high, self.col_low, self.col_close])
 
 
 class LINEARREG_SLOPE(CallBack):
@@ -563,7 +796,13 @@ class LINEARREG_SLOPE(CallBack):
         self.colname = colname
         self.timeperiod = timeperiod
 
+    def input_columns(self):
+        return self._columns(self.colname)
+
+    def output_columns(self):
+        return ['{}_lineSlope_{}'.format(self.colname, self.timeperiod)]
+
     def on_preparing_data(self, data, **kwargs):
-        col_name = '{}_lineSlope_{}'.format(self.colname, self.timeperiod)
-        data[col_name] = talib.LINEARREG_SLOPE(data[self.colname],
-                                               self.timeperiod)
+        col_name, = self.output_columns()
+        data[col_name] = self._calc(data, talib.LINEARREG_SLOPE,
+                                    [self.colname], self.timeperiod)
@@ -0,0 +1,217 @@
+"""策略参数扫描。
+
+对参数网格中的每组参数分别执行模拟计算（:py:class:`finance_tools_py.simulation.Simulation` ）及回测计算（:py:class:`finance_tools_py.backtest.BackTest` ），
+并汇总每组参数的回测结果。
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from finance_tools_py._pool import map_shared
+from finance_tools_py.backtest import BackTest
+from finance_tools_py.backtest import Utils
+from finance_tools_py.simulation import Simulation
+from finance_tools_py.simulation.cache import IndicatorCache
+
+
+def param_grid(grid):
+    """展开参数网格。
+
+    Args:
+        grid: 参数网格。可以是参数名及候选值组成的字典，会按字典顺序计算所有候选值的组合，候选值不是 `list` 或 `tuple` 时作为唯一的候选值；
+            也可以是参数字典组成的集合（或者由参数网格字典组成的集合），会依次展开后合并。
+
+    Examples:
+        >>> param_grid({'timeperiod': [10, 20], 'stoploss_point': [1, 2]})
+        [{'timeperiod': 10, 'stoploss_point': 1}, {'timeperiod': 10, 'stoploss_point': 2},
+        {'timeperiod': 20, 'stoploss_point': 1}, {'timeperiod': 20, 'stoploss_point': 2}]
+
+    Returns:
+        [dict]: 参数字典集合。
+    """
+    if isinstance(grid, dict):
+        names = list(grid.keys())
+        values = [
+            v if isinstance(v, (list, tuple)) else [v] for v in grid.values()
+        ]
+        return [dict(zip(names, v)) for v in itertools.product(*values)]
+    result = []
+    for g in grid:
+        result.extend(param_grid(g))
+    return result
+
+
+def summary(bt):
+    """回测结果的汇总指标。
+
+    Args:
+        bt (:py:class:`finance_tools_py.backtest.BackTest`): 计算完成的回测。
+
+    Returns:
+        dict: 包含以下指标的字典。
+
+            * `init_assets`: 期初资产。
+            * `total_assets`: 期末资产（现金+持股现价值）。
+            * `return`: 收益率。 `total_assets/init_assets-1` 。
+            * `available_cash`: 可用资金。
+            * `trades`: 交易次数（买入/卖出各算1次）。
+            * `win_rate`: 胜率。参考 :py:func:`finance_tools_py.backtest.Utils.win_rate` 。
+            * `commission`: 总手续费。
+            * `tax`: 总印花税。
+    """
+    init_assets = bt._init_assets
+    total_assets = bt.total_assets_cur
+    trades = len(bt.history)
+    return {
+        'init_assets': init_assets,
+        'total_assets': total_assets,
+        'return': (total_assets / init_assets - 1) if init_assets else 0,
+        'available_cash': bt.available_cash,
+        'trades': trades,
+        'win_rate': Utils.win_rate(bt.profit_loss_df()) if trades else 0,
+        'commission': bt._calc_total_commission(),
+        'tax': bt._calc_total_tax(),
+    }
+
+
+def _callbacks_key(callbacks):
+    """由回调类型及回调参数计算回调集合的key值。参数相同的回调集合计算结果相同。"""
+    return repr([(type(cb).__module__, type(cb).__qualname__,
+                  IndicatorCache._params(cb)) for cb in callbacks])
+
+
+def _simulate_symbol(shared, task):
+    """在子进程中计算一支股票的所有指标。同一个子进程中参数相同的回调只计算一次。"""
+    data, callbacks, col_code = shared
+    start, stop = task
+    frame = data.iloc[start:stop]
+    symbol = frame[col_code].iloc[0]
+    cache = IndicatorCache()
+    result = {}
+    for key, cbs in callbacks.items():
+        s = Simulation(frame, symbol, callbacks=cbs, cache=cache, copy=False)
+        s.simulate(reset_index=False)
+        result[key] = {
+            name: s.data[name].values
+            for name in s.data.columns if name not in frame.columns
+        }
+    return result
+
+
+def _backtest_params(shared, task):
+    """在子进程中按一组参数进行回测计算，返回汇总指标"""
+    data, columns, strategy, metrics, bt_kwargs, trade_kwargs = shared
+    params, key = task
+    frame = data.copy(deep=False)
+    for name, values in columns.get(key, {}).items():
+        frame[name] = values
+    bt = BackTest(frame, callbacks=strategy(params), **bt_kwargs)
+    bt.calc_trade_history(**trade_kwargs)
+    return metrics(bt)
+
+
+def sweep(data, grid, strategy, indicators=None, n_jobs=1, **kwargs):
+    """在进程池中按参数网格进行回测计算，返回每组参数的汇总指标。
+
+    计算分为两步：
+
+    1. 按股票代码在进程池中计算指标列。所有参数组合中参数相同的指标回调只计算一次，不同参数组合可以共享相同的指标列。
+    2. 按参数组合在进程池中进行回测计算。
+
+    子进程通过 `fork` 直接继承输入数据及指标列，不会随每个任务序列化数据（参考 :py:mod:`finance_tools_py._pool` ）。
+    Windows、macOS 等使用 `spawn` 启动子进程的平台上，`strategy` 、 `indicators` 及 `metrics` 必须是可以被序列化的模块级函数
+    （或其 `functools.partial` ），否则会给出警告并在当前进程中计算。
+
+    Args:
+        data (:py:class:`pandas.DataFrame`): 包含多支股票的长格式数据。需要满足 :py:class:`finance_tools_py.backtest.BackTest` 对数据的要求。
+        grid: 参数网格。参考 :py:func:`param_grid` 。
+        strategy: 按参数字典创建回测回调集合（:py:class:`finance_tools_py.backtest.CallBack` ）的模块级函数。
+            每组参数都会调用一次，返回新的回调实例。
+        indicators: 按参数字典创建指标回调集合（:py:class:`finance_tools_py.simulation.callbacks.CallBack` ）的模块级函数。
+            默认为 `None` ，不计算指标。
+        n_jobs (int): 进程数。为 `None` 或小于等于0时使用所有的CPU核心。为1时在当前进程中计算。默认为1。
+        col_code (str): 股票代码的列名。默认为 `code` 。
+        metrics: 按计算完成的回测计算汇总指标的函数，返回指标名及指标值组成的字典。默认为 :py:func:`summary` 。
+        engine (str): 回测计算引擎。参考 :py:func:`finance_tools_py.backtest.BackTest.calc_trade_history` 。默认为 `columnar` 。
+        trade_kwargs (dict): 传递给 :py:func:`finance_tools_py.backtest.BackTest.calc_trade_history` 的其他参数。
+        kwargs: 其他参数传递给 :py:class:`finance_tools_py.backtest.BackTest` 。例如 `init_cash` 、 `col_name` 等。
+
+    Examples:
+        >>> import functools
+        >>> from finance_tools_py.sweep import sweep
+        >>> from finance_tools_py.backtest import TurtleStrategy
+        >>> from finance_tools_py.simulation.callbacks.talib import ATR
+        >>> # strategies.py
+        >>> def indicators(p):
+        >>>     return [ATR(p['timeperiod'])]
+        >>> def strategy(buys, sells, p):
+        >>>     return [TurtleStrategy(colname='atr_{}'.format(p['timeperiod']),
+        >>>                            buy_dict=buys, sell_dict=sells,
+        >>>                            stoploss_point=p['stoploss_point'])]
+        >>> # notebook
+        >>> from strategies import indicators, strategy
+        >>> result = sweep(data,
+        >>>                {'timeperiod': [10, 20], 'stoploss_point': [1, 2]},
+        >>>                strategy=functools.partial(strategy, buys, sells),
+        >>>                indicators=indicators,
+        >>>                n_jobs=4,
+        >>>                init_cash=50000)
+           timeperiod  stoploss_point  init_assets  total_assets  return  ...
+
+    Returns:
+        :py:class:`pandas.DataFrame`: 每组参数为一行。包含参数列及 `metrics` 返回的指标列。
+    """
+    col_code = kwargs.pop('col_code', 'code')
+    metrics = kwargs.pop('metrics', summary)
+    trade_kwargs = dict(kwargs.pop('trade_kwargs', {}))
+    trade_kwargs.setdefault('engine', kwargs.pop('engine', 'columnar'))
+    params = param_grid(grid)
+    if not params:
+        return pd.DataFrame()
+
+    keys = [None] * len(params)
+    columns = {}
+    if indicators is not None:
+        callbacks = {}
+        for i, p in enumerate(params):
+            cbs = indicators(p)
+            keys[i] = _callbacks_key(cbs)
+            callbacks.setdefault(keys[i], cbs)
+        columns = _simulate_columns(data, callbacks, col_code, n_jobs)
+
+    rows = map_shared(_backtest_params,
+                      (data, columns, strategy, metrics, kwargs, trade_kwargs),
+                      list(zip(params, keys)),
+                      n_jobs=n_jobs,
+                      chunksize=1,
+                      desc='参数扫描中...')
+    result = pd.DataFrame(params)
+    return pd.concat([result, pd.DataFrame(rows, index=result.index)],
+                     axis=1)
+
+
+def _simulate_columns(data, callbacks, col_code, n_jobs):
+    """按股票代码计算所有指标回调集合生成的列。返回的列与 `data` 的行顺序一致。"""
+    keys, symbols = pd.factorize(data[col_code])
+    if (keys < 0).any():
+        raise ValueError('股票代码不能为空')
+    order = np.argsort(keys, kind='stable')
+    counts = np.bincount(keys, minlength=len(symbols))
+    stops = np.cumsum(counts)
+    starts = stops - counts
+    parts = map_shared(_simulate_symbol,
+                       (data.iloc[order], callbacks, col_code),
+                       list(zip(starts.tolist(), stops.tolist())),
+                       n_jobs=n_jobs,
+                       desc='计算指标中...')
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    columns = {}
+    for key in callbacks:
+        names = list(parts[0][key].keys()) if parts else []
+        columns[key] = {
+            name: np.concatenate([part[key][name] for part in parts])[inverse]
+            for name in names
+        }
+    return columns
@@ -0,0 +1,331 @@
+"""逐年度滚动（walk-forward）回测。
+
+每个年度根据回看期间的数据选取流动性最大的股票，计算指标后使用 :py:class:`finance_tools_py.backtest.TurtleStrategy` 进行回测，
+并将年末的资金及持仓带入下一年度。
+"""
+import copy
+import datetime
+
+import pandas as pd
+
+from finance_tools_py._pool import imap_shared
+from finance_tools_py.backtest import BackTest
+from finance_tools_py.backtest import TurtleStrategy
+from finance_tools_py.calc import fluidity_windows
+from finance_tools_py.calc import position_unit
+from finance_tools_py.panel import Panel
+from finance_tools_py.simulation import Simulation
+from finance_tools_py.simulation.callbacks.talib import ATR
+
+
+def _year_start(year):
+    return datetime.datetime(year, 1, 1)
+
+
+def _year_end(year):
+    return datetime.datetime(year, 12, 31)
+
+
+def _unit_inputs(panel, symbol, look, year, colname, cache=None):
+    """使用回看期间的数据计算ATR(20)，返回最后一个完整数据行中计算头寸单位所需的价格及指标值。数据为空时返回 `None` 。
+
+    使用缓存时计算到回测年度的年末，回看期间之后的数据行不影响回看期间内的结果，
+    之后对同一窗口调用 :py:func:`_simulate_symbol` 时可以直接使用缓存中的ATR(20)。
+    """
+    start, end = _year_start(look[0]), _year_end(look[-1])
+    n = len(panel.slice(symbol, start, end))
+    s = Simulation(panel.slice(symbol, start,
+                               end if cache is None else _year_end(year)),
+                   symbol,
+                   callbacks=[ATR(20)],
+                   cache=cache,
+                   copy=False)
+    s.simulate(reset_index=False)
+    data = s.data.iloc[:n].dropna()
+    if data.empty:
+        return None
+    row = data.iloc[-1]
+    return row['close'], row[colname]
+
+
+def _unit(inputs, base):
+    """按头寸单位计算每次交易数量（100的整数倍）"""
+    if inputs is None:
+        return 0
+    return int(position_unit(inputs[0], inputs[1], base) / 100) * 100
+
+
+def _simulate_symbol(panel, symbol, look, year, cbs, cache=None):
+    s = Simulation(panel.slice(symbol, _year_start(look[0]), _year_end(year)),
+                   symbol,
+                   callbacks=cbs,
+                   cache=cache,
+                   copy=False)
+    s.simulate(reset_index=False)
+    return s.data
+
+
+def backtest_year(data, year, holds, init_cash, tb_kwgs, verbose=0,
+                  skip_buys=()):
+    """使用 :py:class:`finance_tools_py.backtest.TurtleStrategy` 回测一个年度。
+
+    根据 `opt` 列生成买卖点（值为1时买入，值为0时卖出），只回测 `year` 年的数据，并从上一年度的持仓开始计算。
+
+    Args:
+        data (:py:class:`pandas.DataFrame`): 按日期排序的所有股票的数据。需要包含 `code` 、 `date` 、 `opt` 列，
+            可以包含 `year` 年之前的数据（只用来生成买卖点）。
+        year (int): 回测年份。
+        holds (dict): 上一年度的持仓。参考 :py:attr:`finance_tools_py.backtest.TurtleStrategy.holds` 。
+        init_cash (float): 初始资金。
+        tb_kwgs (dict): :py:class:`finance_tools_py.backtest.TurtleStrategy` 的参数集合。
+        verbose (int): 是否显示计算过程。0（不显示），1（显示部分），2（显示全部）。默认为0。
+        skip_buys ([str]): 不再买入（只卖出）的股票代码。
+
+    Returns:
+        - :py:class:`finance_tools_py.backtest.BackTest`: 回测结果。
+
+        - dict: 年末的持仓。可以作为下一年度的 `holds` 。
+
+        - dict: 买点字典。
+
+        - dict: 卖点字典。
+
+        - :py:class:`pandas.DataFrame`: 回测用的数据。
+    """
+    buy_dict = data[data['opt'] == 1].groupby('code')['date'].apply(
+        lambda x: x.dt.to_pydatetime()).to_dict()
+    sell_dict = data[data['opt'] == 0].groupby('code')['date'].apply(
+        lambda x: x.dt.to_pydatetime()).to_dict()
+    for code in skip_buys:
+        buy_dict.pop(code, None)
+
+    data = data[data['date'] >= _year_start(year)]
+    if verbose == 2:
+        print('起止日期:{:%Y-%m-%d}~{:%Y-%m-%d}'.format(min(data['date']),
+                                                  max(data['date'])))
+
+    ts = TurtleStrategy(buy_dict=buy_dict,
+                        sell_dict=sell_dict,
+                        holds=holds,
+                        **tb_kwgs)
+    bt = BackTest(data,
+                  init_cash=init_cash,
+                  init_hold=TurtleStrategy.Hold.to_frame(holds)
+                  if holds else pd.DataFrame(),
+                  live_start_date=_year_start(year),
+                  callbacks=[ts])
+    bt.calc_trade_history(verbose=verbose)
+    return bt, ts.holds, buy_dict, sell_dict, data
+
+
+def _prepare_segment(shared, task):
+    """在子进程中按股票排名计算一个年度的头寸单位及指标。
+
+    使用初始的头寸单位基准选取股票。年度之间需要传递的资金及持仓不在这里处理。
+    """
+    panel, cbs, colname, top, base, cache = shared
+    look, year, ranking = task
+    inputs = {}
+    selected = []
+    for symbol in ranking:
+        inputs[symbol] = _unit_inputs(panel, symbol, look, year, colname,
+                                      cache)
+        if _unit(inputs[symbol], base) > 0:
+            selected.append(symbol)
+        if len(selected) >= top:
+            break
+    frames = {
+        symbol: _simulate_symbol(panel, symbol, look, year, cbs, cache)
+        for symbol in selected
+    }
+    return ranking, inputs, frames
+
+
+class WalkForward():
+    """逐年度对流动性最大的n支股票进行回测。
+
+    数据在初始化时按 (股票代码, 日期) 排序一次，之后按股票及日期截取数据时只需要二分查找。
+    所有年度的股票排名通过 :py:func:`finance_tools_py.calc.fluidity_windows` 一次计算；
+    各年度的头寸单位及指标计算互不依赖，在进程池中同时计算；
+    只有将资金及持仓带入下一年度的回测计算按年度顺序执行。
+
+    Attributes:
+        panel (:py:class:`finance_tools_py.panel.Panel`): 按 (股票代码, 日期) 排序后的数据。
+        cbs ([:py:class:`finance_tools_py.simulation.callbacks.CallBack`]): 对数据进行模拟填充时的回调。
+        start_year (int): 开始计算年份。
+        end_year (int): 结束计算年份。
+        lookback (int): 回看年数。
+        top (int): 每个年度选取的股票数量。
+        tb_kwgs (dict): :py:class:`finance_tools_py.backtest.TurtleStrategy` 的参数集合。
+
+    Example:
+        >>> from finance_tools_py.walkforward import WalkForward
+        >>> wf = WalkForward(fulldata,
+        >>>                  cbs=[ATR(20), BBANDS(20, 2, 2), CALC_OPT()],
+        >>>                  start_year=2005, end_year=2010, top=5,
+        >>>                  tb_kwgs={'colname': 'atr_20'})
+        >>> df_profit, report, datas, buys, sells = wf.run(init_cash=10000, n_jobs=4)
+    """
+    def __init__(self,
+                 fulldata,
+                 cbs,
+                 start_year=2005,
+                 end_year=2020,
+                 lookback=1,
+                 top=10,
+                 tb_kwgs={},
+                 **kwargs):
+        """初始化
+
+        Args:
+            fulldata (:py:class:`pandas.DataFrame`): 完整的原始数据。
+                index[0]为股票代码,index[1]为日期；或者包含 `code` 列及 `date` 列。
+                也可以传入 :py:class:`finance_tools_py.panel.Panel` 。
+                需要包含 `close` 、 `high` 、 `low` 、 `amount` 、 `rets` 列。
+            cbs ([:py:class:`finance_tools_py.simulation.callbacks.CallBack`]): 对数据进行模拟填充时的回调。
+                参考 :py:class:`finance_tools_py.simulation.Simulation` 中的`callbacks`参数。回调需要生成 `opt` 列，
+                值为1时买入，值为0时卖出。
+            start_year (int): 开始计算年份。
+            end_year (int): 结束计算年份。
+            lookback (int): 回看几年的数据，用来计算流动性及头寸单位。默认为1。
+            top (int): 选取流动性最大的n值股票。默认为10。
+            tb_kwgs (dict): :py:class:`finance_tools_py.backtest.TurtleStrategy` 的参数集合。需要包含 `colname` 。
+            unit_percent (float): 计算头寸单元时使用的基准，默认为1%。
+            fixed_unit (bool): 是否使用固定金额（init_cash）作为计算头寸单元的标的。默认为True。
+                如果为False的话，会在每年开始时，使用上一年度的总资产（:py:attr:`finance_tools_py.backtest.BackTest.total_assets_cur`）结合`unit_percent`进行运算。
+            cache (:py:class:`finance_tools_py.simulation.cache.IndicatorCache`): 回调计算结果的缓存。默认为 `None` ，不使用缓存。
+                计算头寸单位时的ATR(20)与 `cbs` 中相同参数的回调共享计算结果。
+                多进程计算时，只有带 `cache_dir` 的缓存可以在进程之间共享计算结果。
+        """
+        self.panel = fulldata if isinstance(fulldata,
+                                            Panel) else Panel(fulldata)
+        self.cbs = cbs
+        self.start_year = start_year
+        self.end_year = end_year
+        self.lookback = lookback
+        self.top = top
+        self.tb_kwgs = tb_kwgs
+        self.unit_percent = kwargs.pop('unit_percent', 0.01)
+        self.fixed_unit = kwargs.pop('fixed_unit', True)
+        self.cache = kwargs.pop('cache', None)
+
+    def segments(self):
+        """回看期间及回测年度。
+
+        Returns:
+            [([int],int)]: 回看期间（起止年份）及回测年份组成的集合。
+        """
+        result = []
+        for i in range(self.start_year, self.end_year):
+            if i + self.lookback <= self.end_year:
+                result.append(([i, i + self.lookback - 1], i + self.lookback))
+        return result
+
+    def run(self, init_cash=10000, n_jobs=1, verbose=0):
+        """执行回测。
+
+        Args:
+            init_cash (float): 初始资金。
+            n_jobs (int): 计算股票排名及指标时的进程数。为 `None` 或小于等于0时使用所有的CPU核心。为1时在当前进程中计算。默认为1。
+                使用多个进程时，不支持 `fork` 的平台上 `cbs` 中的回调需要可以被序列化（参考 :py:mod:`finance_tools_py._pool` ）。
+            verbose (int): 是否显示计算过程。0（不显示），1（显示部分），2（显示全部）。默认为0。
+
+        Returns:
+            - :py:class:`pandas.DataFrame`: 所有年度的损益表。参考 :py:func:`finance_tools_py.backtest.BackTest.profit_loss_df` 。
+
+            - dict: BackTest字典。key值为年份。
+
+            - dict: 回测用的数据源字典。key值为年份。
+
+            - dict: 买点字典。key值为年份。
+
+            - dict: 卖点字典。key值为年份。
+        """
+        report = {}
+        datas = {}
+        buys = {}
+        sells = {}
+        for year, bt, data, buy_dict, sell_dict in self.iter_run(
+                init_cash, n_jobs, verbose):
+            report[year] = bt
+            datas[year] = data
+            buys[year] = buy_dict
+            sells[year] = sell_dict
+        df_profit = pd.concat([x.profit_loss_df() for x in report.values()
+                               ]) if report else pd.DataFrame()
+        return df_profit, report, datas, buys, sells
+
+    def iter_run(self, init_cash=10000, n_jobs=1, verbose=0):
+        """逐年度执行回测，每个年度回测完成后立即返回该年度的结果。参数参考 :py:meth:`run` 。
+
+        各年度的股票排名及指标按年度顺序计算（使用多个进程时同时计算），只需要计算到当前年度即可返回。
+        没有任何可跟踪股票的年度不会返回。
+
+        Yields:
+            (int, :py:class:`finance_tools_py.backtest.BackTest`, :py:class:`pandas.DataFrame`, dict, dict):
+            年份、回测结果、回测用的数据源、买点字典、卖点字典。
+        """
+        colname = self.tb_kwgs['colname']
+        base = init_cash * self.unit_percent  # 计算头寸单元时使用的基准
+        segments = self.segments()
+        rankings = fluidity_windows(
+            self.panel, [(_year_start(look[0]), _year_end(look[-1]))
+                         for look, year in segments])
+        prepared = imap_shared(_prepare_segment,
+                               (self.panel, self.cbs, colname, self.top,
+                                base, self.cache),
+                               [(look, year, r.index.tolist())
+                                for (look, year), r in zip(segments, rankings)],
+                               n_jobs=n_jobs,
+                               chunksize=1,
+                               desc='计算指标中...')
+
+        h = {}
+        for (look, year), (ranking, inputs, frames) in zip(segments, prepared):
+            tb_kwgs = copy.deepcopy(self.tb_kwgs)
+            tb_kwgs['min_amount'] = {}
+            tb_kwgs['max_amount'] = {}
+            top_year = []
+            for symbol in ranking:
+                if symbol not in inputs:
+                    # 头寸单位基准变小时，需要计算更多的股票
+                    inputs[symbol] = _unit_inputs(self.panel, symbol, look,
+                                                  year, colname, self.cache)
+                m = _unit(inputs[symbol], base)
+                if m > 0:
+                    tb_kwgs['min_amount'][symbol] = m
+                    tb_kwgs['max_amount'][symbol] = m * 4
+                    top_year.append(symbol)
+                elif verbose > 0 and inputs[symbol] is not None:
+                    print('{}-根据时间 {}~{} 计算头寸单位大小为0'.format(
+                        symbol, look[0], look[-1]))
+                if len(top_year) >= self.top:
+                    break
+
+            hold_codes = [code for code, book in h.items() if len(book)]
+            ls = top_year + [c for c in hold_codes if c not in top_year]
+            if not ls:
+                if verbose > 0:
+                    print('{}无任何可跟踪的股票'.format(year))
+                continue
+
+            df_symbol_years = pd.concat([
+                frames[symbol] if symbol in frames else _simulate_symbol(
+                    self.panel, symbol, look, year, self.cbs, self.cache)
+                for symbol in ls
+            ])
+            df_symbol_years.sort_values('date', kind='mergesort', inplace=True)
+
+            bt, h, buy_dict, sell_dict, data = backtest_year(
+                df_symbol_years,
+                year,
+                h,
+                init_cash,
+                tb_kwgs,
+                verbose=verbose,
+                skip_buys=set(hold_codes).difference(top_year))
+            yield year, bt, data, buy_dict, sell_dict
+
+            if not self.fixed_unit:
+                base = bt.total_assets_cur * self.unit_percent
+            init_cash = bt.available_cash
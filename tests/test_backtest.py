@@ -8,6 +8,8 @@ from finance_tools_py.backtest import MinAmountChecker
 from finance_tools_py.backtest import AllInChecker
 from finance_tools_py.backtest import Utils
 from finance_tools_py.backtest import TurtleStrategy
+from finance_tools_py.backtest import PositionLedger
+from finance_tools_py.backtest import TradeLog
 import os
 
 
@@ -561,6 +563,260 @@ def test_calc_Skip():
         2000, 1, 1)
 
 
+def test_position_ledger():
+    ledger = PositionLedger()
+    assert ledger.avg_price('000001') == (0.0, 0.0)
+    ledger.buy('000001', 100, 4.5, dt(1998, 1, 1))
+    ledger.buy('000001', 200, 6.7, dt(1999, 1, 1))
+    ledger.buy('000002', 100, 41.5, dt(1999, 1, 1))
+    assert ledger.avg_price('000001') == np.average([4.5, 6.7],
+                                                    weights=[100, 200],
+                                                    returned=True)
+    ledger.sell('000001', 150)
+    assert ledger.lots('000001') == [(dt(1999, 1, 1), 150, 6.7)]
+    assert ledger.amount('000001') == 150
+    assert np.round(ledger.avg_price('000001')[0], 6) == 6.7
+    ledger.sell('000001', 150)
+    assert '000001' not in ledger
+    assert ledger.avg_price('000001') == (0.0, 0.0)
+    assert ledger.codes == ['000002']
+    assert len(ledger) == 1
+
+
+def test_trade_log():
+    log = TradeLog(capacity=1)
+    assert len(log) == 0
+    assert log['tax'].sum() == 0
+    log.append(dt(1998, 1, 1), '000001', 4.5, 100, 544.55, 5, 0.45, 455.45, 1)
+    log.append(dt(1999, 1, 1), '000002', 7.9, -100, 1328.76, 5, 0.79, 795.79,
+               -1)
+    log.append(dt(2000, 1, 1), '000001', 6.7, 100, 653.09, 5, 0.67, 675.67, 1)
+    assert len(log) == 3
+    assert log[-1] == [
+        pd.Timestamp('2000-01-01'), '000001', 6.7, 100, 653.09, 5, 0.67,
+        675.67, 1
+    ]
+    assert list(log['code']) == ['000001', '000002', '000001']
+    assert log['toward'].dtype == np.int8
+    assert np.round(log['commission'].sum(), 2) == 15
+    df = log.to_frame()
+    assert df.columns.tolist() == TradeLog.headers
+    assert df['datetime'].iloc[1] == pd.Timestamp('1999-01-01')
+    assert df['amount'].tolist() == [100, -100, 100]
+    with pytest.raises(IndexError):
+        log[3]
+
+
+def test_cached_views(init_global_data):
+    bt = BackTest(pytest.global_data,
+                  callbacks=[
+                      MinAmountChecker(
+                          buy_dict={pytest.global_code: [dt(2001, 1, 1)]})
+                  ])
+    assert bt.hold_price_cur_df.empty
+    assert bt.total_assets_cur == 10000
+    bt.calc_trade_history()
+    assert bt.history_df is bt.history_df
+    assert bt.hold_price_cur_df is bt.hold_price_cur_df
+    assert 100 == bt.hold_price_cur_df.loc[pytest.global_code]['amount']
+    assert np.round(bt.total_assets_cur,
+                    2) == np.round(bt.available_cash + 15.3 * 100, 2)
+
+
+def test_mark_to_market(init_global_data):
+    marks = []
+
+    class chker(MinAmountChecker):
+        def on_check_buy(self, date, code, price, cash, **kwargs):
+            marks.append(bt.mark_to_market())
+            return super().on_check_buy(date, code, price, cash, **kwargs)
+
+    bt = BackTest(pytest.global_data,
+                  col_name='close',
+                  callbacks=[
+                      chker(buy_dict={pytest.global_code: [dt(1999, 1, 1)]})
+                  ])
+    assert bt.last_price(pytest.global_code) is None
+    bt.calc_trade_history()
+    assert marks[:2] == [10000, 10000]
+    cash = 10000 - 7.9 * 100 - 5 - 7.9 * 100 * 0.001
+    assert np.round(marks[2], 2) == np.round(cash + 6.7 * 100, 2)
+    assert np.round(marks[3], 2) == np.round(cash + 13.4 * 100, 2)
+    assert bt.last_price(pytest.global_code) == 15.3
+    assert bt.mark_to_market() == bt.total_assets_cur
+
+
+def test_record_equity():
+    data = pd.DataFrame({
+        'code': ['000001' for x in range(5)] + ['000002' for x in range(5)],
+        'date': [dt(1998 + x, 1, 1) for x in range(5)] * 2,
+        'close': [4.5, 7.9, 6.7, 13.4, 15.3, 10.1, 9.8, 12.3, 11.0, 14.2],
+    }).sort_values('date').reset_index(drop=True)
+    bt = BackTest(data,
+                  init_cash=50000,
+                  callbacks=[
+                      MinAmountChecker(
+                          buy_dict={
+                              '000001': [dt(1998, 1, 1),
+                                         dt(2000, 1, 1)],
+                              '000002': [dt(1999, 1, 1)]
+                          },
+                          sell_dict={'000001': [dt(2001, 1, 1)]})
+                  ])
+    assert bt.equity_df is None
+    bt.calc_trade_history(record_equity=True)
+    equity = bt.equity_df
+    assert equity.index.tolist() == [
+        pd.Timestamp(1998 + x, 1, 1) for x in range(5)
+    ]
+    assert equity['cash'].tolist() == [
+        bt.cash[1], bt.cash[2], bt.cash[3], bt.cash[4], bt.cash[4]
+    ]
+    assert np.round(equity['positions'].iloc[2], 2) == np.round(
+        6.7 * 200 + 12.3 * 100, 2)
+    assert np.round(equity['total'].iloc[-1],
+                    2) == np.round(bt.total_assets_cur, 2)
+    assert np.round(equity['rets'].iloc[1], 6) == np.round(
+        equity['total'].iloc[1] / equity['total'].iloc[0] - 1, 6)
+
+
+def test_minamountchecker_date_index():
+    dates = pd.Series(pd.to_datetime(['2000-01-03', '2000-01-05']))
+    for values in [
+            dates.dt.to_pydatetime(),
+            pd.DatetimeIndex(dates), dates, [dt(2000, 1, 3),
+                                             dt(2000, 1, 5)]
+    ]:
+        chk = MinAmountChecker(buy_dict={'000001': values},
+                               sell_dict={'000002': values})
+        assert chk.on_check_buy(dt(2000, 1, 3), '000001', 1, 0)
+        assert chk.on_check_buy(pd.Timestamp('2000-01-05'), '000001', 1, 0)
+        assert not chk.on_check_buy(dt(2000, 1, 4), '000001', 1, 0)
+        assert not chk.on_check_buy(dt(2000, 1, 3), '000002', 1, 0)
+        assert chk.on_check_sell(datetime.datetime(2000, 1, 5), '000002', 1,
+                                 0, 0, 0)
+        assert not chk.on_check_sell(dt(2000, 1, 3), '000001', 1, 0, 0, 0)
+    chk.buy_dict = {'000002': [dt(2000, 1, 4)]}
+    assert not chk.on_check_buy(dt(2000, 1, 3), '000001', 1, 0)
+    assert chk.on_check_buy(dt(2000, 1, 4), '000002', 1, 0)
+
+
+@pytest.mark.parametrize('engine', ['iterrows', 'signal'])
+def test_hold_price_index(engine, monkeypatch):
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2000-01-01', periods=200)
+    codes = ['00000{}'.format(i) for i in range(4)]
+    data = pd.DataFrame({
+        'code': np.repeat(codes, len(dates)),
+        'date': np.tile(dates, len(codes)),
+        'close': rng.uniform(5, 15, len(dates) * len(codes)).round(2),
+    }).sort_values('date', kind='stable').reset_index(drop=True)
+    buy_dict = {c: list(rng.choice(dates, 40, replace=False)) for c in codes}
+    sell_dict = {c: list(rng.choice(dates, 30, replace=False)) for c in codes}
+    init_hold = pd.DataFrame({
+        'code': [codes[0]],
+        'amount': [300],
+        'price': [8.0],
+        'buy_date': [dates[0]],
+        'stoploss_price': [-1],
+        'stopprofit_price': [-1],
+        'next_price': [-1],
+    })
+    bt = BackTest(data,
+                  init_cash=100000,
+                  init_hold=init_hold,
+                  callbacks=[MinAmountChecker(buy_dict, sell_dict)])
+    bt.calc_trade_history(engine=engine)
+
+    # 与按成交历史分组计算的结果一致：最近一次清仓之后的成交按数量加权
+    expected = {}
+    for code, df in bt.history_df.groupby('code'):
+        flat = np.flatnonzero(df['amount'].cumsum().values == 0)
+        df = df.iloc[flat[-1] + 1:] if len(flat) else df
+        if df['amount'].sum() != 0:
+            expected[code] = np.average(df['price'], weights=df['amount'],
+                                        returned=True)
+    last = data.drop_duplicates('code', keep='last').set_index('code')['close']
+    assert len(expected) > 0
+
+    # 估值直接读取成交时维护的累计值及最近价格，不再扫描成交历史或数据
+    def fail(*args, **kwargs):
+        raise AssertionError('不应扫描数据')
+
+    monkeypatch.setattr(pd.DataFrame, 'groupby', fail)
+    monkeypatch.setattr(pd.DataFrame, 'sort_values', fail)
+    monkeypatch.setattr(pd.DataFrame, 'drop_duplicates', fail)
+    hold = bt.hold_price_cur_df
+    assert hold.index.tolist() == sorted(expected)
+    for code, (price, amount) in expected.items():
+        assert hold.loc[code, 'buy_price'] == pytest.approx(price)
+        assert hold.loc[code, 'amount'] == amount
+        assert hold.loc[code, 'price_cur'] == last[code]
+    assert bt.total_assets_cur == pytest.approx(
+        bt.available_cash + sum(hold['amount'] * last[hold.index]))
+
+
+def test_calc_engine_columnar():
+    data = pd.DataFrame({
+        'code': ['000001' for x in range(5)] + ['000002' for x in range(5)],
+        'date': [dt(1998 + x, 1, 1) for x in range(5)] * 2,
+        'close': [4.5, 7.9, 6.7, 13.4, 15.3, 10.1, 9.8, 12.3, 11.0, 14.2],
+    }).sort_values('date').reset_index(drop=True)
+    buy_dict = {
+        '000001': [dt(1998, 1, 1), dt(2000, 1, 1)],
+        '000002': [dt(1999, 1, 1), dt(2001, 1, 1)]
+    }
+    sell_dict = {'000001': [dt(2001, 1, 1)], '000002': [dt(2002, 1, 1)]}
+
+    bts = []
+    for engine in ['iterrows', 'columnar']:
+        bt = BackTest(data,
+                      init_cash=50000,
+                      callbacks=[MinAmountChecker(buy_dict, sell_dict)])
+        bt.calc_trade_history(engine=engine)
+        bts.append(bt)
+    assert bts[0].cash == bts[1].cash
+    pd.testing.assert_frame_equal(bts[0].history_df, bts[1].history_df)
+    pd.testing.assert_frame_equal(bts[0].hold_price_cur_df,
+                                  bts[1].hold_price_cur_df)
+
+    with pytest.raises(ValueError):
+        BackTest(data).calc_trade_history(engine='unknown')
+
+
+@pytest.mark.parametrize('checker,init_cash', [(MinAmountChecker, 50000),
+                                                (MinAmountChecker, 2000),
+                                                (AllInChecker, 5000)])
+def test_calc_engine_signal(checker, init_cash):
+    data = pd.DataFrame({
+        'code': ['000001' for x in range(7)] + ['000002' for x in range(7)],
+        'date': [dt(1998 + x, 1, 1) for x in range(7)] * 2,
+        'close': [4.5, 7.9, 6.7, 10, 3.0, 3.5, 5.0] +
+        [10.1, 9.8, 12.3, 11.0, 14.2, 13.1, 9.9],
+    }).sort_values('date').reset_index(drop=True)
+    buy_dict = {
+        '000001': [dt(1998, 1, 1), dt(1999, 1, 1), dt(2000, 1, 1)],
+        '000002': [dt(1998, 1, 1), dt(2001, 1, 1), dt(2003, 1, 1)]
+    }
+    sell_dict = {
+        '000001': [dt(2000, 1, 1), dt(2002, 1, 1), dt(2003, 1, 1)],
+        '000002': [dt(1999, 1, 1), dt(2002, 1, 1)]
+    }
+
+    bts = []
+    for engine in ['iterrows', 'signal']:
+        bt = BackTest(data,
+                      init_cash=init_cash,
+                      live_start_date=dt(1999, 1, 1),
+                      callbacks=[checker(buy_dict, sell_dict)])
+        bt.calc_trade_history(engine=engine, bssd_buy=True)
+        bts.append(bt)
+    assert bts[0].cash == bts[1].cash
+    pd.testing.assert_frame_equal(bts[0].history_df, bts[1].history_df)
+    assert bts[0]._BackTest__get_buy_avg_price(
+        '000001') == bts[1]._BackTest__get_buy_avg_price('000001')
+
+
 def test_calc_pnl_fifo():
     desired_width = 320
     pd.set_option('display.width', desired_width)
@@ -1,5 +1,8 @@
 from finance_tools_py.calc import position_unit
 from finance_tools_py.calc import fluidity
+from finance_tools_py.calc import fluidity_windows
+from finance_tools_py.calc import buy_cost
+from finance_tools_py.calc import max_buy_amount
 import pandas as pd
 
 def test_position_unit():
@@ -10,4 +13,63 @@ def test_fluidity():
                      'amount':[100,100,200,400,1000,3000],
                      'rets':[0.01,0.23,0.02,0.55,0.10,0.45]})
     print(df)
-    print(fluidity(df))
\ No newline at end of file
+    print(fluidity(df))
+
+
+def test_fluidity_windows():
+    import numpy as np
+    from finance_tools_py.panel import Panel
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2005-01-01', '2006-12-31')
+    df = pd.concat([
+        pd.DataFrame({
+            'code': '00000{}'.format(i),
+            'date': dates[i * 20:],
+            'amount': rng.uniform(1, 100, len(dates) - i * 20) * (i + 1),
+            'rets': rng.normal(0, 0.02, len(dates) - i * 20)
+        }) for i in range(6)
+    ])
+    df.loc[df.index[::7], 'amount'] = np.nan
+    panel = Panel(df)
+    windows = [('2005-01-01', '2005-12-31'), ('2006-01-01', '2006-12-31'),
+               (None, '2005-02-15'), ('2005-06-01', None), (None, None),
+               ('2005-03-01', '2005-03-01'), ('2010-01-01', '2010-12-31')]
+    results = fluidity_windows(panel, windows)
+    assert len(results) == len(windows)
+    for (start, end), result in zip(windows, results):
+        expected = fluidity(panel.window(start, end))
+        pd.testing.assert_frame_equal(result, expected, check_names=False)
+    assert results[-1].empty
+    # DataFrame与Panel的结果相同
+    for a, b in zip(fluidity_windows(df.set_index(['code', 'date']), windows),
+                    results):
+        pd.testing.assert_frame_equal(a, b)
+
+def test_buy_cost():
+    assert buy_cost(10, 100) == 1006
+    assert buy_cost(100, 100) == 10000 + 10 + 10
+
+
+def test_max_buy_amount():
+    import numpy as np
+
+    def loop(price, cash, lot, commission_coeff, min_commission, tax_coeff):
+        amount = lot
+        while price * amount + max(price * amount * commission_coeff,
+                                   min_commission) + price * amount * tax_coeff <= cash:
+            amount = amount + lot
+        return amount - lot
+
+    rng = np.random.default_rng(0)
+    prices = np.round(rng.uniform(0.5, 200, 500), 2)
+    cashes = np.round(rng.uniform(0, 200000, 500), 2)
+    for args in [(100, 0.001, 5, 0.001), (1, 0.0003, 5, 0), (100, 0, 0, 0)]:
+        expected = [loop(p, c, *args) for p, c in zip(prices, cashes)]
+        assert max_buy_amount(prices, cashes, *args).tolist() == expected
+        assert [max_buy_amount(p, c, *args)
+                for p, c in zip(prices, cashes)] == expected
+    # 刚好可以买入的边界
+    assert max_buy_amount(10, 1006) == 100
+    assert max_buy_amount(10, 1005.99) == 0
+    assert max_buy_amount(0, 1000) == 0
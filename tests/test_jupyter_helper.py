@@ -107,27 +107,6 @@ def test_test_all_years():
                         raise
 
 
-def test_cache():
-
-    d = {}
-
-    symbol = '123456'
-    start = None
-    end = None
-    data = np.array([1, 2, 3, 4, 5])
-    c1 = finance_tools_py._jupyter_helper._cache(symbol)
-    d[c1] = data
-    assert len(d) == 1
-    c2 = finance_tools_py._jupyter_helper._cache(symbol, start, end)
-    d[c2] = data
-    assert len(d) == 1
-    assert np.array_equal(np.array(d[c1]), np.array(d[c2]))
-    c3 = finance_tools_py._jupyter_helper._cache(symbol, '123', '456')
-    d[c3] = np.array([2, 3, 4, 5, 6])
-    assert len(d) == 2
-    assert not np.array_equal(np.array(d[c3]), np.array(d[c2]))
-
-
 @pytest.mark.skip
 def test_profile():
     import cProfile, pstats, io
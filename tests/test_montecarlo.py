@@ -0,0 +1,77 @@
+from datetime import date as dt
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from finance_tools_py.backtest import BackTest
+from finance_tools_py.backtest import MinAmountChecker
+from finance_tools_py.montecarlo import iter_random_entry
+from finance_tools_py.montecarlo import random_entry
+from finance_tools_py.montecarlo import trial_rng
+
+
+@pytest.fixture
+def mc_data():
+    np.random.seed(0)
+    dates = [dt(2000, 1, 1) + datetime.timedelta(days=x) for x in range(60)]
+    dfs = []
+    for code in ['000001', '000002']:
+        dfs.append(
+            pd.DataFrame({
+                'code': code,
+                'date': dates,
+                'close': 10 + np.cumsum(np.random.normal(0, 0.3, len(dates)))
+            }))
+    return pd.concat(dfs).sort_values('date',
+                                      kind='stable').reset_index(drop=True)
+
+
+def test_trial_rng():
+    children = np.random.SeedSequence(1234).spawn(3)
+    for i, child in enumerate(children):
+        np.testing.assert_array_equal(
+            trial_rng(1234, i).random(5),
+            np.random.default_rng(child).random(5))
+
+
+def test_random_entry(mc_data):
+    result = random_entry(mc_data, times=6, buy_times=10, seed=1234, n_jobs=1)
+    assert result.columns.tolist() == [
+        'trial', 'total_assets', 'available_cash', 'trades'
+    ]
+    assert result['trial'].tolist() == list(range(6))
+    assert result['total_assets'].nunique() > 1
+    pd.testing.assert_frame_equal(
+        result,
+        random_entry(mc_data, times=6, buy_times=10, seed=1234, n_jobs=2))
+
+    # 与逐次回测的结果一致
+    codes = mc_data['code'].tolist()
+    dates = mc_data['date'].tolist()
+    for trial in range(6):
+        buys = {}
+        for i in trial_rng(1234, trial).choice(len(mc_data), 10):
+            buys.setdefault(codes[i], []).append(dates[i])
+        bt = BackTest(mc_data,
+                      init_cash=50000,
+                      callbacks=[MinAmountChecker(buys, {})])
+        bt.calc_trade_history()
+        assert result['total_assets'][trial] == pytest.approx(
+            bt.total_assets_cur)
+        assert result['available_cash'][trial] == pytest.approx(
+            bt.available_cash)
+        assert result['trades'][trial] == len(bt.history)
+
+
+def test_iter_random_entry(mc_data):
+    results = iter_random_entry(mc_data,
+                                times=3,
+                                buy_times=5,
+                                seed=1,
+                                keep_history=True,
+                                init_cash=1000,
+                                n_jobs=2)
+    for i, r in enumerate(results):
+        assert r['trial'] == i
+        assert len(r['history']) == r['trades']
+        assert r['available_cash'] <= 1000
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from finance_tools_py.backtest import BackTest
+from finance_tools_py.backtest import MinAmountChecker
+from finance_tools_py.panel import Panel
+from finance_tools_py.simulation import Simulation
+from finance_tools_py.simulation import simulate_many
+from finance_tools_py.simulation.callbacks.talib import SMA
+
+
+@pytest.fixture
+def panel_data():
+    np.random.seed(0)
+    dates = pd.date_range('2020-01-01', periods=30)
+    dfs = []
+    for code in ['000003', '000001', '000002']:
+        dfs.append(
+            pd.DataFrame({
+                'code': code,
+                'date': dates,
+                'close': 10 + np.cumsum(np.random.normal(0, 0.3, len(dates)))
+            }))
+    return pd.concat(dfs).sort_values('date', kind='stable')
+
+
+def test_panel(panel_data):
+    panel = Panel(panel_data.set_index(['code', 'date']))
+    assert panel.codes == ['000001', '000002', '000003']
+    assert len(panel) == 90
+    assert '000002' in panel
+    assert '000004' not in panel
+    assert panel.offsets('000002') == (30, 60)
+    assert panel.offsets('000004') == (0, 0)
+
+    df = panel.slice('000002', '2020-01-05', '2020-01-10')
+    expected = panel_data[(panel_data['code'] == '000002')
+                          & (panel_data['date'] >= '2020-01-05') &
+                          (panel_data['date'] <= '2020-01-10')]
+    np.testing.assert_array_equal(df['close'].values, expected['close'].values)
+    assert np.shares_memory(df['close'].values, panel.data['close'].values)
+    assert len(panel.slice('000002')) == 30
+    assert len(panel.slice('000002', end='2020-01-01')) == 1
+    assert len(panel.slice('000002', start='2020-03-01')) == 0
+    assert panel.slice('000004').empty
+
+    df = panel.window('2020-01-05', '2020-01-10')
+    assert len(df) == 18
+    assert df['code'].tolist() == ['000001'] * 6 + ['000002'] * 6 + [
+        '000003'
+    ] * 6
+    assert len(panel.window(codes=['000003'])) == 30
+
+    df = panel.by_date()
+    assert df['date'].is_monotonic_increasing
+    assert df['code'].tolist()[:3] == ['000001', '000002', '000003']
+
+
+def test_panel_entry_points(panel_data):
+    panel = Panel(panel_data)
+
+    s1 = Simulation(panel, '000002', callbacks=[SMA(5)])
+    s1.simulate()
+    s2 = Simulation(panel_data[panel_data['code'] == '000002'],
+                    '000002',
+                    callbacks=[SMA(5)])
+    s2.simulate()
+    np.testing.assert_array_equal(s1.data['sma_close_5'].values,
+                                  s2.data['sma_close_5'].values)
+    assert 'sma_close_5' not in panel.data.columns
+
+    result = simulate_many(panel, [SMA(5)], n_jobs=1)
+    assert result['code'].tolist() == panel.data['code'].tolist()
+    expected = simulate_many(panel_data, [SMA(5)], n_jobs=1)
+    for code in panel.codes:
+        np.testing.assert_array_equal(
+            result[result['code'] == code]['sma_close_5'].values,
+            expected[expected['code'] == code]['sma_close_5'].values)
+
+    dates = pd.date_range('2020-01-01', periods=30)
+    buys = {'000001': list(dates[:5]), '000003': list(dates[3:6])}
+    sells = {'000001': list(dates[10:12]), '000003': list(dates[20:21])}
+    bts = [
+        BackTest(data,
+                 init_cash=10000,
+                 callbacks=[MinAmountChecker(buys, sells)])
+        for data in [panel, panel.by_date()]
+    ]
+    for bt in bts:
+        bt.calc_trade_history()
+    assert len(bts[0].history) == 11
+    assert bts[0].cash == bts[1].cash
@@ -1,5 +1,6 @@
 from finance_tools_py.backtest import BackTest
 from finance_tools_py.backtest import MinAmountChecker
+from finance_tools_py.calc import max_buy_amount
 import pandas as pd
 import numpy as np
 import datetime
@@ -19,7 +20,7 @@ class chker(MinAmountChecker):
 
     def on_check_sell(self, date: datetime.datetime.timestamp, code: str,
                       price: float, cash: float, hold_amount: float,
-                      hold_price: float) -> bool:
+                      hold_price: float, **kwargs) -> bool:
         if price < hold_price:
             # 当前价格小于持仓价时，不可卖
             return False
@@ -31,22 +32,20 @@ class chker(MinAmountChecker):
             return True
         return False
 
-    def on_calc_buy_amount(self, date, code: str, price: float,
-                           cash: float) -> float:
+    def on_calc_buy_amount(self, date, code: str, price: float, cash: float,
+                           **kwargs) -> float:
         amount = 100
         if self._min_price > 0:
             if cash < self._min_price:
                 return super().on_calc_buy_amount(date, code, price, cash)
-            while True:
-                amount = amount + 100
-                if price * amount > self._min_price:
-                    break
-            amount = amount - 100
+            # 不超过 min_price 的最大买入数量（不计算手续费及印花税），至少为100
+            amount = max(max_buy_amount(price, self._min_price, 100, 0, 0, 0),
+                         100)
         return amount
 
     def on_calc_sell_amount(self, date: datetime.datetime.timestamp, code: str,
                             price: float, cash: float, hold_amount: float,
-                            hold_price: float) -> float:
+                            hold_price: float, **kwargs) -> float:
         """返回所有持仓数量，一次卖出所有"""
         return hold_amount
 
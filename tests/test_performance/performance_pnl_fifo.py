@@ -0,0 +1,141 @@
+"""比较 :py:func:`BackTest._pnl_fifo` 优化前后（逐行遍历 / 累计数量区间配对）的计算速度及结果。"""
+from finance_tools_py.backtest import BackTest
+import pandas as pd
+import numpy as np
+import datetime
+import time
+
+
+def pnl_fifo_iterrows(history_df, code):
+    """优化前的实现：逐行遍历成交记录，通过 deque 按先进先出配对。"""
+    from collections import deque
+    X = dict(
+        zip(code, [{
+            'buy': deque(),
+            'sell': deque()
+        } for i in range(len(code))]))
+    pair_table = []
+    for _, data in history_df.iterrows():
+        if abs(data.amount) < 1:
+            pass
+        else:
+            while True:
+                if data.amount > 0:
+                    X[data.code]['buy'].append(
+                        (data.datetime, data.amount, data.price, 1))
+                    break
+                elif data.amount < 0:
+                    rawoffset = 'buy'
+                    l = X[data.code][rawoffset].popleft()
+                    if abs(l[1]) > abs(data.amount):
+                        """
+                        if raw> new_close:
+                        """
+                        temp = (l[0], l[1] + data.amount, l[2])
+                        X[data.code][rawoffset].appendleft(temp)
+                        if data.amount < 0:
+                            pair_table.append([
+                                data.code, data.datetime, l[0],
+                                abs(data.amount), data.price, l[2],
+                                rawoffset
+                            ])
+                            break
+                        else:
+                            pair_table.append([
+                                data.code, l[0], data.datetime,
+                                abs(data.amount), l[2], data.price,
+                                rawoffset
+                            ])
+                            break
+
+                    elif abs(l[1]) < abs(data.amount):
+                        data.amount = data.amount + l[1]
+
+                        if data.amount < 0:
+                            pair_table.append([
+                                data.code, data.datetime, l[0], l[1],
+                                data.price, l[2], rawoffset
+                            ])
+                        else:
+                            pair_table.append([
+                                data.code, l[0], data.datetime, l[1], l[2],
+                                data.price, rawoffset
+                            ])
+                    else:
+                        if data.amount < 0:
+                            pair_table.append([
+                                data.code, data.datetime, l[0],
+                                abs(data.amount), data.price, l[2],
+                                rawoffset
+                            ])
+                            break
+                        else:
+                            pair_table.append([
+                                data.code, l[0], data.datetime,
+                                abs(data.amount), l[2], data.price,
+                                rawoffset
+                            ])
+                            break
+    pair_title = [
+        'code', 'sell_date', 'buy_date', 'amount', 'sell_price',
+        'buy_price', 'rawdirection'
+    ]
+    pnl = pd.DataFrame(pair_table, columns=pair_title)
+
+    pnl = pnl.assign(
+        pnl_ratio=(pnl.sell_price / pnl.buy_price) - 1,  #盈利比率
+        sell_date=pd.to_datetime(pnl.sell_date),
+        buy_date=pd.to_datetime(pnl.buy_date))
+    pnl = pnl.assign(
+        pnl_money=(pnl.sell_price - pnl.buy_price) * pnl.amount * 1,  #盈利金额
+        hold_gap=abs(pnl.sell_date - pnl.buy_date),  #持仓时间
+    )
+    return pnl[[
+        'code', 'buy_date', 'sell_date', 'buy_price', 'sell_price',
+        'amount', 'pnl_ratio', 'pnl_money', 'hold_gap'
+    ]].set_index('code')
+
+
+
+
+def mock_history(code_count=200, trade_count=100000, seed=0):
+    """创建 code_count 只股票共 trade_count 笔的随机成交记录。卖出数量不会超过当前持仓。"""
+    rng = np.random.default_rng(seed)
+    codes = ['{:06d}'.format(i) for i in range(1, code_count + 1)]
+    start = datetime.datetime(2000, 1, 1)
+    hold = dict.fromkeys(codes, 0)
+    rows = []
+    for i in range(trade_count):
+        code = codes[rng.integers(code_count)]
+        if hold[code] > 0 and rng.random() < 0.5:
+            amount = -int(rng.integers(1, hold[code] // 100 + 1)) * 100
+        else:
+            amount = int(rng.integers(1, 10)) * 100
+        hold[code] += amount
+        rows.append([
+            code, amount,
+            np.round(rng.uniform(1, 100), 2),
+            start + datetime.timedelta(hours=i)
+        ])
+    return pd.DataFrame(rows, columns=['code', 'amount', 'price', 'datetime'])
+
+
+def do_benchmark(code_count=200, trade_count=100000):
+    history_df = mock_history(code_count, trade_count)
+    codes = history_df.code.unique()
+
+    t = time.perf_counter()
+    old = pnl_fifo_iterrows(history_df, codes)
+    old_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    new = BackTest._pnl_fifo(history_df, codes)
+    new_time = time.perf_counter() - t
+
+    pd.testing.assert_frame_equal(old, new)
+    print('成交记录:{}笔，配对结果:{}笔'.format(len(history_df), len(new)))
+    print('优化前:{:.3f}秒，优化后:{:.3f}秒，提升{:.1f}倍'.format(
+        old_time, new_time, old_time / new_time))
+
+
+do_benchmark(200, 100000)  # 模拟200支股票共100000笔成交
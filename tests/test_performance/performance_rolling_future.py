@@ -0,0 +1,83 @@
+"""比较 :py:class:`Rolling_Future` 优化前后（四次 rolling 聚合 / 单次前向窗口计算）的计算速度及结果，
+以及多个窗口大小时 :py:class:`Rolling_Future_Batch` 的计算速度。"""
+from finance_tools_py.simulation.callbacks import Rolling_Future, Rolling_Future_Batch
+import pandas as pd
+import numpy as np
+import time
+
+
+def assert_frame_close(left, right):
+    """逐列比较结果。平均值的求和顺序与 pandas 不同，只比较到相对误差1e-9。"""
+    assert left.columns.tolist() == right.columns.tolist()
+    for col in left.columns:
+        np.testing.assert_allclose(left[col].values, right[col].values,
+                                   rtol=1e-9, equal_nan=True)
+
+
+def rolling_future_shift(data, timeperiod, col_name='close'):
+    """优化前的实现：平移整个 DataFrame 后分别做四次 rolling 聚合。"""
+    col_min = 'rolling_{}_{}_min'.format(col_name, timeperiod)
+    col_max = 'rolling_{}_{}_max'.format(col_name, timeperiod)
+    col_mean = 'rolling_{}_{}_mean'.format(col_name, timeperiod)
+    col_med = 'rolling_{}_{}_med'.format(col_name, timeperiod)
+    r = data.shift(-timeperiod)[col_name].rolling(timeperiod)
+    data[col_min] = r.min()
+    data[col_max] = r.max()
+    data[col_mean] = r.mean()
+    data[col_med] = r.median()
+    data['{}/{}'.format(col_mean, col_name)] = data[col_mean] / data[col_name]
+    data['{}/{}'.format(col_med, col_name)] = data[col_med] / data[col_name]
+    data['{}/{}'.format(col_max, col_name)] = data[col_max] / data[col_name]
+    data['{}/{}'.format(col_min, col_name)] = data[col_min] / data[col_name]
+
+
+def do_benchmark(size=2000000, timeperiod=20, columns=5, seed=0):
+    """创建 size 行、columns 列的随机数据。其中包含 close 列。"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.uniform(1, 100, (size, columns)),
+                        columns=['close'] +
+                        ['col_{}'.format(i) for i in range(1, columns)])
+    old = data.copy()
+    new = data.copy()
+
+    t = time.perf_counter()
+    rolling_future_shift(old, timeperiod)
+    old_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    Rolling_Future(timeperiod).on_preparing_data(new)
+    new_time = time.perf_counter() - t
+
+    assert_frame_close(old, new)
+    print('数据量:{}行{}列，timeperiod:{}'.format(size, columns, timeperiod))
+    print('优化前:{:.3f}秒，优化后:{:.3f}秒，提升{:.1f}倍'.format(
+        old_time, new_time, old_time / new_time))
+
+
+def do_benchmark_batch(size=2000000, timeperiods=[5, 10, 20, 60], stats=None,
+                       seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({'close': rng.uniform(1, 100, size)})
+    old = data.copy()
+    new = data.copy()
+
+    t = time.perf_counter()
+    for timeperiod in timeperiods:
+        Rolling_Future(timeperiod).on_preparing_data(old)
+    old_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    Rolling_Future_Batch(timeperiods, stats=stats).on_preparing_data(new)
+    new_time = time.perf_counter() - t
+
+    assert_frame_close(old[new.columns], new)
+    print('数据量:{}行，timeperiods:{}，stats:{}'.format(size, timeperiods, stats))
+    print('逐个计算:{:.3f}秒，批量计算:{:.3f}秒，提升{:.1f}倍'.format(
+        old_time, new_time, old_time / new_time))
+
+
+do_benchmark(2000000, 20, 5)  # 模拟2000000行的原始行情数据
+do_benchmark(2000000, 20, 40)  # 模拟2000000行、已附加其他指标列的数据
+do_benchmark_batch(2000000, [5, 10, 20, 60])
+do_benchmark_batch(2000000, [5, 10, 20, 60], ['min', 'max', 'mean'])
+do_benchmark_batch(2000000, [5, 10, 20, 60], ['med'])
@@ -3,6 +3,7 @@ from datetime import date as dt
 import numpy as np
 import pandas as pd
 import pytest
+import warnings
 import talib
 import os
 from finance_tools_py.simulation import Simulation
@@ -828,3 +829,364 @@ def test_Rolling_Future(init_global_data):
         pd.Series(
             [np.NaN, np.NaN, 4.0, 5.0, 6.0, 7.0, 8.0, np.NaN, np.NaN, np.NaN]),
         data[_med])
+
+
+@pytest.mark.parametrize('start_method', ['fork', 'spawn'])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_simulate_many(mock_data, n_jobs, start_method, monkeypatch):
+    from finance_tools_py import _pool
+    from finance_tools_py.simulation import simulate_many
+    monkeypatch.setattr(_pool, '_start_method', start_method)
+    dfs = []
+    for i in range(3):
+        df = pytest.mock_data.copy()
+        df['code'] = '00000{}'.format(i)
+        df['close'] = df['close'] * (i + 1)
+        dfs.append(df)
+    data = pd.concat(dfs).sort_values(['date', 'code']).reset_index(drop=True)
+    cbs = [cb_talib.SMA(5), cb_talib.ATR(20)]
+    with warnings.catch_warnings():
+        # 回调可以被序列化，spawn 方式下不会退回到当前进程中计算
+        warnings.simplefilter('error', UserWarning)
+        result = simulate_many(data, cbs, n_jobs=n_jobs, reset_index=False)
+    assert result['code'].unique().tolist() == ['000000', '000001', '000002']
+    # 保留输入数据的索引
+    assert result.index.is_unique
+    assert sorted(result.index) == data.index.tolist()
+    for i in range(3):
+        code = '00000{}'.format(i)
+        s = Simulation(data[data['code'] == code], code, callbacks=cbs)
+        s.simulate(reset_index=False)
+        pd.testing.assert_frame_equal(s.data, result[result['code'] == code])
+
+    # 默认合并后做一次 reset_index ，输入数据的索引成为 index 列
+    result = simulate_many(data, cbs, n_jobs=n_jobs)
+    assert result.index.tolist() == list(range(len(data)))
+    pd.testing.assert_frame_equal(
+        result.drop(columns=['index']),
+        simulate_many(data, cbs, reset_index=False).reset_index(drop=True))
+
+
+def test_group_key(mock_data):
+    dfs = []
+    for i in range(3):
+        df = pytest.mock_data.copy()
+        df['code'] = '00000{}'.format(i)
+        df['close'] = df['close'] * (i + 1)
+        dfs.append(df)
+    data = pd.concat(dfs).sort_values(['date', 'code']).reset_index(drop=True)
+
+    def cbs(**kwargs):
+        return [
+            cb_talib.BBANDS(5, 2, 2, **kwargs),
+            cb_talib.ATR(14, **kwargs),
+            cb_talib.SMA(5, **kwargs),
+            cb_talib.LINEARREG_SLOPE('close', 5, **kwargs)
+        ]
+
+    grouped = data.copy()
+    for cb in cbs(group_key='code'):
+        cb.on_preparing_data(grouped)
+    for code in data['code'].unique():
+        df = data[data['code'] == code].copy()
+        for cb in cbs():
+            cb.on_preparing_data(df)
+        pd.testing.assert_frame_equal(df, grouped[grouped['code'] == code])
+
+
+def test_indicator_cache(mock_data, tmp_path):
+    from finance_tools_py.simulation.cache import IndicatorCache
+    cbs = [cb_talib.SMA(5), cb_talib.ATR(20)]
+    cache = IndicatorCache(cache_dir=str(tmp_path))
+    s1 = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs)
+    s1.simulate()
+    s2 = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs,
+                    cache=cache)
+    s2.simulate()
+    assert (cache.hits, cache.misses) == (0, 2)
+    s3 = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs,
+                    cache=cache)
+    s3.simulate()
+    assert (cache.hits, cache.misses) == (2, 2)
+    pd.testing.assert_frame_equal(s1.data, s2.data)
+    pd.testing.assert_frame_equal(s1.data, s3.data)
+
+    # 参数或输入数据不同时不使用缓存
+    s4 = Simulation(pytest.mock_data, pytest.mock_code,
+                    callbacks=[cb_talib.SMA(10)], cache=cache)
+    s4.simulate()
+    df = pytest.mock_data.copy()
+    df['close'] = df['close'] * 2
+    s5 = Simulation(df, pytest.mock_code, callbacks=[cb_talib.SMA(5)],
+                    cache=cache)
+    s5.simulate()
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert len(cache) == 4
+
+    # 从缓存文件中读取
+    disk = IndicatorCache(cache_dir=str(tmp_path))
+    s6 = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs,
+                    cache=disk)
+    s6.simulate()
+    assert (disk.hits, disk.misses) == (2, 0)
+    pd.testing.assert_frame_equal(s1.data, s6.data)
+
+    # 超出内存限制时移除最早使用的缓存
+    small = IndicatorCache(max_bytes=cache.nbytes // 4)
+    for cb in cbs:
+        small.apply(cb, pytest.mock_data.copy())
+    assert len(small) == 1
+
+
+def test_indicator_cache_files(mock_data, tmp_path):
+    from finance_tools_py.simulation.cache import IndicatorCache
+
+    class LABEL(callbacks.CallBack):
+        def __init__(self, col_name='close'):
+            self.col_name = col_name
+
+        def on_preparing_data(self, data, **kwargs):
+            data['label'] = np.where(data[self.col_name] > 10, 'up', 'down')
+            data['label_sma'] = data[self.col_name].rolling(3).mean()
+
+    cbs = [LABEL(), cb_talib.SMA(5)]
+    expected = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs)
+    expected.simulate()
+    first = IndicatorCache(cache_dir=str(tmp_path))
+    Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs,
+               cache=first).simulate()
+    # 包含字符串列的结果只在内存中缓存
+    assert len(list(tmp_path.glob('*.npz'))) == 1
+
+    second = IndicatorCache(cache_dir=str(tmp_path))
+    s = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs,
+                   cache=second)
+    s.simulate()
+    assert (second.hits, second.misses) == (1, 1)
+    pd.testing.assert_frame_equal(expected.data, s.data)
+
+    # 无法读取的缓存文件视为未命中
+    for path in tmp_path.glob('*.npz'):
+        path.write_bytes(b'broken')
+    third = IndicatorCache(cache_dir=str(tmp_path))
+    s = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs,
+                   cache=third)
+    s.simulate()
+    assert (third.hits, third.misses) == (0, 2)
+    pd.testing.assert_frame_equal(expected.data, s.data)
+
+
+def test_indicator_cache_overlap(mock_data, tmp_path):
+    from finance_tools_py.simulation.cache import IndicatorCache
+
+    def simulate(data, cache=None):
+        s = Simulation(data, pytest.mock_code,
+                       callbacks=[cb_talib.ATR(20), callbacks.Rolling_Future(5)],
+                       cache=cache)
+        s.simulate()
+        return s.data
+
+    full = pytest.mock_data
+    cache = IndicatorCache(cache_dir=str(tmp_path))
+    simulate(full, cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # 起始行相同的数据窗口共享支持增量计算的回调的结果，需要未来数据的回调只有窗口完全相同时才会命中
+    for n in [len(full) // 2, 30]:
+        expected = simulate(full.iloc[:n])
+        hits = cache.hits
+        pd.testing.assert_frame_equal(expected, simulate(full.iloc[:n], cache))
+        assert cache.hits == hits + 1
+    disk = IndicatorCache(cache_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(simulate(full.iloc[:30]),
+                                  simulate(full.iloc[:30], disk))
+    assert (disk.hits, disk.misses) == (2, 0)
+
+    # 输入数据不同或起始行不同时不使用缓存
+    df = full.iloc[:100].copy()
+    df.loc[df.index[50], 'close'] *= 2
+    hits = cache.hits
+    pd.testing.assert_frame_equal(simulate(df), simulate(df, cache))
+    pd.testing.assert_frame_equal(simulate(full.iloc[10:100]),
+                                  simulate(full.iloc[10:100], cache))
+    assert cache.hits == hits
+
+    # 更长的数据窗口重新计算，并替换缓存中较短的结果
+    cache = IndicatorCache()
+    simulate(full.iloc[:30], cache)
+    simulate(full.iloc[:60], cache)
+    simulate(full.iloc[:40], cache)
+    assert (cache.hits, cache.misses) == (1, 5)
+    # ATR只保留最长的结果，Rolling_Future每个窗口各一个
+    assert len(cache) == 4
+    cache.clear()
+    assert (len(cache), cache.nbytes) == (0, 0)
+
+
+@pytest.mark.parametrize('cb', [
+    lambda **kw: cb_talib.SMA(5, **kw),
+    lambda **kw: cb_talib.EMA(5, **kw),
+    lambda **kw: cb_talib.ATR(14, **kw),
+    lambda **kw: cb_talib.RSI(14, **kw),
+    lambda **kw: cb_talib.BBANDS(5, 2, 2, **kw),
+])
+@pytest.mark.parametrize('split', [0, 3, 100])
+def test_incremental_update(mock_data, cb, split):
+    data = pytest.mock_data
+    expected = data.copy()
+    cb().on_preparing_data(expected)
+    names = [c for c in expected.columns if c not in data.columns]
+
+    inc = cb().seed(data.iloc[:split])
+    columns = data.columns.tolist()
+    rows = [data.iloc[i:i + 1] for i in range(split, split + 20)]
+    rows.append(data.iloc[split + 20:])
+    results = [inc.update(row) for row in rows]
+    result = pd.concat(results)
+    assert result.columns.tolist() == names
+    pd.testing.assert_frame_equal(result, expected[names].iloc[split:])
+    # 结果以新的 DataFrame 返回，不会修改传入的数据
+    assert data.columns.tolist() == columns
+    assert all(row.columns.tolist() == columns for row in rows)
+    assert not any(np.shares_memory(r.values, data.values) for r in results)
+    assert inc.update(data.iloc[:0]).columns.tolist() == names
+
+    # 分组计算
+    dfs = []
+    for i in range(2):
+        df = data.copy()
+        df['code'] = '00000{}'.format(i)
+        df['close'] = df['close'] * (i + 1)
+        dfs.append(df)
+    grouped = pd.concat(dfs).sort_values(['date', 'code'])
+    history = grouped[grouped['date'] < data['date'].iloc[split]]
+    inc = cb(group_key='code').seed(history)
+    result = inc.update(grouped.iloc[len(history):].copy())
+    expected = grouped.copy()
+    cb(group_key='code').on_preparing_data(expected)
+    pd.testing.assert_frame_equal(result, expected[names].iloc[len(history):])
+
+
+def test_incremental_Rolling_Future(mock_data):
+    data = pytest.mock_data
+    expected = data.copy()
+    rf = callbacks.Rolling_Future(5)
+    rf.on_preparing_data(expected)
+    names = rf.output_columns()
+    inc = callbacks.Rolling_Future(5).seed(data.iloc[:100])
+    columns = data.columns.tolist()
+    rows = []
+    for i in range(100, 120):
+        new = data.iloc[i:i + 1]
+        rows.append(inc.update(new))
+        assert new.columns.tolist() == columns
+    rows.append(inc.update(data.iloc[120:]))
+    assert data.columns.tolist() == columns
+    result = pd.concat(rows)
+    assert result.index.tolist() == data.index[95:len(data) - 5].tolist()
+    pd.testing.assert_frame_equal(result, expected.loc[result.index, names])
+
+    # 不支持增量计算的回调
+    with pytest.raises(ValueError):
+        cb_talib.WILLR(14).seed(data)
+    with pytest.raises(ValueError):
+        cb_talib.WILLR(14).update(data)
+
+
+def test_simulate_columns(mock_data):
+    class Opt(callbacks.CallBack):
+        def on_preparing_data(self, data, **kwargs):
+            data['opt'] = (data['sma_close_5'] > data['close']).astype(int)
+
+    def cbs():
+        return [
+            cb_talib.SMA(5),
+            callbacks.Rolling_Future(5),
+            cb_talib.BBANDS(5, 2, 2),
+            cb_talib.ATR(20),
+            cb_talib.EMA(5, col_name='sma_close_5'),
+        ]
+
+    full = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs())
+    full.simulate()
+
+    s = Simulation(pytest.mock_data, pytest.mock_code, callbacks=cbs())
+    s.simulate(columns=['ema_sma_close_5_5'])
+    expected = pytest.mock_data.columns.tolist() + [
+        'sma_close_5', 'ema_sma_close_5_5'
+    ]
+    assert s.data.columns.tolist() == ['index'] + expected
+    pd.testing.assert_frame_equal(s.data, full.data[s.data.columns])
+
+    # 未声明依赖的回调总是会被执行，并且之前所有的回调都会被执行
+    s = Simulation(pytest.mock_data, pytest.mock_code,
+                   callbacks=cbs() + [Opt()])
+    s.simulate(columns=['atr_20'])
+    assert 'opt' in s.data.columns
+    assert 'rolling_close_5_min' in s.data.columns
+
+    # 多线程计算的结果与逐个计算的结果一致
+    s = Simulation(pytest.mock_data, pytest.mock_code,
+                   callbacks=cbs() + [Opt()])
+    s.simulate(n_jobs=4)
+    full = Simulation(pytest.mock_data, pytest.mock_code,
+                      callbacks=cbs() + [Opt()])
+    full.simulate()
+    pd.testing.assert_frame_equal(s.data, full.data)
+    assert Simulation._levels(cbs()) == [[0, 1, 2, 3], [4]]
+
+
+def test_simulation_copy(mock_data):
+    cbs = [cb_talib.SMA(5), callbacks.Rolling_Future(5)]
+    data = pytest.mock_data
+    columns = data.columns.tolist()
+    s1 = Simulation(data, pytest.mock_code, callbacks=cbs)
+    s1.simulate()
+    s2 = Simulation(data, pytest.mock_code, callbacks=cbs, copy=False)
+    assert np.shares_memory(s2.data['close'].values, data['close'].values)
+    s2.simulate()
+    assert data.columns.tolist() == columns
+    assert np.shares_memory(s2.data['close'].values, data['close'].values)
+    pd.testing.assert_frame_equal(s1.data, s2.data)
+    assert not np.shares_memory(s1.data['close'].values, data['close'].values)
+
+
+@pytest.mark.parametrize('t', [1, 3, 20])
+def test_Rolling_Future_shift(t):
+    """与平移后滑动计算的结果一致，包括数据中有 nan 及数据很长的情况。"""
+    rng = np.random.default_rng(0)
+    close = rng.uniform(10000, 20000, 300000)
+    close[rng.integers(0, len(close), 50)] = np.nan
+    data = pd.DataFrame({'close': close})
+    callbacks.Rolling_Future(t).on_preparing_data(data)
+    r = data['close'].shift(-t).rolling(t)
+    for stat, expected in [('min', r.min()), ('max', r.max()),
+                           ('mean', r.mean()), ('med', r.median())]:
+        np.testing.assert_allclose(
+            data['rolling_close_{}_{}'.format(t, stat)].values,
+            expected.values,
+            rtol=1e-12,
+            equal_nan=True)
+
+
+def test_Rolling_Future_Batch(mock_data):
+    timeperiods = [5, 10, 20, 60]
+    expected = pytest.mock_data.copy()
+    for t in timeperiods:
+        callbacks.Rolling_Future(t).on_preparing_data(expected)
+    cb = callbacks.Rolling_Future_Batch(timeperiods)
+    result = pytest.mock_data.copy()
+    cb.on_preparing_data(result)
+    pd.testing.assert_frame_equal(expected, result)
+    assert result.columns.tolist()[len(pytest.mock_data.columns):] == \
+        cb.output_columns()
+
+    result = pytest.mock_data.copy()
+    callbacks.Rolling_Future_Batch(timeperiods,
+                                   stats=['max', 'mean']).on_preparing_data(result)
+    assert 'rolling_close_5_min' not in result.columns
+    assert 'rolling_close_60_max/close' in result.columns
+    pd.testing.assert_frame_equal(expected[result.columns], result)
+
+    with pytest.raises(ValueError):
+        callbacks.Rolling_Future_Batch(timeperiods, stats=['std'])
@@ -0,0 +1,149 @@
+from datetime import date as dt
+import datetime
+import functools
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from finance_tools_py import _pool
+from finance_tools_py.backtest import BackTest
+from finance_tools_py.backtest import TurtleStrategy
+from finance_tools_py.simulation import Simulation
+from finance_tools_py.simulation.callbacks.talib import ATR
+from finance_tools_py.sweep import param_grid
+from finance_tools_py.sweep import summary
+from finance_tools_py.sweep import sweep
+
+
+def _indicators(p):
+    return [ATR(p['timeperiod'])]
+
+
+def _strategy(buys, sells, p):
+    return [
+        TurtleStrategy(colname='atr_{}'.format(p['timeperiod']),
+                       buy_dict=buys,
+                       sell_dict=sells,
+                       stoploss_point=p['stoploss_point'])
+    ]
+
+
+@pytest.fixture
+def sweep_data():
+    np.random.seed(0)
+    dates = [dt(2000, 1, 1) + datetime.timedelta(days=x) for x in range(80)]
+    dfs = []
+    for code in ['000001', '000002', '000003']:
+        close = 10 + np.cumsum(np.random.normal(0, 0.3, len(dates)))
+        dfs.append(
+            pd.DataFrame({
+                'code': code,
+                'date': dates,
+                'close': close,
+                'high': close + 0.2,
+                'low': close - 0.2,
+            }))
+    data = pd.concat(dfs).sort_values('date',
+                                      kind='stable').reset_index(drop=True)
+    buys = {
+        code: [dates[i] for i in range(20, 80, 3)]
+        for code in data['code'].unique()
+    }
+    sells = {
+        code: [dates[i] for i in range(25, 80, 7)]
+        for code in data['code'].unique()
+    }
+    return data, buys, sells
+
+
+def test_param_grid():
+    assert param_grid({'a': [1, 2], 'b': [3, 4]}) == [{
+        'a': 1,
+        'b': 3
+    }, {
+        'a': 1,
+        'b': 4
+    }, {
+        'a': 2,
+        'b': 3
+    }, {
+        'a': 2,
+        'b': 4
+    }]
+    assert param_grid({'a': [1, 2], 'b': 3}) == [{
+        'a': 1,
+        'b': 3
+    }, {
+        'a': 2,
+        'b': 3
+    }]
+    assert param_grid([{'a': [1]}, {'b': 2}]) == [{'a': 1}, {'b': 2}]
+    assert param_grid({}) == [{}]
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_sweep(sweep_data, n_jobs):
+    data, buys, sells = sweep_data
+
+    def indicators(p):
+        return [ATR(p['timeperiod'])]
+
+    def strategy(p):
+        return [
+            TurtleStrategy(colname='atr_{}'.format(p['timeperiod']),
+                           buy_dict=buys,
+                           sell_dict=sells,
+                           stoploss_point=p['stoploss_point'],
+                           max_days=p['max_days'])
+        ]
+
+    grid = {
+        'timeperiod': [5, 10],
+        'stoploss_point': [1, 2],
+        'max_days': [0, 10]
+    }
+    result = sweep(data,
+                   grid,
+                   strategy,
+                   indicators=indicators,
+                   n_jobs=n_jobs,
+                   init_cash=50000)
+    assert len(result) == 8
+    assert result.columns.tolist()[:3] == [
+        'timeperiod', 'stoploss_point', 'max_days'
+    ]
+
+    for i, p in enumerate(param_grid(grid)):
+        dfs = []
+        for code, df in data.groupby('code', sort=False):
+            s = Simulation(df, code, callbacks=indicators(p))
+            s.simulate(reset_index=False)
+            dfs.append(s.data)
+        df = pd.concat(dfs).loc[data.index]
+        bt = BackTest(df, init_cash=50000, callbacks=strategy(p))
+        bt.calc_trade_history()
+        expected = summary(bt)
+        assert expected['trades'] > 0
+        for k, v in expected.items():
+            assert result[k].iloc[i] == pytest.approx(v)
+
+
+def test_sweep_spawn(sweep_data, monkeypatch):
+    data, buys, sells = sweep_data
+    grid = {'timeperiod': [5, 10], 'stoploss_point': [1, 2]}
+    strategy = functools.partial(_strategy, buys, sells)
+    expected = sweep(data, grid, strategy, indicators=_indicators,
+                     init_cash=50000)
+    monkeypatch.setattr(_pool, '_start_method', 'spawn')
+    with warnings.catch_warnings():
+        # 模块级函数可以被序列化，在子进程中计算
+        warnings.simplefilter('error', UserWarning)
+        result = sweep(data, grid, strategy, indicators=_indicators,
+                       n_jobs=2, init_cash=50000)
+    pd.testing.assert_frame_equal(result, expected)
+
+    # 无法序列化的函数在当前进程中计算
+    with pytest.warns(UserWarning):
+        result = sweep(data, grid, lambda p: strategy(p),
+                       indicators=_indicators, n_jobs=2, init_cash=50000)
+    pd.testing.assert_frame_equal(result, expected)
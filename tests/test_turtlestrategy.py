@@ -1,4 +1,5 @@
 from finance_tools_py.backtest import TurtleStrategy
+from finance_tools_py.backtest import HoldBook
 import pandas as pd
 import datetime
 
@@ -529,3 +530,90 @@ def test_TurtleStrategy_MaxDays():
                                   verbose=2) == 100
     assert sum([h.amount for h in ts.holds[symbol]]) == 100
     assert ts.holds[symbol][0].price == 20
+
+
+def test_HoldBook():
+    symbol = '0'
+    book = HoldBook(symbol, [
+        TurtleStrategy.Hold(symbol, datetime.date(1999, 1, 1), 10, 100, 9, 11,
+                            10.5)
+    ])
+    book.append(datetime.date(1999, 1, 2), 10.5, 200, 9.5, -1, 11)
+    book.append(datetime.date(1999, 1, 3), 11, 100, -1, 12, 11.5)
+    assert len(book) == 3
+    assert book.amount == 400
+    assert [h.amount for h in book] == [100, 200, 100]
+    assert book[-1].next_price == 11.5
+
+    assert not book.hit_stoploss(9.6)
+    assert book.hit_stoploss(9.5)
+    assert book.stoploss_amount(9) == 300
+    assert not book.hit_stopprofit(10.9)
+    assert book.hit_stopprofit(11)
+    assert book.stopprofit_amount(12) == 200
+    assert not book.hit_overdue(datetime.date(1999, 1, 5),
+                                datetime.timedelta(days=5))
+    assert book.hit_overdue(datetime.date(1999, 1, 6),
+                            datetime.timedelta(days=5))
+    assert [
+        h.date for h in book.overdue(datetime.date(1999, 1, 7),
+                                     datetime.timedelta(days=5))
+    ] == [datetime.date(1999, 1, 1), datetime.date(1999, 1, 2)]
+
+    book.update_last(stopprofit_price=13, next_price=12)
+    assert book[-1].stopprofit_price == 13
+    assert book[-1].next_price == 12
+    assert book.stopprofit_amount(12) == 100
+
+    assert book.pop_stoploss(9.6) == 0
+    assert book.pop_stoploss(9.5) == 200
+    assert book.amount == 200
+    assert [h.price for h in book] == [10, 11]
+
+    assert book.reduce_first(50) == 0
+    assert book.amount == 150
+    assert book.reduce_first(100) == 50
+    assert len(book) == 1
+    assert book.pop_overdue(datetime.date(1999, 1, 8),
+                            datetime.timedelta(days=5)) == 100
+    assert not book
+    assert book.amount == 0
+    assert not book.hit_stoploss(0)
+
+
+def test_Hold_frame():
+    holds = {
+        '0': [
+            TurtleStrategy.Hold('0', pd.Timestamp('1999-01-01'), 10, 100, 9,
+                                11, 10.5),
+            TurtleStrategy.Hold('0', pd.Timestamp('1999-01-02'), 10.5, 200,
+                                9.5, 12, 11)
+        ],
+        '1': HoldBook('1')
+    }
+    holds['1'].append(pd.Timestamp('1999-01-03'), 20, 300, -1, -1, -1)
+    df = TurtleStrategy.Hold.to_frame(holds)
+    assert df.columns.tolist() == [
+        'code', 'amount', 'price', 'buy_date', 'stoploss_price',
+        'stopprofit_price', 'next_price'
+    ]
+    assert df['code'].tolist() == ['0', '0', '1']
+    assert df['amount'].tolist() == [100, 200, 300]
+    assert df['buy_date'].tolist() == [
+        pd.Timestamp('1999-01-01'),
+        pd.Timestamp('1999-01-02'),
+        pd.Timestamp('1999-01-03')
+    ]
+    assert df['next_price'].tolist() == [10.5, 11, -1]
+
+    result = TurtleStrategy.Hold.from_frame(df)
+    assert list(result.keys()) == ['0', '1']
+    for symbol, hs in holds.items():
+        assert [str(h) for h in result[symbol]] == [str(h) for h in hs]
+
+    result = TurtleStrategy.Hold.from_frame(df[['code', 'amount', 'price',
+                                                'buy_date']])
+    assert result['0'][0].stoploss_price == -1
+    assert TurtleStrategy.Hold.from_frame(pd.DataFrame()) == {}
+    assert TurtleStrategy.Hold.to_frame({}).empty
+    assert not hasattr(holds['0'][0], '__dict__')
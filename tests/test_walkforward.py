@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+from finance_tools_py._jupyter_helper import all_years
+from finance_tools_py.calc import fluidity
+from finance_tools_py.simulation.callbacks import CallBack
+from finance_tools_py.simulation.callbacks.talib import ATR
+from finance_tools_py.walkforward import WalkForward
+
+
+class CALC_OPT(CallBack):
+    def on_preparing_data(self, data, **kwargs):
+        mean = data['close'].rolling(10).mean()
+        data['opt'] = np.NaN
+        data.loc[data['close'] > mean * 1.01, 'opt'] = 1
+        data.loc[data['close'] < mean * 0.99, 'opt'] = 0
+
+
+@pytest.fixture
+def fulldata():
+    np.random.seed(0)
+    dates = pd.bdate_range('2005-01-01', '2008-12-31')
+    dfs = []
+    for i in range(8):
+        close = 10 + i + np.cumsum(np.random.normal(0, 0.2, len(dates)))
+        close = np.maximum(close, 1)
+        df = pd.DataFrame({
+            'code': '00000{}'.format(i),
+            'date': dates,
+            'close': close,
+            'high': close + np.random.uniform(0.05, 0.3, len(dates)),
+            'low': close - np.random.uniform(0.05, 0.3, len(dates)),
+            'amount': np.random.uniform(1, 100, len(dates)) * (i + 1),
+        })
+        df['rets'] = df['close'].pct_change()
+        dfs.append(df)
+    data = pd.concat(dfs).sort_values('date', kind='stable')
+    return data.set_index(['code', 'date'])
+
+
+def test_segments(fulldata):
+    wf = WalkForward(fulldata, [],
+                     start_year=2005,
+                     end_year=2008,
+                     lookback=2,
+                     tb_kwgs={'colname': 'atr_20'})
+    assert wf.segments() == [([2005, 2006], 2007), ([2006, 2007], 2008)]
+    assert wf.panel.data['code'].is_monotonic_increasing
+    df = wf.panel.slice('000003', pd.Timestamp('2006-01-01'),
+                         pd.Timestamp('2006-12-31'))
+    expected = fulldata.loc['000003'].loc['2006-01-01':'2006-12-31']
+    np.testing.assert_array_equal(df['close'].values, expected['close'].values)
+    assert len(wf.panel.window(pd.Timestamp('2006-01-01'),
+                                pd.Timestamp('2006-12-31'))) == 8 * len(df)
+
+
+@pytest.mark.parametrize('fixed_unit', [True, False])
+def test_walkforward(fulldata, fixed_unit):
+    wf = WalkForward(fulldata, [ATR(20), CALC_OPT()],
+                     start_year=2005,
+                     end_year=2008,
+                     top=3,
+                     tb_kwgs={'colname': 'atr_20'},
+                     fixed_unit=fixed_unit,
+                     unit_percent=0.01)
+    results = [
+        wf.run(init_cash=1000000, n_jobs=n_jobs) for n_jobs in [1, 2]
+    ]
+    (df_profit, report, datas, buys, sells), other = results
+    assert list(report.keys()) == [2006, 2007, 2008]
+    pd.testing.assert_frame_equal(df_profit, other[0])
+    for year, bt in report.items():
+        assert len(bt.history) > 0
+        assert bt.total_assets_cur == pytest.approx(
+            other[1][year].total_assets_cur)
+        pd.testing.assert_frame_equal(datas[year], other[2][year])
+
+        # 回测的股票为回看期间流动性排名靠前的股票及上一年度的持仓股票
+        look = fulldata[(fulldata.index.get_level_values(1).year == year - 1)]
+        top = fluidity(look).index[:3].tolist()
+        assert set(top) <= set(datas[year]['code'])
+        assert set(buys[year].keys()) <= set(top)
+        assert datas[year]['date'].min().year == year
+        assert datas[year]['date'].is_monotonic_increasing
+
+
+def test_walkforward_cache(fulldata):
+    from finance_tools_py.simulation.cache import IndicatorCache
+    kwargs = dict(start_year=2005,
+                  end_year=2008,
+                  top=3,
+                  tb_kwgs={'colname': 'atr_20'},
+                  fixed_unit=False)
+    expected = WalkForward(fulldata, [ATR(20), CALC_OPT()],
+                           **kwargs).run(init_cash=1000000)
+    cache = IndicatorCache()
+    result = WalkForward(fulldata, [ATR(20), CALC_OPT()], cache=cache,
+                         **kwargs).run(init_cash=1000000)
+    pd.testing.assert_frame_equal(expected[0], result[0])
+    for year in expected[2]:
+        pd.testing.assert_frame_equal(expected[2][year], result[2][year])
+    # 回测的股票直接使用计算头寸单位时缓存的ATR(20)
+    assert cache.hits >= 3 * len(expected[1])
+
+
+def test_walkforward_all_years(fulldata):
+    kwargs = dict(start_year=2005,
+                  end_year=2008,
+                  top=3,
+                  tb_kwgs={
+                      'colname': 'atr_20',
+                      'max_days': 20
+                  },
+                  fixed_unit=False,
+                  unit_percent=0.01)
+    _, report, datas, buys, sells = WalkForward(
+        fulldata, [ATR(20), CALC_OPT()], **kwargs).run(init_cash=1000000,
+                                                       n_jobs=2)
+    _, expected, _, expected_buys, _ = all_years(fulldata, [ATR(20), CALC_OPT()],
+                                                 init_cash=1000000,
+                                                 verbose=0,
+                                                 show_report=False,
+                                                 show_plot=False,
+                                                 **kwargs)
+    assert list(report.keys()) == list(expected.keys())
+    for year, bt in expected.items():
+        assert len(report[year].history) == len(bt.history)
+        assert report[year].available_cash == pytest.approx(bt.available_cash)
+        assert report[year].total_assets_cur == pytest.approx(
+            bt.total_assets_cur)
+        assert sorted(buys[year].keys()) == sorted(expected_buys[year].keys())
+
+
+def test_walkforward_all_years_streaming(fulldata, monkeypatch):
+    import finance_tools_py._jupyter_helper as helper
+    events = []
+    wf_iter_run = WalkForward.iter_run
+
+    def iter_run(self, *args, **kwargs):
+        for result in wf_iter_run(self, *args, **kwargs):
+            events.append(('run', result[0]))
+            yield result
+
+    monkeypatch.setattr(WalkForward, 'iter_run', iter_run)
+    monkeypatch.setattr(helper, '_show_year',
+                        lambda bt, *args: events.append(('show', bt)))
+    _, report, _, _, _ = all_years(fulldata, [ATR(20), CALC_OPT()],
+                                   init_cash=1000000,
+                                   start_year=2005,
+                                   end_year=2008,
+                                   top=3,
+                                   tb_kwgs={'colname': 'atr_20'},
+                                   verbose=0)
+    # 每个年度回测完成后立即显示，不等待所有年度计算完成
+    assert [e[0] for e in events] == ['run', 'show'] * len(report)